@@ -3,7 +3,7 @@
 function print_usage() {
   echo -n "Usage: $1 -f <file_containing_list_of_git_urls>"
   echo -n " -o <output_file_to_store_csv_data>"
-  echo " -t <git_access_token>"
+  echo " -t <git_access_token> [-t <another_git_access_token> ...]"
   echo "Optional:"
   if ! command -v nproc &> /dev/null
   then
@@ -33,7 +33,7 @@ do
     f) GIT_URL_FILE=${OPTARG};;
     o) OUTPUT_CSV_FILE=${OPTARG};;
     n) NUM_PROCS=${OPTARG};;
-    t) TOKEN=${OPTARG}
+    t) TOKEN="${TOKEN} ${OPTARG}"
   esac
 done
 
@@ -44,42 +44,8 @@ fi
 
 CURRENT_DIR=`dirname $0`
 
-function get_metadata_of_single_repo() {
-  repo_url=$1
-  token=$2
-  output_csv=$3
-  tmp_dir_to_clone_repo=`mktemp -d`
-  python3 ${CURRENT_DIR}/../src/get_metadata_of_single_repo.py -r ${repo_url} -t ${token} -d ${tmp_dir_to_clone_repo} -p >> ${output_csv}
-  rm -rf ${tmp_dir_to_clone_repo}
-}
-export -f get_metadata_of_single_repo
-export CURRENT_DIR
-
-# Generate CSV header using a repo
-python3 src/get_metadata_of_single_repo.py -t ${TOKEN} -r https://github.com/nirhasabnis/gitrank -d `mktemp -d` | head -n 1 > ${OUTPUT_CSV_FILE}
-
-if ! command -v parallel &> /dev/null
-then
-  echo "GNU Parallel does not exist. Invoking serial dump.."
-  for git_url in `cat $GIT_URL_FILE`;
-  do
-    echo "Processing " ${git_url}
-    get_metadata_of_single_repo ${git_url} ${TOKEN} ${OUTPUT_CSV_FILE}
-  done
-else
-  echo "GNU Parallel exists. Invoking parallel dump.."
-  TMP_DIR=`mktemp -d`
-
-  cat ${GIT_URL_FILE} | parallel --eta --bar --progress \
-    -I% -j${NUM_PROCS} get_metadata_of_single_repo % ${TOKEN} ${TMP_DIR}/proc_{%}.csv
-
-  for i in `seq 1 $NUM_PROCS`;
-  do
-    if [ -f ${TMP_DIR}/proc_${i}.csv ]
-    then
-      cat ${TMP_DIR}/proc_${i}.csv >> ${OUTPUT_CSV_FILE}
-    fi
-  done
-
-  rm -rf {TMP_DIR}
-fi
\ No newline at end of file
+# Tokens are not quoted below, so that every token given with -t is passed on.
+# Repositories are processed by a pool of long-lived Python workers, so modules are imported only once
+# per worker and CSV header comes from the metric schema instead of from a sample repository.
+python3 ${CURRENT_DIR}/../src/get_repo_metadata_in_batch.py -f ${GIT_URL_FILE} -o ${OUTPUT_CSV_FILE} \
+  -n ${NUM_PROCS} -t ${TOKEN}
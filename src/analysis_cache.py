@@ -0,0 +1,182 @@
+#! /usr/bin/env python3
+
+# MIT License
+# 
+# Copyright (c) 2022 Niranjan Hasabnis
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import hashlib
+import json
+import os
+import sqlite3
+import subprocess
+
+import tracing
+
+class AnalysisCache(object):
+  ''' Per-file analysis results keyed by analyzer, analyzer version and git blob SHA of the file.
+      Identical files in different repositories (e.g., vendored googletest) are thus analyzed once.
+      Results are stored as JSON in a SQLite database that can be shared by concurrent processes.
+      Analyzers whose results depend on more than contents of a file key them by a hash of all it depends
+      on instead of blob SHA. '''
+
+  # Number of host parameters per SQL query; SQLite's default limit is 999.
+  query_batch_size = 500
+
+  def __init__(self, db_file_name):
+    self.connection = sqlite3.connect(db_file_name, timeout=60)
+    self.connection.execute('PRAGMA journal_mode=WAL')
+    with self.connection:
+      self.connection.execute('CREATE TABLE IF NOT EXISTS file_results ('
+                              'analyzer TEXT NOT NULL, analyzer_version TEXT NOT NULL, blob_sha TEXT NOT NULL, '
+                              'result TEXT NOT NULL, PRIMARY KEY (analyzer, analyzer_version, blob_sha))')
+
+  def get_results(self, analyzer, analyzer_version, blob_shas):
+    ''' Returns dictionary from blob SHA to result for blobs that have a cached result '''
+    results = dict()
+    unique_blob_shas = list(set(blob_shas))
+    for i in range(0, len(unique_blob_shas), self.query_batch_size):
+      batch = unique_blob_shas[i : i + self.query_batch_size]
+      rows = self.connection.execute('SELECT blob_sha, result FROM file_results '
+                                     'WHERE analyzer = ? AND analyzer_version = ? AND blob_sha IN (' +
+                                     ','.join('?' * len(batch)) + ')', [analyzer, analyzer_version] + batch)
+      for blob_sha, result in rows:
+        results[blob_sha] = json.loads(result)
+    return results
+
+  def put_results(self, analyzer, analyzer_version, results_by_blob_sha):
+    with self.connection:
+      self.connection.executemany('INSERT OR REPLACE INTO file_results VALUES (?, ?, ?, ?)',
+                                  [(analyzer, analyzer_version, blob_sha, json.dumps(result))
+                                   for blob_sha, result in results_by_blob_sha.items()])
+
+  def analyze_files(self, analyzer, analyzer_version, analyze_files_fn, blob_shas_by_file):
+    ''' Returns dictionary from file name to result for all files in blob_shas_by_file. Only files whose
+        blob has no cached result are analyzed by analyze_files_fn, which takes list of file names and
+        yields (file name, result) pairs. '''
+    cached_results = self.get_results(analyzer, analyzer_version, blob_shas_by_file.values())
+    # Analyze one file per unseen blob; its copies in the repository reuse that result.
+    files_to_analyze = dict()
+    for file_name, blob_sha in blob_shas_by_file.items():
+      if blob_sha not in cached_results and blob_sha not in files_to_analyze:
+        files_to_analyze[blob_sha] = file_name
+    new_results = dict()
+    if len(files_to_analyze) > 0:
+      results_by_file = dict(analyze_files_fn(list(files_to_analyze.values())))
+      new_results = {blob_sha: results_by_file[file_name] for blob_sha, file_name in files_to_analyze.items()
+                     if file_name in results_by_file}
+      self.put_results(analyzer, analyzer_version, new_results)
+    cached_results.update(new_results)
+    return {file_name: cached_results[blob_sha] for file_name, blob_sha in blob_shas_by_file.items()
+            if blob_sha in cached_results}
+
+def get_blob_sha_of_file(file_name):
+  ''' Returns SHA that git would assign to contents of file_name as a blob '''
+  with open(file_name, 'rb') as input_file:
+    contents = input_file.read()
+  return hashlib.sha1(b'blob ' + str(len(contents)).encode('ascii') + b'\0' + contents).hexdigest()
+
+def get_blob_shas(repo_directory, file_names):
+  ''' Returns dictionary from file name to its blob SHA. SHAs of regular files tracked by git come from
+      git index without reading the files; other files are hashed. '''
+  blob_shas_in_index = dict()
+  try:
+    with tracing.span('git_ls_files'):
+      output = subprocess.check_output(['git', '-C', repo_directory, 'ls-files', '--stage', '-z'],
+                                       stderr=subprocess.DEVNULL)
+    for entry in output.split(b'\0'):
+      # Entry format: "<mode> <blob_sha> <stage>\t<path>"
+      if entry == b'':
+        continue
+      entry_info, _, path = entry.partition(b'\t')
+      mode, blob_sha, _ = entry_info.split(b' ')
+      # Symbolic links and submodules do not have file contents as blobs.
+      if mode.startswith(b'100'):
+        blob_shas_in_index[os.path.normpath(os.path.join(repo_directory, os.fsdecode(path)))] = blob_sha.decode('ascii')
+  except (subprocess.CalledProcessError, OSError):
+    pass
+
+  blob_shas = dict()
+  for file_name in file_names:
+    blob_sha = blob_shas_in_index.get(os.path.normpath(file_name))
+    blob_shas[file_name] = blob_sha if blob_sha is not None else get_blob_sha_of_file(file_name)
+  return blob_shas
+
+class IncrementalState(object):
+  ''' Per-repository record of last analyzed commit and code metrics obtained for it, along with per-file
+      results of every analyzer and their sums. Later runs on the repository then analyze only files that
+      changed since, and update the sums by subtracting old and adding new per-file contributions. '''
+
+  def __init__(self, db_file_name):
+    self.connection = sqlite3.connect(db_file_name, timeout=60)
+    self.connection.execute('PRAGMA journal_mode=WAL')
+    with self.connection:
+      self.connection.execute('CREATE TABLE IF NOT EXISTS analyzed_commits ('
+                              'repo_url TEXT PRIMARY KEY, commit_sha TEXT NOT NULL, analyzer_versions TEXT NOT NULL, '
+                              'metrics TEXT NOT NULL)')
+      self.connection.execute('CREATE TABLE IF NOT EXISTS analyzer_totals ('
+                              'repo_url TEXT NOT NULL, analyzer TEXT NOT NULL, analyzer_version TEXT NOT NULL, '
+                              'totals TEXT NOT NULL, PRIMARY KEY (repo_url, analyzer))')
+      self.connection.execute('CREATE TABLE IF NOT EXISTS file_results ('
+                              'repo_url TEXT NOT NULL, analyzer TEXT NOT NULL, file_name TEXT NOT NULL, '
+                              'blob_sha TEXT NOT NULL, result TEXT NOT NULL, PRIMARY KEY (repo_url, analyzer, file_name))')
+
+  def get_analyzed_commit(self, repo_url, analyzer_versions):
+    ''' Returns last analyzed commit of repository and code metrics obtained for it, or (None, None) if
+        repository was not analyzed before with the same analyzer versions '''
+    row = self.connection.execute('SELECT commit_sha, analyzer_versions, metrics FROM analyzed_commits '
+                                  'WHERE repo_url = ?', [repo_url]).fetchone()
+    if row is None or json.loads(row[1]) != analyzer_versions:
+      return None, None
+    return row[0], json.loads(row[2])
+
+  def set_analyzed_commit(self, repo_url, commit_sha, analyzer_versions, metrics):
+    with self.connection:
+      self.connection.execute('INSERT OR REPLACE INTO analyzed_commits VALUES (?, ?, ?, ?)',
+                              [repo_url, commit_sha, json.dumps(analyzer_versions), json.dumps(metrics)])
+
+  def get_file_results(self, repo_url, analyzer, analyzer_version):
+    ''' Returns dictionary from file name (relative to repository root) to its blob SHA and result, and
+        sums of per-file contributions. Both are empty if analyzer version changed since last run. '''
+    row = self.connection.execute('SELECT analyzer_version, totals FROM analyzer_totals '
+                                  'WHERE repo_url = ? AND analyzer = ?', [repo_url, analyzer]).fetchone()
+    if row is None or row[0] != analyzer_version:
+      return dict(), dict()
+    rows = self.connection.execute('SELECT file_name, blob_sha, result FROM file_results '
+                                   'WHERE repo_url = ? AND analyzer = ?', [repo_url, analyzer])
+    return {file_name: (blob_sha, json.loads(result)) for file_name, blob_sha, result in rows}, json.loads(row[1])
+
+  def update_file_results(self, repo_url, analyzer, analyzer_version, removed_file_names, new_results, totals):
+    ''' Replaces results of removed_file_names by new_results (dictionary from file name to its blob SHA and
+        result) and records new totals, all in one transaction '''
+    with self.connection:
+      row = self.connection.execute('SELECT analyzer_version FROM analyzer_totals '
+                                    'WHERE repo_url = ? AND analyzer = ?', [repo_url, analyzer]).fetchone()
+      if row is not None and row[0] != analyzer_version:
+        # Results of older analyzer version are stale.
+        self.connection.execute('DELETE FROM file_results WHERE repo_url = ? AND analyzer = ?', [repo_url, analyzer])
+      self.connection.executemany('DELETE FROM file_results WHERE repo_url = ? AND analyzer = ? AND file_name = ?',
+                                  [(repo_url, analyzer, file_name) for file_name in removed_file_names])
+      self.connection.executemany('INSERT OR REPLACE INTO file_results VALUES (?, ?, ?, ?, ?)',
+                                  [(repo_url, analyzer, file_name, blob_sha, json.dumps(result))
+                                   for file_name, (blob_sha, result) in new_results.items()])
+      self.connection.execute('INSERT OR REPLACE INTO analyzer_totals VALUES (?, ?, ?, ?)',
+                              [repo_url, analyzer, analyzer_version, json.dumps(totals)])
@@ -0,0 +1,89 @@
+#! /usr/bin/env python3
+
+# MIT License
+# 
+# Copyright (c) 2022 Niranjan Hasabnis
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import fcntl
+import json
+import os
+import sys
+import time
+
+class BatchJournal(object):
+  ''' Append-only journal of a batch run, with a JSON line per completed repository (holding its CSV row) and
+      per failed attempt on a repository. Every record is written with a single write to a file opened for
+      appending and synced to disk before the next repository is started on, so a crashed or killed run can
+      be restarted without losing completed repositories. Journal is locked while in use, so that runs do not
+      share it; BlockingIOError is raised if another run holds it. '''
+
+  def __init__(self, journal_file_name):
+    self.journal_file_name = journal_file_name
+    # Rows of completed repositories in order of completion, and last failure of other repositories
+    self.rows = dict()
+    self.failures = dict()
+    self.journal_fd = os.open(journal_file_name, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+      fcntl.flock(self.journal_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+      os.close(self.journal_fd)
+      raise
+    self.read_journal()
+
+  def read_journal(self):
+    with open(self.journal_file_name, 'rb') as journal_file:
+      contents = journal_file.read()
+    # Last record may have been cut short by a crash; it is dropped, so that next record starts on a new line.
+    end_of_last_record = contents.rfind(b'\n') + 1
+    if end_of_last_record < len(contents):
+      print('Dropping incomplete last record of', self.journal_file_name, file=sys.stderr)
+      os.truncate(self.journal_file_name, end_of_last_record)
+    for line in contents[:end_of_last_record].splitlines():
+      record = json.loads(line)
+      if record['status'] == 'done':
+        self.rows[record['repository']] = record['row']
+        self.failures.pop(record['repository'], None)
+      elif record['repository'] not in self.rows:
+        self.failures[record['repository']] = record
+
+  def append(self, record):
+    record['time'] = round(time.time(), 3)
+    os.write(self.journal_fd, (json.dumps(record) + '\n').encode('utf-8'))
+    os.fsync(self.journal_fd)
+
+  def record_row(self, repo_url, row):
+    self.append({'repository': repo_url, 'status': 'done', 'row': row})
+    self.rows[repo_url] = row
+    self.failures.pop(repo_url, None)
+
+  def record_failure(self, repo_url, stage, error, attempt, timed_out=False):
+    ''' Records failed attempt on a repository at given stage (fetch, clone or analysis) '''
+    record = {'repository': repo_url, 'status': 'timeout' if timed_out else 'failed', 'stage': stage,
+              'error': error, 'attempt': attempt}
+    self.append(record)
+    self.failures[repo_url] = record
+
+  def is_done(self, repo_url):
+    return repo_url in self.rows
+
+  def close(self):
+    os.close(self.journal_fd)
@@ -0,0 +1,384 @@
+#! /usr/bin/env python3
+
+# MIT License
+# 
+# Copyright (c) 2022 Niranjan Hasabnis
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import argparse
+import csv
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import get_metadata_of_single_repo as single_repo
+import metrics_file
+from file_manifest import FileManifest
+
+src_directory = os.path.dirname(os.path.abspath(__file__))
+
+# Owner of generated repositories, which are cloned as https://github.com/<owner>/<name>
+benchmark_owner = 'gitrank-benchmark'
+
+# Commits of generated repositories have fixed authors and dates, so that same parameters give same commit SHAs.
+_git_environment = {'GIT_AUTHOR_NAME': 'GitRank Benchmark', 'GIT_AUTHOR_EMAIL': 'benchmark@example.com',
+                    'GIT_AUTHOR_DATE': '2020-01-01T00:00:00Z',
+                    'GIT_COMMITTER_NAME': 'GitRank Benchmark', 'GIT_COMMITTER_EMAIL': 'benchmark@example.com',
+                    'GIT_COMMITTER_DATE': '2020-01-01T00:00:00Z'}
+
+# Benchmarks that take less than this many seconds more than their baseline are not reported as regressions,
+# as such differences are mostly noise.
+min_regression_seconds = 0.05
+
+def generate_function(rng, name, num_lines):
+  ''' Returns lines of a C function of about num_lines lines with branches and loops, and with calls and
+      formatting that flawfinder and cpplint report '''
+  lines = ['int %s(int n, char *buffer, const char *input) {' % name, '  int result = 0;']
+  while len(lines) < num_lines - 2:
+    kind = rng.random()
+    if kind < 0.3:
+      lines += ['  if (n > %d) {' % rng.randint(0, 100), '    result += n * %d;' % rng.randint(1, 9), '  }']
+    elif kind < 0.5:
+      lines += ['  for (int i = 0; i < n; i++) {', '    result ^= i + %d;' % rng.randint(1, 9), '  }']
+    elif kind < 0.6:
+      lines.append('  strcpy(buffer, input);')
+    elif kind < 0.7:
+      lines.append('  sprintf(buffer, "%%d", result + %d);' % rng.randint(0, 9))
+    elif kind < 0.8:
+      lines.append('  if(n < %d) result--;' % rng.randint(0, 100))
+    else:
+      lines.append('  result = result * %d + n;' % rng.randint(2, 9))
+  return lines + ['  return result;', '}']
+
+def generate_source_file(rng, functions_per_file, lines_per_function):
+  lines = ['/* Generated by benchmark.py */', '#include <stdio.h>', '#include <string.h>', '']
+  for _ in range(functions_per_file):
+    lines += generate_function(rng, 'function_%08x' % rng.getrandbits(32), lines_per_function) + ['']
+  return '\n'.join(lines)
+
+def get_repository_name(num_files, functions_per_file, lines_per_function, duplication_ratio, seed):
+  return 'files%d_functions%d_lines%d_dup%g_seed%d' % (num_files, functions_per_file, lines_per_function,
+                                                      duplication_ratio, seed)
+
+def generate_repository(repo_dir, num_files, functions_per_file, lines_per_function, duplication_ratio, seed):
+  ''' Creates a git repository in repo_dir with num_files C/C++ files, of which duplication_ratio are copies
+      of other files (as with vendored libraries), and an MIT license. Repository only depends on
+      parameters. '''
+  rng = random.Random(seed)
+  num_unique_files = max(1, round(num_files * (1 - duplication_ratio)))
+  contents = []
+  for i in range(num_files):
+    if i < num_unique_files:
+      contents.append(generate_source_file(rng, functions_per_file, lines_per_function))
+    else:
+      contents.append(contents[rng.randrange(num_unique_files)])
+  os.makedirs(repo_dir)
+  for i, content in enumerate(contents):
+    # 20 files per directory, in modules of C sources, C++ sources and headers
+    file_name = os.path.join(repo_dir, 'module_%d' % (i // 20), 'file_%d' % i + ['.c', '.cpp', '.h'][i % 3])
+    os.makedirs(os.path.dirname(file_name), exist_ok=True)
+    with open(file_name, 'w') as output_file:
+      output_file.write(content)
+  shutil.copy(os.path.join(src_directory, '..', 'LICENSE'), os.path.join(repo_dir, 'LICENSE'))
+  environment = dict(os.environ, **_git_environment)
+  for command in [['init', '-q'], ['add', '-A'], ['commit', '-q', '-m', 'Generated repository']]:
+    subprocess.run(['git', '-C', repo_dir] + command, env=environment, check=True)
+
+def get_repository(repositories_dir, *parameters):
+  ''' Returns directory of generated repository with given parameters, generating it if needed '''
+  repo_dir = os.path.join(repositories_dir, benchmark_owner, get_repository_name(*parameters))
+  if not os.path.isdir(os.path.join(repo_dir, '.git')):
+    shutil.rmtree(repo_dir, ignore_errors=True)
+    generate_repository(repo_dir, *parameters)
+  return repo_dir
+
+def generate_metrics_csv_file(csv_file_name, num_rows, seed):
+  ''' Writes CSV file of phase-1 metrics of num_rows made-up repositories, about 3% of them with an error (-1) '''
+  rng = random.Random(seed)
+  metric_fields = single_repo.metric_fields
+  with open(csv_file_name, 'w', newline='') as csv_file:
+    writer = csv.writer(csv_file)
+    writer.writerow(metric_fields)
+    for i in range(num_rows):
+      row = dict()
+      for field in metric_fields:
+        if field == 'repository_owner':
+          row[field] = 'owner%d' % (i % 1000)
+        elif field == 'repository_uri':
+          row[field] = 'https://github.com/owner%d/repository%d' % (i % 1000, i)
+        elif field == 'created_at':
+          row[field] = '2019-08-01T10:25:51Z'
+        elif field == 'repo_age_in_days':
+          row[field] = str(rng.randint(1, 4000))
+        elif field == 'is_valid_license':
+          row[field] = str(rng.randint(0, 1))
+        elif field.endswith('_per_nloc'):
+          row[field] = str(round(rng.random() * 0.2, 3))
+        elif field.startswith('average'):
+          row[field] = str(round(rng.uniform(1, 150), 2))
+        else:
+          row[field] = str(rng.randint(0, 2000))
+      if rng.random() < 0.03:
+        row[rng.choice(metric_fields[2:])] = '-1'
+      writer.writerow([row[field] for field in metric_fields])
+
+def get_metrics_csv_file(data_dir, num_rows, seed):
+  csv_file_name = os.path.join(data_dir, 'metrics_%d_seed%d.csv' % (num_rows, seed))
+  if not os.path.exists(csv_file_name):
+    generate_metrics_csv_file(csv_file_name + '.tmp', num_rows, seed)
+    os.replace(csv_file_name + '.tmp', csv_file_name)
+  return csv_file_name
+
+class GitHubStubHandler(BaseHTTPRequestHandler):
+  ''' Answers GraphQL queries of github_graphql.py with fixed metadata for every repository, so that
+      metadata extraction runs without network access. REST requests are not supported. '''
+
+  def do_POST(self):
+    query = json.loads(self.rfile.read(int(self.headers['Content-Length'])))['query']
+    data = {'rateLimit': {'cost': 1, 'remaining': 4999, 'resetAt': '2030-01-01T00:00:00Z'}}
+    for line in query.split('\n'):
+      alias, _, field = line.strip().partition(': ')
+      if field.startswith('repository('):
+        data[alias] = {'stargazerCount': 100, 'forkCount': 10, 'createdAt': '2020-01-01T00:00:00Z',
+                       'watchers': {'totalCount': 5}, 'openIssues': {'totalCount': 3},
+                       'openPullRequests': {'totalCount': 2}, 'parent': None,
+                       'defaultBranchRef': {'target': {'history': {'totalCount': 50}}}}
+      elif field.startswith('search('):
+        data[alias] = {'issueCount': 7}
+    self.send_json({'data': data})
+
+  def do_GET(self):
+    self.send_json({'message': 'Not Found'}, 404)
+
+  def send_json(self, response, status=200):
+    body = json.dumps(response).encode('utf-8')
+    self.send_response(status)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, *args):
+    pass
+
+def start_github_stub():
+  ''' Starts GitHub stub on a free local port in a background thread and returns its GraphQL URL '''
+  server = ThreadingHTTPServer(('127.0.0.1', 0), GitHubStubHandler)
+  threading.Thread(target=server.serve_forever, daemon=True).start()
+  return 'http://127.0.0.1:%d/graphql' % server.server_port
+
+def time_function(fn, repeat):
+  ''' Returns wall times of repeat calls of fn '''
+  wall_times = []
+  for _ in range(repeat):
+    start_time = time.perf_counter()
+    fn()
+    wall_times.append(time.perf_counter() - start_time)
+  return wall_times
+
+# Runs command given as arguments and prints its wall time and peak memory (KB) of its largest process. A child
+# process starts with memory of its parent, so peak memory is measured from this small process rather than
+# from benchmark process.
+_measuring_script = '''
+import resource, subprocess, sys, time
+start_time = time.perf_counter()
+returncode = subprocess.call(sys.argv[1:], stdout=subprocess.DEVNULL)
+print(time.perf_counter() - start_time, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+sys.exit(returncode)
+'''
+
+def run_process(command, environment=None):
+  ''' Runs command and returns its wall time and peak memory (MB) '''
+  process = subprocess.run([sys.executable, '-c', _measuring_script] + command, stdout=subprocess.PIPE,
+                           env=environment, check=True)
+  wall_time, peak_rss_kb = process.stdout.split()
+  # ru_maxrss is in KB on Linux.
+  return float(wall_time), int(peak_rss_kb) / 1024
+
+def get_result(wall_times, peak_rss_mb=None):
+  result = {'wall_time': round(statistics.median(wall_times), 4), 'min_wall_time': round(min(wall_times), 4)}
+  if peak_rss_mb is not None:
+    result['peak_rss_mb'] = round(peak_rss_mb, 1)
+  return result
+
+def benchmark_phase_1(work_dir, results):
+  ''' Times every analyzer stage, in this process, and metadata extraction of a repository, end to end, for
+      generated repositories of every size '''
+  repositories_dir = os.path.join(work_dir, 'repositories')
+  single_repo_parser = argparse.ArgumentParser()
+  single_repo.add_common_arguments(single_repo_parser)
+  single_repo.args = single_repo_parser.parse_args(['-t', 'benchmark', '-w', str(args.workers)])
+  graphql_url = start_github_stub()
+  # Repositories are cloned from generated ones rather than from GitHub.
+  environment = dict(os.environ, GIT_CONFIG_COUNT='1',
+                     GIT_CONFIG_KEY_0='url.' + os.path.abspath(repositories_dir) + '/.insteadOf',
+                     GIT_CONFIG_VALUE_0='https://github.com/')
+
+  for num_files in args.num_files:
+    parameters = [num_files, args.functions_per_file, args.lines_per_function, args.duplication_ratio, args.seed]
+    repo_dir = get_repository(repositories_dir, *parameters)
+    prefix = 'phase1/' + get_repository_name(*parameters) + '/'
+    manifest = FileManifest(repo_dir)
+    stages = [('manifest', lambda: FileManifest(repo_dir)),
+              ('lizard', lambda: single_repo.get_repo_code_complexity(repo_dir, manifest)),
+              ('cpplint', lambda: single_repo.get_repo_code_formatting_report(repo_dir, manifest)),
+              ('flawfinder', lambda: single_repo.get_repo_code_security_report(repo_dir, manifest)),
+              ('license', lambda: single_repo.get_repo_code_license_compliance(repo_dir))]
+    for stage, fn in stages:
+      results[prefix + stage] = get_result(time_function(fn, args.repeat))
+      print_result(prefix + stage, results[prefix + stage])
+
+    clone_dir = os.path.join(work_dir, 'clone')
+    command = [sys.executable, os.path.join(src_directory, 'get_metadata_of_single_repo.py'),
+               '-r', 'https://github.com/' + benchmark_owner + '/' + get_repository_name(*parameters),
+               '-d', clone_dir, '-t', 'benchmark', '-w', str(args.workers),
+               '--github-api', 'graphql', '--github-graphql-url', graphql_url]
+    wall_times, peak_rss_mb = [], 0
+    for _ in range(args.repeat):
+      shutil.rmtree(clone_dir, ignore_errors=True)
+      wall_time, process_peak_rss_mb = run_process(command, environment)
+      wall_times.append(wall_time)
+      peak_rss_mb = max(peak_rss_mb, process_peak_rss_mb)
+    shutil.rmtree(clone_dir, ignore_errors=True)
+    results[prefix + 'end_to_end'] = get_result(wall_times, peak_rss_mb)
+    print_result(prefix + 'end_to_end', results[prefix + 'end_to_end'])
+
+def get_metrics_file(csv_file_name):
+  ''' Returns metrics file (see metrics_file.py) converted from generated metrics CSV file '''
+  metrics_file_name = os.path.splitext(csv_file_name)[0] + '.metrics'
+  if not os.path.exists(metrics_file_name):
+    metrics_file.convert_csv_file(csv_file_name, metrics_file_name, legacy_errors=True)
+  return metrics_file_name
+
+def benchmark_phase_2(work_dir, results):
+  ''' Times rank_repos.py on generated metrics CSV files of every size, and on metrics files converted from
+      them, in memory and in chunks '''
+  data_dir = os.path.join(work_dir, 'csv')
+  os.makedirs(data_dir, exist_ok=True)
+  output_csv_file = os.path.join(work_dir, 'ranked.csv')
+  for num_rows in args.csv_rows:
+    csv_file_name = get_metrics_csv_file(data_dir, num_rows, args.seed)
+    for input_format, input_file_name in [('', csv_file_name), ('metrics_file_', get_metrics_file(csv_file_name))]:
+      command = [sys.executable, os.path.join(src_directory, 'rank_repos.py'), '-c', input_file_name,
+                 '-o', output_csv_file]
+      modes = [('chunked', ['--chunk-size', str(args.chunk_size)])]
+      if num_rows <= args.max_in_memory_rows:
+        modes.insert(0, ('in_memory', []))
+      for mode, options in modes:
+        name = 'phase2/rows%d/%s%s' % (num_rows, input_format, mode)
+        runs = [run_process(command + options) for _ in range(args.repeat)]
+        results[name] = get_result([wall_time for wall_time, _ in runs], max(peak_rss_mb for _, peak_rss_mb in runs))
+        print_result(name, results[name])
+  os.remove(output_csv_file)
+
+def print_result(name, result):
+  print('%-70s %10.3f s' % (name, result['wall_time']) +
+        (' %8.1f MB' % result['peak_rss_mb'] if 'peak_rss_mb' in result else ''), file=sys.stderr)
+
+def get_regressions(results, baseline_results, threshold):
+  ''' Returns benchmarks whose median wall time exceeds that of baseline by more than threshold (a fraction),
+      along with both times '''
+  regressions = []
+  for name, result in results.items():
+    baseline_result = baseline_results.get(name)
+    if baseline_result is None:
+      continue
+    wall_time, baseline_wall_time = result['wall_time'], baseline_result['wall_time']
+    if wall_time > baseline_wall_time * (1 + threshold) and wall_time - baseline_wall_time > min_regression_seconds:
+      regressions.append((name, baseline_wall_time, wall_time))
+  return regressions
+
+def get_environment():
+  ''' Returns description of machine, which baselines should be compared on '''
+  return {'python': platform.python_version(), 'machine': platform.machine(), 'system': platform.system(),
+          'cpus': os.cpu_count()}
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+      description = "Script to benchmark metadata extraction (phase 1) and ranking (phase 2) offline, on "
+                    "generated repositories and metrics"
+      )
+  parser.add_argument("-d", "--work-dir", required=True,
+                      help = "Directory to store generated repositories and CSV files, which are reused by "
+                             "later runs with same parameters")
+  parser.add_argument("--phase", type=int, choices=[1, 2], action='append',
+                      help = "Phase to benchmark. May be repeated (default: both)")
+  parser.add_argument("--num-files", type=int, nargs='+', default=[50, 500],
+                      help = "Number of files of every generated repository (default: 50 500)")
+  parser.add_argument("--functions-per-file", type=int, default=10,
+                      help = "Number of functions per generated file (default: 10)")
+  parser.add_argument("--lines-per-function", type=int, default=20,
+                      help = "Number of lines per generated function (default: 20)")
+  parser.add_argument("--duplication-ratio", type=float, default=0.2,
+                      help = "Fraction of generated files that are copies of others (default: 0.2)")
+  parser.add_argument("--csv-rows", type=int, nargs='+', default=[1000, 10000, 100000, 1000000],
+                      help = "Number of repositories of every generated metrics CSV file, up to millions "
+                             "(default: 1000 10000 100000 1000000)")
+  parser.add_argument("--chunk-size", type=int, default=100000,
+                      help = "Chunk size of rank_repos.py for chunked ranking (default: 100000)")
+  parser.add_argument("--max-in-memory-rows", type=int, default=1000000,
+                      help = "Largest CSV file to also rank in memory (default: 1000000)")
+  parser.add_argument("-w", "--workers", type=int, default=1,
+                      help = "Number of processes to analyze files of a repository with (default: 1)")
+  parser.add_argument("-r", "--repeat", type=int, default=3,
+                      help = "Number of runs of every benchmark; median wall time is reported (default: 3)")
+  parser.add_argument("--seed", type=int, default=0, help = "Seed of generated repositories and metrics")
+  parser.add_argument("-o", "--output-file", help = "File to write results to (JSON)")
+  parser.add_argument("--save-baseline", help = "File to save results to as baseline (JSON)")
+  parser.add_argument("-b", "--baseline", help = "Baseline file to compare results with")
+  parser.add_argument("--threshold", type=float, default=0.1,
+                      help = "Fraction by which a benchmark may be slower than its baseline before it is "
+                             "reported as a regression (default: 0.1)")
+  args = parser.parse_args()
+
+  os.makedirs(args.work_dir, exist_ok=True)
+  results = dict()
+  if args.phase is None or 1 in args.phase:
+    benchmark_phase_1(args.work_dir, results)
+  if args.phase is None or 2 in args.phase:
+    benchmark_phase_2(args.work_dir, results)
+
+  report = {'environment': get_environment(), 'parameters': vars(args), 'results': results}
+  for file_name in [args.output_file, args.save_baseline]:
+    if file_name is not None:
+      with open(file_name, 'w') as output_file:
+        json.dump(report, output_file, indent=2)
+
+  if args.baseline is not None:
+    with open(args.baseline) as baseline_file:
+      baseline = json.load(baseline_file)
+    if baseline['environment'] != get_environment():
+      print('Warning: baseline was measured on another machine:', baseline['environment'], file=sys.stderr)
+    regressions = get_regressions(results, baseline['results'], args.threshold)
+    for name, baseline_wall_time, wall_time in regressions:
+      print('Regression: %s took %.3f s, baseline %.3f s (%+.1f%%)' %
+            (name, wall_time, baseline_wall_time, 100 * (wall_time / baseline_wall_time - 1)), file=sys.stderr)
+    if len(regressions) > 0:
+      sys.exit(1)
+    print('No regressions against', args.baseline, file=sys.stderr)
@@ -0,0 +1,245 @@
+#! /usr/bin/env python3
+
+# MIT License
+# 
+# Copyright (c) 2022 Niranjan Hasabnis
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import fcntl
+import hashlib
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from git import Repo, GitCommandError
+
+# full: complete history. shallow: only tip commit. sparse: only tip commit, blobs fetched on demand and
+# only files consumed by analyzers checked out.
+clone_modes = ['full', 'shallow', 'sparse']
+
+# Files consumed by analyzers: C/C++ sources and headers recognized by lizard, cpplint and flawfinder,
+# cpplint configuration files, and LICENSE. Patterns use .gitignore syntax (non-cone sparse checkout).
+sparse_checkout_patterns = ['*.c', '*.cc', '*.cpp', '*.cxx', '*.c++', '*.cu', '*.C', '*.CC', '*.CPP', '*.mm',
+                            '*.h', '*.hh', '*.hpp', '*.hxx', '*.h++', '*.cuh', '*.H',
+                            '*.ec', '*.ecp', '*.pgc', '*.pcc',
+                            'CPPLINT.cfg',
+                            # License files in root directory, as found by license_classifier
+                            '/[Ll][Ii][Cc][Ee][Nn][CcSs][Ee]*', '/[Uu][Nn][Ll][Ii][Cc][Ee][Nn][CcSs][Ee]*',
+                            '/[Cc][Oo][Pp][Yy][Ii][Nn][Gg]*']
+
+# Ref in a mirror that tracks tip of the default branch of its repository, and file whose mtime records
+# when the mirror was last used (for LRU eviction).
+mirror_head_ref = 'refs/gitrank/head'
+mirror_last_used_file = 'gitrank-last-used'
+
+# Held while git is started by run_git(). Starting a process makes pipes that are closed once it runs, so a
+# process forked meanwhile by another thread (e.g., a worker of a process pool) would keep them open, and
+# starting git would wait until it exits.
+git_start_lock = threading.Lock()
+
+class CloneTimeout(Exception):
+  ''' Raised when git is killed for running past deadline of a clone '''
+
+def get_git_timeout(deadline):
+  ''' Returns seconds left before deadline (None if there is none). Raises CloneTimeout if it has passed. '''
+  if deadline is None:
+    return None
+  time_left = deadline - time.time()
+  if time_left <= 0:
+    raise CloneTimeout()
+  return time_left
+
+def run_git(args, cwd=None, deadline=None):
+  ''' Runs git with args in directory cwd. Raises GitCommandError if git fails, and CloneTimeout if it is
+      still running once deadline passes. git then runs in a process group of its own, which is killed, as
+      killing git alone would leave its helpers (e.g., git-remote-http) running. '''
+  timeout = get_git_timeout(deadline)
+  with git_start_lock:
+    process = subprocess.Popen(['git'] + args, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                               start_new_session=True)
+  try:
+    _, stderr = process.communicate(timeout=timeout)
+  except subprocess.TimeoutExpired:
+    os.killpg(process.pid, signal.SIGKILL)
+    process.communicate()
+    raise CloneTimeout()
+  if process.returncode != 0:
+    raise GitCommandError(['git'] + args, process.returncode, stderr.decode('utf-8', errors='replace'))
+
+def get_mirror_path(mirror_cache_dir, repo_url):
+  ''' Returns path of mirror of repo_url in cache. URLs differing only in case, trailing slash or .git
+      suffix (e.g., GitHub's html_url and clone_url) share a mirror. '''
+  normalized_url = repo_url.strip().rstrip('/').lower()
+  if normalized_url.endswith('.git'):
+    normalized_url = normalized_url[:-len('.git')]
+  readable_name = '_'.join(normalized_url.split('/')[-2:])
+  url_hash = hashlib.sha1(normalized_url.encode('utf-8')).hexdigest()[:12]
+  return os.path.join(mirror_cache_dir, readable_name + '-' + url_hash + '.git')
+
+@contextmanager
+def lock_mirror(mirror_path, blocking=True):
+  ''' Locks mirror against concurrent fetches and eviction by other processes. Yields False if
+      blocking is False and mirror is already locked. '''
+  with open(mirror_path + '.lock', 'w') as lock_file:
+    try:
+      fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+      yield False
+      return
+    try:
+      yield True
+    finally:
+      fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def update_mirror(repo_url, mirror_path, reference_mirror_path=None, deadline=None):
+  ''' Creates bare mirror of repo_url if it does not exist, and fetches tip of its default branch
+      incrementally otherwise. A new mirror borrows objects of reference_mirror_path (e.g., mirror of
+      upstream of a fork) through git alternates. Returns commit SHA of fetched tip. '''
+  if not os.path.isdir(mirror_path):
+    mirror = Repo.init(mirror_path, bare=True)
+    mirror.create_remote('origin', repo_url)
+    if reference_mirror_path is not None and os.path.isdir(reference_mirror_path):
+      with open(os.path.join(mirror_path, 'objects', 'info', 'alternates'), 'w') as alternates:
+        alternates.write(os.path.join(os.path.abspath(reference_mirror_path), 'objects') + '\n')
+  mirror = Repo(mirror_path)
+  # Only the default branch is analyzed, so fetch its tip and nothing else (no pull request refs, etc.).
+  run_git(['fetch', '--force', '--no-tags', 'origin', '+HEAD:' + mirror_head_ref], mirror_path, deadline)
+  # Mark as recently used
+  with open(os.path.join(mirror_path, mirror_last_used_file), 'w'):
+    pass
+  return mirror.git.rev_parse(mirror_head_ref)
+
+def checkout_from_mirror(mirror_path, commit_sha, repo_dir, clone_mode, deadline=None):
+  ''' Checks out commit_sha of mirror in repo_dir. Objects are shared with mirror, so this only
+      writes the working tree. '''
+  run_git(['clone', '--shared', '--no-checkout', mirror_path, repo_dir], deadline=deadline)
+  if clone_mode == 'sparse':
+    run_git(['sparse-checkout', 'set', '--no-cone'] + sparse_checkout_patterns, repo_dir, deadline)
+  run_git(['checkout', '--detach', commit_sha], repo_dir, deadline)
+
+def get_directory_size(directory):
+  ''' Returns total size of files in directory, in bytes '''
+  total_size = 0
+  for root, _, files in os.walk(directory):
+    for file_name in files:
+      try:
+        total_size += os.lstat(os.path.join(root, file_name)).st_size
+      except OSError:
+        pass
+  return total_size
+
+def get_mirror_last_used_time(mirror_path):
+  try:
+    return os.path.getmtime(os.path.join(mirror_path, mirror_last_used_file))
+  except OSError:
+    return 0
+
+def dissociate_mirror(mirror_path):
+  ''' Copies objects borrowed through alternates into mirror so that it no longer depends on them '''
+  Repo(mirror_path).git.repack('-a', '-d')
+  os.remove(os.path.join(mirror_path, 'objects', 'info', 'alternates'))
+
+def get_alternates_of_mirror(mirror_path):
+  try:
+    with open(os.path.join(mirror_path, 'objects', 'info', 'alternates')) as alternates:
+      return [os.path.realpath(line.strip()) for line in alternates if line.strip() != '']
+  except FileNotFoundError:
+    return []
+
+def evict_mirrors(mirror_cache_dir, max_cache_size_mb):
+  ''' Evicts least recently used mirrors until cache fits in max_cache_size_mb. Mirrors in use by other
+      processes are skipped. Mirrors borrowing objects from an evicted mirror are dissociated first. '''
+  if not os.path.isdir(mirror_cache_dir):
+    return
+  mirror_paths = [os.path.join(mirror_cache_dir, name) for name in os.listdir(mirror_cache_dir)
+                  if name.endswith('.git') and os.path.isdir(os.path.join(mirror_cache_dir, name))]
+  mirror_sizes = {mirror_path: get_directory_size(mirror_path) for mirror_path in mirror_paths}
+  total_size = sum(mirror_sizes.values())
+  max_cache_size = max_cache_size_mb * 1024 * 1024
+
+  for mirror_path in sorted(mirror_paths, key=get_mirror_last_used_time):
+    if total_size <= max_cache_size:
+      break
+    objects_path = os.path.realpath(os.path.join(mirror_path, 'objects'))
+    dependent_mirror_paths = [other_path for other_path in mirror_paths
+                              if other_path != mirror_path and os.path.isdir(other_path)
+                              and objects_path in get_alternates_of_mirror(other_path)]
+    with lock_mirror(mirror_path, blocking=False) as locked:
+      if not locked:
+        continue
+      for dependent_mirror_path in dependent_mirror_paths:
+        # Dissociating a mirror that is being fetched into may lose objects, so wait for it.
+        with lock_mirror(dependent_mirror_path):
+          dissociate_mirror(dependent_mirror_path)
+        total_size += get_directory_size(dependent_mirror_path) - mirror_sizes[dependent_mirror_path]
+        mirror_sizes[dependent_mirror_path] = get_directory_size(dependent_mirror_path)
+      shutil.rmtree(mirror_path, ignore_errors=True)
+      total_size -= mirror_sizes[mirror_path]
+
+def clone_repository(repo_url, repo_dir, clone_mode='full', mirror_cache_dir=None, upstream_url=None,
+                     deadline=None):
+  ''' Clones repository at repo_url into repo_dir using given clone mode. If server does not support
+      options needed by the mode (e.g., shallow clone over dumb HTTP), falls back to full clone.
+
+      If mirror_cache_dir is given, repository is fetched incrementally into a persistent bare mirror
+      in that directory and checked out from there. A fork borrows objects of mirror of its
+      upstream_url, if that is cached.
+
+      If deadline (a time.time() value) is given, git is killed once it passes and CloneTimeout is
+      raised. '''
+  if mirror_cache_dir is not None:
+    os.makedirs(mirror_cache_dir, exist_ok=True)
+    mirror_path = get_mirror_path(mirror_cache_dir, repo_url)
+    reference_mirror_path = None if upstream_url is None else get_mirror_path(mirror_cache_dir, upstream_url)
+    try:
+      with lock_mirror(mirror_path):
+        commit_sha = update_mirror(repo_url, mirror_path, reference_mirror_path, deadline)
+        checkout_from_mirror(mirror_path, commit_sha, repo_dir, clone_mode, deadline)
+      return
+    except GitCommandError as err:
+      print('Mirror cache failed for', repo_url + '; cloning directly:', err.stderr.strip(), file=sys.stderr)
+      shutil.rmtree(repo_dir, ignore_errors=True)
+
+  if clone_mode == 'full':
+    run_git(['clone', repo_url, repo_dir], deadline=deadline)
+    return
+
+  try:
+    if clone_mode == 'shallow':
+      run_git(['clone', '--depth=1', repo_url, repo_dir], deadline=deadline)
+    elif clone_mode == 'sparse':
+      # Servers that do not support filtering ignore --filter with a warning, so we still get a valid
+      # (unfiltered) clone in that case.
+      run_git(['clone', '--depth=1', '--filter=blob:none', '--no-checkout', repo_url, repo_dir], deadline=deadline)
+      run_git(['sparse-checkout', 'set', '--no-cone'] + sparse_checkout_patterns, repo_dir, deadline)
+      run_git(['checkout'], repo_dir, deadline)
+    else:
+      raise ValueError("Unknown clone mode: " + clone_mode)
+  except GitCommandError as err:
+    print('Clone mode', clone_mode, 'failed for', repo_url + '; falling back to full clone:', err.stderr.strip(),
+          file=sys.stderr)
+    shutil.rmtree(repo_dir, ignore_errors=True)
+    run_git(['clone', repo_url, repo_dir], deadline=deadline)
@@ -0,0 +1,66 @@
+#! /usr/bin/env python3
+
+# MIT License
+# 
+# Copyright (c) 2022 Niranjan Hasabnis
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import fnmatch
+import os
+
+# Directories holding vendored or generated code, which says little about quality of the repository itself
+default_excluded_directories = ['third_party', 'third-party', 'thirdparty', '3rdparty', 'vendor', 'external',
+                                'node_modules', 'build']
+# Generated files (protobuf, flatbuffers, Qt moc/uic/rcc) and minified files
+default_excluded_files = ['*.pb.h', '*.pb.cc', '*.pb.c', '*_generated.h', 'moc_*.cpp', 'ui_*.h', 'qrc_*.cpp',
+                          '*.min.*']
+# Files larger than this (in KB) are mostly amalgamations or generated tables
+default_max_file_size = 1024
+
+class FileManifest(object):
+  ''' Regular files of a checkout, found by a single walk of its tree, along with their sizes. Directories
+      whose names begin with a dot (e.g., .git) and symbolic links are skipped, as are directories and files
+      matching exclusion rules. '''
+
+  def __init__(self, repo_directory, excluded_directories=default_excluded_directories,
+               excluded_files=default_excluded_files, max_file_size=default_max_file_size):
+    self.repo_directory = repo_directory
+    self.file_sizes = dict()
+    self.num_excluded_files = 0
+    for root, dirs, files in os.walk(repo_directory):
+      dirs[:] = [dir_name for dir_name in dirs
+                 if not dir_name.startswith('.') and not is_excluded(dir_name, excluded_directories)]
+      for file_name in files:
+        full_name = os.path.join(root, file_name)
+        if os.path.islink(full_name) or not os.path.isfile(full_name):
+          continue
+        file_size = os.path.getsize(full_name)
+        if is_excluded(file_name, excluded_files) or (max_file_size > 0 and file_size > max_file_size * 1024):
+          self.num_excluded_files += 1
+          continue
+        self.file_sizes[full_name] = file_size
+
+  def get_files(self, extensions):
+    ''' Returns files whose extensions (without dot) are in extensions '''
+    return [file_name for file_name in self.file_sizes if os.path.splitext(file_name)[1][1:] in extensions]
+
+def is_excluded(name, patterns):
+  return any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns)
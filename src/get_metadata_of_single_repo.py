@@ -30,19 +30,84 @@ from dateutil.parser import isoparse
 import json
 import sys
 import csv, math
-
+import functools
+import hashlib
+import multiprocessing
+import resource
+import time
+from multiprocessing.pool import ThreadPool
+
+import cpplint
+import flawfinder
 from git import Repo, GitCommandError
-from lizard import analyze
+from lizard import FileAnalyzer, get_extensions, get_reader_for, md5_hash_file
+from lizard_ext.version import version as lizard_version
 from perceval.backends.core.git import Git
 from perceval.backends.core.github import GitHub
-from perceval.backends.core.github import GitHubClient
+from perceval.backends.core import github as perceval_github
 from graal.backends.core.cocom import CoCom
+from lizardmaintainabilityindex import LizardExtension as MaintainabilityIndexExtension
+from clone_repo import clone_modes, clone_repository, evict_mirrors, get_directory_size
+from analysis_cache import AnalysisCache, IncrementalState, get_blob_shas
+import file_manifest
+from file_manifest import FileManifest
+from license_classifier import is_valid_license
+from sampling import StratifiedSample, estimate_ratio, estimate_total
+import github_graphql
+import http_cache
+import tracing
+from token_scheduler import TokenScheduler
 
 default_entries_per_page = 1
 repo_metadata = dict()
+# Command-line arguments. Set by main script or by batch driver in its worker processes.
+args = None
+# GitHub REST client of repository being processed
+github_clients = dict()
+# Per-file analysis results shared across repositories and runs. Opened on first use in every process.
+file_analysis_cache = None
+# Last analyzed commit and per-file results of repositories. Opened on first use in every process.
+incremental_state = None
+flawfinder_initialized = False
+
+# Versions of analyzers, as part of the key of cached per-file results. Suffix is version of per-file
+# result computed by GitRank, to be bumped when that changes.
+analyzer_versions = {'lizard': lizard_version + '-3',
+                     'cpplint': cpplint.__VERSION__ + '-2',
+                     'flawfinder': flawfinder.version + '-1',
+                     'license': '1'}
+
+# File extensions linted by cpplint by default
+cpplint_extensions = ['c', 'cc', 'cpp', 'cxx', 'c++', 'cu', 'h', 'hh', 'hpp', 'hxx', 'h++', 'cuh']
+cpplint_files_per_invocation = 256
+cpplint_error_pattern = re.compile(r'(.+?):[0-9]+:  .*  \[[^\]]+\] \[[0-9]\]$')
+
+# Metrics reported for every repository, in the order in which they appear in the CSV.
+metric_fields = ['repository_owner', 'repository_uri',
+                 'stargazers_count', 'subscribers_count', 'forks_count', 'open_issues', 'repo_age_in_days', 'created_at',
+                 'num_commits', 'open_issues_and_pr_now',
+                 'closed_issues_and_pr_over_two_year', 'closed_issues_and_pr_over_one_year',
+                 'closed_issues_and_pr_over_six_months', 'closed_issues_and_pr_over_one_month',
+                 'average_cyclomatic_complexity_for_repo', 'average_maintainability_index_for_repo',
+                 'style_errors', 'style_errors_per_nloc', 'is_valid_license',
+                 'security_notes', 'security_warnings', 'security_errors',
+                 'security_notes_per_nloc', 'security_warnings_per_nloc', 'security_errors_per_nloc']
+# Fields and lengths (in days) of windows over which closed issues and PRs are counted
+closed_issue_windows = [('closed_issues_and_pr_over_two_year', 365*2),
+                        ('closed_issues_and_pr_over_one_year', 365),
+                        ('closed_issues_and_pr_over_six_months', 180),
+                        ('closed_issues_and_pr_over_one_month', 30)]
+
+# Metrics obtained by analyzing code of a repository, which only change with its commit.
+code_metric_fields = metric_fields[metric_fields.index('average_cyclomatic_complexity_for_repo'):]
 
 def make_github_get_query(owner, repository, token, resource, params=''):
-  github_client = GitHubClient(owner=owner, repository=repository, tokens=token)
+  # Creating a client queries rate limit of its tokens, so reuse client across queries on a repository.
+  client_key = (owner, repository, tuple(token))
+  if client_key not in github_clients:
+    github_clients.clear()
+    github_clients[client_key] = perceval_github.GitHubClient(owner=owner, repository=repository, tokens=token)
+  github_client = github_clients[client_key]
   resource_url = "https://api.github.com/repos/" + owner + "/" + repository + "/" + resource + "?per_page=" + str(default_entries_per_page) + params
   if args.debug:
     print("Asking for URL:", resource_url)
@@ -92,7 +157,8 @@ def get_number_of_issues_over_period(owner, repository, token, state, from_date,
   #return (open_issues, closed_issues)
 
 def report_number_of_issues_over_period(owner, repository, token):
-  current_date = datetime.utcnow()
+  # Windows start at a day boundary, so that queries are the same, and thus cacheable, throughout a day.
+  current_date = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
   # obtain 2 year prior date
   two_year_ago_date = current_date - timedelta(days=365*2)
   # obtain one year prior date
@@ -112,163 +178,281 @@ def report_number_of_issues_over_period(owner, repository, token):
   repo_metadata['closed_issues_and_pr_over_six_months'] = closed_issues_and_pr_over_six_months
   repo_metadata['closed_issues_and_pr_over_one_month'] = closed_issues_and_pr_over_one_month
 
-def get_repo_code_complexity(repo_directory):
-  #cc = CoCom(uri=repo_url, git_path=repo_directory)
-  # Use Lizard's cpp language to check for code complexity
-  file_infos = list(analyze(paths=[repo_directory], lans=["cpp"]))
-  total_cyclomatic_complexity_for_repo = 0
-  total_maintainability_index_for_repo = 0
-  total_number_of_files_with_valid_info = 0
-
-  # Determine average cyclomatic complexity per file using function-level cyclomatic complexity
-  def get_avg_cyclomatic_complexity_per_file(file_info):
-    total_cyclomatic_complexity = 0
-    function_info_list = file_info.__dict__["function_list"]
-    total_number_of_functions = len(function_info_list)
-    for function_info in function_info_list:
-      total_cyclomatic_complexity += function_info.__dict__["cyclomatic_complexity"]
-    return total_cyclomatic_complexity / total_number_of_functions
-
-  def get_halstead_volume_for_function(func_name, file_name, start_line, end_line):
-    try:
-      output_json = subprocess.check_output("halstead_volume/bin/get_halstead_volume -f " + file_name + " -l 2 -s " + str(start_line) + " -e " + str(end_line) + " 2> /dev/null", shell=True).decode("utf-8")
-      #print('json:', output_json)
-      halstead_volumes_for_funcs = json.loads(output_json)["halstead_volumes"]
-      if len(halstead_volumes_for_funcs) < 1:
-        raise Exception("No volume found for " + func_name)
-      elif len(halstead_volumes_for_funcs) == 1:
-        return halstead_volumes_for_funcs[0]["halstead_volume"]
-      else:
-        for halstead_volume_for_func in halstead_volumes_for_funcs:
-          if halstead_volume_for_func["function_name"] == func_name:
-            return halstead_volume_for_func["halstead_volume"]
-          else:
-            raise Exception("No volume found for " + func_name)
-    except subprocess.CalledProcessError as err:
-      return -1
-    except Exception as exp:
-      return -1
-    finally:
-      subprocess._cleanup()
-
-  def get_maintainability_index_per_file(file_info):
-    file_name = file_info.__dict__["filename"]
-    # determine maintainability index of file using function-level info.
-    #func_mi = 0
-    #functions_without_err_in_halstead_vol = 0
-    #function_info_list = file_info.__dict__["function_list"]
-    #for function_info in function_info_list:
-      #print(function_info.__dict__)
-    #  func_name = function_info.__dict__["name"]
-    #  start_line = function_info.__dict__["start_line"]
-    #  end_line = function_info.__dict__["end_line"]
-    #  cyclomatic_complexity = float(function_info.__dict__["cyclomatic_complexity"])
-    #  nloc = function_info.__dict__["nloc"]
-    #  halstead_volume_for_func = get_halstead_volume_for_function(func_name, file_name, start_line, end_line)
-    #  if halstead_volume_for_func != -1:
-    #    func_mi += 171 - 5.2 * math.log(halstead_volume_for_func) - 0.23 * cyclomatic_complexity - 16.2 * math.log(nloc)
-    #    functions_without_err_in_halstead_vol += 1
-    #if functions_without_err_in_halstead_vol > 0:
-    #  return func_mi / len(function_info_list)
-    #else:
-    #  return -1
-    avg_maintainability_index = -1
-    try:
-      output = subprocess.check_output("lizard -Emaintainabilityindex -i -1 " + file_name + " 2> /dev/null", shell=True).decode("utf-8")
-      output_lines = output.split('\n')
-      if len(output_lines) >= 2:
-        for line in output_lines[len(output_lines) - 2 : len(output_lines)]:
-          # Expected output line: "avg_maintainability_index: <index>"
-          if line.startswith("avg_maintainability_index:"):
-            avg_maintainability_index = float(line.split(' ')[-1])
-            break
-    except subprocess.CalledProcessError as err:
-      print('filename:', file_name)
-      print('error:', err)
-      return -1
-    finally:
-      subprocess._cleanup()
-      return avg_maintainability_index
-
-  for file_info in file_infos:
+def analyze_source_files(files, num_workers):
+  ''' Runs lizard along with maintainability index extension on given files. Cyclomatic complexity
+      and maintainability index are thus obtained in a single tokenization pass per file. Files are
+      distributed over a pool of num_workers processes. '''
+  file_analyzer = FileAnalyzer(get_extensions([MaintainabilityIndexExtension()]))
+  # Results are yielded as files are analyzed, so that a FileInfo (with its function list) can be
+  # dropped once it is summarized, instead of all of them being kept until the last file is done.
+  if num_workers > 1:
+    with multiprocessing.Pool(processes=num_workers) as pool:
+      yield from pool.imap(file_analyzer, files, chunksize=8)
+  else:
+    yield from map(file_analyzer, files)
+
+def count_analyzed_files(analyze_files_fn):
+  ''' Returns analyze_files_fn that also counts analyzed files in current trace span '''
+  def analyze_and_count_files(file_names):
+    for file_name, result in analyze_files_fn(file_names):
+      tracing.add_to_current_span(files_analyzed=1)
+      yield file_name, result
+  return analyze_and_count_files
+
+def get_cpplint_cache_keys(repo_directory, blob_shas_by_file):
+  ''' Returns dictionary from file name to key of its cached cpplint result. Besides contents of a file,
+      cpplint output depends on its path in repository (e.g., for build/header_guard) and on CPPLINT.cfg
+      files of its directory and of directories above it. '''
+  config_hashes = dict()
+
+  def get_config_hash(directory):
+    ''' Returns hash of CPPLINT.cfg files that apply to files in directory of repository '''
+    if directory not in config_hashes:
+      config_file_name = os.path.join(repo_directory, directory, 'CPPLINT.cfg')
+      contents = b''
+      if os.path.isfile(config_file_name):
+        with open(config_file_name, 'rb') as config_file:
+          contents = config_file.read()
+      parent_hash = get_config_hash(os.path.dirname(directory)) if directory != '' else ''
+      config_hashes[directory] = hashlib.sha1(parent_hash.encode('ascii') + b'\0' + contents).hexdigest()
+    return config_hashes[directory]
+
+  cache_keys = dict()
+  for file_name, blob_sha in blob_shas_by_file.items():
+    relative_file_name = os.path.relpath(file_name, repo_directory)
+    key = '\0'.join([blob_sha, relative_file_name, get_config_hash(os.path.dirname(relative_file_name))])
+    cache_keys[file_name] = hashlib.sha1(key.encode('utf-8', errors='surrogateescape')).hexdigest()
+  return cache_keys
+
+def get_file_keys(analyzer, repo_directory, file_names):
+  ''' Returns dictionary from file name to key of its cached results: its blob SHA, or for cpplint, whose
+      results also depend on where file is, the key of get_cpplint_cache_keys() '''
+  blob_shas_by_file = get_blob_shas(repo_directory, file_names)
+  if analyzer == 'cpplint':
+    return get_cpplint_cache_keys(repo_directory, blob_shas_by_file)
+  return blob_shas_by_file
+
+def analyze_files(analyzer, analyze_files_fn, file_names, repo_directory, file_keys=None):
+  ''' Returns iterator over (file name, result) pairs, where result is what analyze_files_fn yields for
+      that file. If analysis cache is enabled, results of files seen before (in this or other repositories)
+      are taken from it, by keys of get_file_keys(). '''
+  global file_analysis_cache
+  if tracing.is_enabled():
+    analyze_files_fn = count_analyzed_files(analyze_files_fn)
+  if args.analysis_cache is None:
+    return analyze_files_fn(file_names)
+  # SQLite connections cannot be shared across processes, so every process opens its own.
+  if file_analysis_cache is None:
+    file_analysis_cache = AnalysisCache(args.analysis_cache)
+  if file_keys is None:
+    file_keys = get_file_keys(analyzer, repo_directory, file_names)
+  return iter(file_analysis_cache.analyze_files(analyzer, analyzer_versions[analyzer], analyze_files_fn,
+                                                {file_name: file_keys[file_name]
+                                                 for file_name in file_names}).items())
+
+def get_incremental_state():
+  global incremental_state
+  if incremental_state is None:
+    incremental_state = IncrementalState(args.incremental_state)
+  return incremental_state
+
+def add_contribution(totals, contribution, sign=1):
+  for key, value in contribution.items():
+    totals[key] = totals.get(key, 0) + sign * value
+
+def get_repo_totals(analyzer, analyze_files_fn, file_names, repo_directory, get_contribution_fn=lambda result: result):
+  ''' Analyzes files and returns sums of their contributions (as given by get_contribution_fn for result
+      of a file) to repository metrics.
+
+      If incremental state is enabled, only files added or modified since last run on the repository are
+      analyzed. Sums from last run are then updated by subtracting contributions of modified and deleted
+      files and adding those of modified and added files. Files are compared by their keys of
+      get_file_keys() (blob SHAs, or for cpplint, also paths and CPPLINT.cfg files), so this works with
+      shallow clones that do not have the last analyzed commit. '''
+  tracing.add_to_current_span(files=len(file_names))
+  if args.incremental_state is None:
+    # Only sums are kept, so memory does not grow with number of files.
+    totals = dict()
+    for _, result in analyze_files(analyzer, analyze_files_fn, file_names, repo_directory):
+      add_contribution(totals, get_contribution_fn(result))
+    return totals
+
+  state = get_incremental_state()
+  repo_url = repo_metadata['repository_uri']
+  previous_results, totals = state.get_file_results(repo_url, analyzer, analyzer_versions[analyzer])
+  file_keys = get_file_keys(analyzer, repo_directory, file_names)
+  # Checkout directory differs across runs, so state is keyed by file names relative to it.
+  relative_file_names = {file_name: os.path.relpath(file_name, repo_directory) for file_name in file_names}
+  unchanged_file_names = set(relative_file_names[file_name] for file_name in file_names
+                             if relative_file_names[file_name] in previous_results and
+                             previous_results[relative_file_names[file_name]][0] == file_keys[file_name])
+  changed_files = [file_name for file_name in file_names if relative_file_names[file_name] not in unchanged_file_names]
+  removed_file_names = [file_name for file_name in previous_results if file_name not in unchanged_file_names]
+
+  for file_name in removed_file_names:
+    add_contribution(totals, get_contribution_fn(previous_results[file_name][1]), sign=-1)
+  new_results = dict(analyze_files(analyzer, analyze_files_fn, changed_files, repo_directory, file_keys))
+  for result in new_results.values():
+    add_contribution(totals, get_contribution_fn(result))
+
+  state.update_file_results(repo_url, analyzer, analyzer_versions[analyzer], removed_file_names,
+                            {relative_file_names[file_name]: (file_keys[file_name], result)
+                             for file_name, result in new_results.items()}, totals)
+  return totals
+
+# Determine average cyclomatic complexity per file using function-level cyclomatic complexity
+def get_avg_cyclomatic_complexity_per_file(file_info):
+  total_cyclomatic_complexity = 0
+  function_info_list = file_info.__dict__["function_list"]
+  total_number_of_functions = len(function_info_list)
+  for function_info in function_info_list:
+    total_cyclomatic_complexity += function_info.__dict__["cyclomatic_complexity"]
+  return total_cyclomatic_complexity / total_number_of_functions
+
+def get_maintainability_index_per_file(file_info):
+  # Maintainability index is computed by MaintainabilityIndexExtension while lizard analyzes the file.
+  # Files for which it could not be computed do not have it.
+  if not hasattr(file_info, "maintainability_index"):
+    return -1
+  return round(file_info.maintainability_index, 2)
+
+def get_lizard_results_for_files(file_names):
+  ''' Yields file names along with their average cyclomatic complexity and maintainability index. Both
+      are None for files without functions. Maintainability index is -1 if it could not be computed. '''
+  for file_info in analyze_source_files(file_names, args.workers):
     # Skip files having no function list info
     if 'function_list' in file_info.__dict__ and len(file_info.__dict__['function_list']) > 0:
-      mi = get_maintainability_index_per_file(file_info)
-      if mi != -1:
-        total_cyclomatic_complexity_for_repo += get_avg_cyclomatic_complexity_per_file(file_info)
-        total_maintainability_index_for_repo += mi
-        total_number_of_files_with_valid_info += 1
+      result = {'cyclomatic_complexity': get_avg_cyclomatic_complexity_per_file(file_info),
+                'maintainability_index': get_maintainability_index_per_file(file_info)}
+    else:
+      result = {'cyclomatic_complexity': None, 'maintainability_index': None}
     if args.debug:
-      print(file_info.__dict__["filename"], file_info.__dict__["nloc"],
-            get_avg_cyclomatic_complexity_per_file(file_info))    
-      for function_info in file_info.__dict__["function_list"]:
-        print(function_info.__dict__)
-  
+      print(file_info.filename, result, file=sys.stderr)
+    yield file_info.filename, result
+
+def get_lizard_contribution(result):
+  ''' Only files having functions and valid maintainability index count towards repository averages '''
+  if result['cyclomatic_complexity'] is None or result['maintainability_index'] == -1:
+    return {'cyclomatic_complexity': 0, 'maintainability_index': 0, 'files': 0}
+  return {'cyclomatic_complexity': result['cyclomatic_complexity'],
+          'maintainability_index': result['maintainability_index'], 'files': 1}
+
+def get_lizard_source_files(manifest):
+  ''' Returns files of manifest that lizard reads as C/C++, leaving out files having same content as an
+      earlier file, like lizard does '''
+  source_files = []
+  file_hashes = set()
+  for file_name in manifest.file_sizes:
+    reader = get_reader_for(file_name)
+    if reader is None or 'cpp' not in reader.language_names:
+      continue
+    file_hash = md5_hash_file(file_name)
+    if file_hash is not None and file_hash in file_hashes:
+      continue
+    file_hashes.add(file_hash)
+    source_files.append(file_name)
+  return source_files
+
+def report_metric_error(fields, error):
+  ''' Records error (see metrics_file.error_codes) of fields that could not be computed, or clears it if
+      error is None. Fields are reported as -1 in CSV, but as nulls with error in metrics file, so that no
+      valid -1 is taken for an error. '''
+  metric_errors = repo_metadata.setdefault('metric_errors', dict())
+  for field in fields:
+    if error is None:
+      metric_errors.pop(field, None)
+    else:
+      metric_errors[field] = error
+
+def get_repo_code_complexity(repo_directory, manifest, totals=None):
+  ''' Reports complexity metrics of repository. Sums of per-file contributions may be given in totals
+      (e.g., estimated from a sample of files); otherwise all files are analyzed. '''
+  #cc = CoCom(uri=repo_url, git_path=repo_directory)
+  # Use Lizard's cpp language to check for code complexity
+  if totals is None:
+    file_names = get_lizard_source_files(manifest)
+    totals = get_repo_totals('lizard', get_lizard_results_for_files, file_names, repo_directory, get_lizard_contribution)
+  total_cyclomatic_complexity_for_repo = totals.get('cyclomatic_complexity', 0)
+  total_maintainability_index_for_repo = totals.get('maintainability_index', 0)
+  total_number_of_files_with_valid_info = totals.get('files', 0)
+
   if total_number_of_files_with_valid_info == 0:
     #raise Exception("lizard found no files in ", repo_directory)
     # Do not fail as we should continue with next repo.
     average_cyclomatic_complexity_for_repo = -1
     average_maintainability_index_for_repo = -1
+    error = 'no_functions'
   else:
     average_cyclomatic_complexity_for_repo = round(total_cyclomatic_complexity_for_repo / total_number_of_files_with_valid_info, 2)
     average_maintainability_index_for_repo = round(total_maintainability_index_for_repo / total_number_of_files_with_valid_info, 2)
+    error = None
 
   repo_metadata['average_cyclomatic_complexity_for_repo'] = average_cyclomatic_complexity_for_repo
   repo_metadata['average_maintainability_index_for_repo'] = average_maintainability_index_for_repo
+  report_metric_error(['average_cyclomatic_complexity_for_repo', 'average_maintainability_index_for_repo'], error)
 
 def get_repo_code_license_compliance(repo_directory):
   #cc = CoLic(uri=repo_url, git_path=repo_directory)
-  is_valid_license = 0
-  try:
-    # Check type of LICENSE file. If such a file does not exist, return code will be non-zero, in which case we set test score to 0.
-    output_json = subprocess.check_output("scancode -l --quiet --json - " + repo_directory + "/LICENSE 2> /dev/null", shell=True).decode("utf-8")
-    output_dict = json.loads(output_json)
-
-    # check that license is not a generic-cla, but a known one such as Apache, MIT, etc.
-    if 'files' in output_dict:
-      license_file_record = output_dict['files'][0]
-      if 'license_expressions' in license_file_record and 'generic-cla' not in license_file_record['license_expressions']:
-        is_valid_license = 1      
-  except subprocess.CalledProcessError as err:
-    is_valid_license = 0
-  finally:
-    subprocess._cleanup()
-    repo_metadata['is_valid_license'] = is_valid_license
-
-def get_repo_code_formatting_report(repo_directory):
-  cpplint_errors = -1
-  cpplint_loc = 1
-  try:
-    # Run cpplint at top-level with most confident verbosity level. If return code is 0, there are no style issues.
-    # If return code is 1, there are some issues. In that case, issue count is in last but one line.
-    output = subprocess.check_output("cpplint --recursive --verbose=5 --counting=total " + repo_directory + " 2>&1", shell=True).decode("utf-8")
-    # Since there is no exception, set number of style issues to 0.
-    cpplint_errors = 0
-  except subprocess.CalledProcessError as err:
-    if err.returncode == 1:
-       decoded_output = err.output.decode('utf-8')
-       decoded_output_lines = decoded_output.split('\n')
-       if len(decoded_output_lines) >= 2:
-         for line in decoded_output_lines[len(decoded_output_lines) - 2 : len(decoded_output_lines)]:
-           # Expected output line: "Total errors found: <issues_count>"
-           if line.startswith("Total errors found:"):
-              cpplint_errors = line.split(' ')[-1]
-              break
-       else:
-        raise err
-    else:
-      raise err
-  finally:
-    subprocess._cleanup()
-
-  # Get lines of code scanned by cpplint. cpplint output does not contain this info, so we use a simple
-  # shell script for it.
-  try:
-    cpplint_loc = subprocess.check_output(os.path.dirname(sys.argv[0]) + "/get_loc_for_cpplint.sh " + repo_directory, shell=True)
-  except subprocess.CalledProcessError as err:
-    raise err
-  finally:
-    subprocess._cleanup()
+  # License files (LICENSE, COPYING, LICENSE.md, ...) are classified in-process; scancode is only run on
+  # those that are not recognized. Without a license file, score is 0.
+  repo_metadata['is_valid_license'] = is_valid_license(repo_directory)
+
+def get_cpplint_source_files(manifest):
+  ''' Returns files of manifest that 'cpplint --recursive' would lint '''
+  return manifest.get_files(cpplint_extensions)
+
+def count_lines(file_name):
+  ''' Counts lines in file_name the way 'wc -l' does '''
+  with open(file_name, 'rb') as input_file:
+    return input_file.read().count(b'\n')
+
+def run_cpplint(file_names):
+  ''' Lints files with a single cpplint invocation and returns dictionary from file name to number of style
+      errors found in it and its number of lines. Files that cpplint skips (e.g., excluded by CPPLINT.cfg)
+      have 0 lines. '''
+  results = {file_name: {'errors': 0, 'loc': 0} for file_name in file_names}
+  if len(file_names) > 0:
+    # Run cpplint with most confident verbosity level. If return code is 0, there are no style issues.
+    # If return code is 1, there are some issues.
+    with tracing.span('cpplint_process', files=len(file_names)):
+      process = subprocess.run(['cpplint', '--verbose=5', '--output=emacs'] + file_names,
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    if process.returncode not in [0, 1]:
+      raise subprocess.CalledProcessError(process.returncode, process.args, output=process.stdout)
+    for line in process.stdout.decode('utf-8', errors='surrogateescape').split('\n'):
+      # Lines of code scanned by cpplint are not in its output, so count lines of files it processed.
+      if line.startswith('Done processing '):
+        file_name = line[len('Done processing '):]
+        if file_name in results:
+          results[file_name]['loc'] = count_lines(file_name)
+        continue
+      # Expected error line: "<file_name>:<line>:  <message>  [<category>] [<confidence>]"
+      match = cpplint_error_pattern.match(line)
+      if match is not None and match.group(1) in results:
+        results[match.group(1)]['errors'] += 1
+  return results
+
+def get_cpplint_results_for_files(file_names):
+  ''' Yields file names along with their results of run_cpplint(). Files are split in shards of at most
+      cpplint_files_per_invocation files, which are linted by up to args.workers cpplint processes at once. '''
+  shard_size = max(1, min(cpplint_files_per_invocation, math.ceil(len(file_names) / args.workers)))
+  shards = [file_names[i : i + shard_size] for i in range(0, len(file_names), shard_size)]
+  if args.workers > 1 and len(shards) > 1:
+    # Work happens in cpplint processes, so threads are enough to keep several of them running.
+    with ThreadPool(processes=args.workers) as pool:
+      for shard_results in pool.imap_unordered(tracing.in_context(run_cpplint), shards):
+        yield from shard_results.items()
+  else:
+    for shard in shards:
+      yield from run_cpplint(shard).items()
+
+def get_repo_code_formatting_report(repo_directory, manifest, totals=None):
+  ''' Reports style metrics of repository; totals as for get_repo_code_complexity() '''
+  if totals is None:
+    file_names = get_cpplint_source_files(manifest)
+    totals = get_repo_totals('cpplint', get_cpplint_results_for_files, file_names, repo_directory)
+  cpplint_errors = round(totals.get('errors', 0))
+  cpplint_loc = totals.get('loc', 0)
 
   repo_metadata['style_errors'] = cpplint_errors
   # avoid divide by 0
@@ -277,52 +461,60 @@ def get_repo_code_formatting_report(repo_directory):
 
   repo_metadata['style_errors_per_nloc'] = round(float(cpplint_errors) / float(cpplint_loc), 3)
 
-def get_repo_code_security_report(repo_directory):
-  security_notes = 0
-  security_warnings = 0
-  security_errors = 0
-  flawfinder_loc = 1
-  try:
-    # Run flawfinder to get security report. Before that set LANG to ISO-8859-1 encoding to handle Python3 encoding/decoding errors.
-    myenv = os.environ.copy()
-    myenv["LANG"] = "en_US.ISO-8859-1"
-    output_sarif = subprocess.check_output("flawfinder --sarif --falsepositive " + repo_directory + " 2> /dev/null", env=myenv, shell=True).decode("utf-8")
-    output_json = json.loads(output_sarif)
-    if "runs" in output_json and 'results' in output_json['runs'][0]:
-      for result in output_json['runs'][0]['results']:
-        if result['level'] == 'note':
-          security_notes += 1
-        elif result['level'] == 'warning':
-          security_warnings += 1
-        elif result['level'] == 'error':
-          security_errors += 1
-        else:
-          print("Unhandled security level:", result['level'])
-    else:
-      # "runs" should be present in valid output, so scanning error.
-      security_notes = -1
-      security_warnings = -1
-      security_errors = -1
-  except subprocess.CalledProcessError as err:
-    raise err
-  finally:
-    subprocess._cleanup()
-
-  try:
-    loc_scanned_output = subprocess.check_output("flawfinder -S --falsepositive " + repo_directory + " 2>&1 | tail -n 20", env=myenv, shell=True).decode("utf-8")
-    decoded_output_lines = loc_scanned_output.split('\n')
-    if len(decoded_output_lines) >= 20:
-      for line in decoded_output_lines:
-        # Expected output line: "Physical Source Lines of Code (SLOC) = <loc>"
-        if line.startswith("Physical Source Lines of Code (SLOC)"):
-          flawfinder_loc = float(line.split(' ')[-1])
-          break
+def get_flawfinder_source_files(manifest):
+  ''' Returns files of manifest that flawfinder scans '''
+  return manifest.get_files([extension[1:] for extension in flawfinder.c_extensions])
+
+def init_flawfinder():
+  ''' Configures flawfinder module as 'flawfinder --falsepositive --quiet --dataonly' would '''
+  global flawfinder_initialized
+  if flawfinder_initialized:
+    return
+  flawfinder.falsepositive = 1
+  flawfinder.quiet = 1
+  flawfinder.showheading = 0
+  # flawfinder opens files with default encoding, which fails on files that are not valid UTF-8.
+  # ISO-8859-1 can decode any file, so make flawfinder use it (as LANG=en_US.ISO-8859-1 would).
+  flawfinder.open = functools.partial(open, encoding='iso-8859-1')
+  flawfinder.initialize_ruleset()
+  flawfinder_initialized = True
+
+def get_flawfinder_result_for_file(file_name):
+  ''' Runs flawfinder in-process on file and returns file name along with number of security notes,
+      warnings and errors found in it and its physical SLOC '''
+  init_flawfinder()
+  flawfinder.hitlist = []
+  flawfinder.sloc = 0
+  flawfinder.process_c_file(file_name, None)
+  result = {'notes': 0, 'warnings': 0, 'errors': 0, 'sloc': flawfinder.sloc}
+  for hit in flawfinder.hitlist:
+    # Same mapping from risk level to severity as in flawfinder's SARIF output
+    if hit.level >= 4:
+      result['errors'] += 1
+    elif hit.level == 3:
+      result['warnings'] += 1
     else:
-      raise subprocess.CalledProcessError
-  except subprocess.CalledProcessError as err:
-    raise err
-  finally:
-    subprocess._cleanup()
+      result['notes'] += 1
+  return file_name, result
+
+def get_flawfinder_results_for_files(file_names):
+  ''' Yields results of get_flawfinder_result_for_file() for files. Files are scanned on a pool of
+      args.workers processes, and only per-file counts come back from them. '''
+  if args.workers > 1 and len(file_names) > 1:
+    with multiprocessing.Pool(processes=args.workers) as pool:
+      yield from pool.imap_unordered(get_flawfinder_result_for_file, file_names, chunksize=8)
+  else:
+    yield from map(get_flawfinder_result_for_file, file_names)
+
+def get_repo_code_security_report(repo_directory, manifest, totals=None):
+  ''' Reports security metrics of repository; totals as for get_repo_code_complexity() '''
+  if totals is None:
+    file_names = get_flawfinder_source_files(manifest)
+    totals = get_repo_totals('flawfinder', get_flawfinder_results_for_files, file_names, repo_directory)
+  security_notes = round(totals.get('notes', 0))
+  security_warnings = round(totals.get('warnings', 0))
+  security_errors = round(totals.get('errors', 0))
+  flawfinder_loc = totals.get('sloc', 0)
 
   repo_metadata['security_notes'] = security_notes
   repo_metadata['security_warnings'] = security_warnings
@@ -335,68 +527,371 @@ def get_repo_code_security_report(repo_directory):
   repo_metadata['security_notes_per_nloc'] = round(float(security_notes) / flawfinder_loc, 3)
   repo_metadata['security_warnings_per_nloc'] = round(float(security_warnings) / flawfinder_loc, 3)
   repo_metadata['security_errors_per_nloc'] = round(float(security_errors) / flawfinder_loc, 3)
- 
+
+# Analyzers whose metrics can be estimated from a sample of files: files they analyze, function analyzing
+# files, contribution of result of a file to repository sums, and function reporting metrics from sums
+code_analyzers = [('lizard', get_lizard_source_files, get_lizard_results_for_files, get_lizard_contribution,
+                   get_repo_code_complexity),
+                  ('cpplint', get_cpplint_source_files, get_cpplint_results_for_files, lambda result: result,
+                   get_repo_code_formatting_report),
+                  ('flawfinder', get_flawfinder_source_files, get_flawfinder_results_for_files, lambda result: result,
+                   get_repo_code_security_report)]
+# Metrics that are ratios of sums of per-file contributions, for which confidence intervals are reported
+# when sampling: metric, analyzer, numerator, denominator, and digits metric is rounded to
+sampled_ratio_metrics = [('average_cyclomatic_complexity_for_repo', 'lizard', 'cyclomatic_complexity', 'files', 2),
+                         ('average_maintainability_index_for_repo', 'lizard', 'maintainability_index', 'files', 2),
+                         ('style_errors_per_nloc', 'cpplint', 'errors', 'loc', 3),
+                         ('security_notes_per_nloc', 'flawfinder', 'notes', 'sloc', 3),
+                         ('security_warnings_per_nloc', 'flawfinder', 'warnings', 'sloc', 3),
+                         ('security_errors_per_nloc', 'flawfinder', 'errors', 'sloc', 3)]
+sampling_fields = ['sampled_files_fraction'] + [metric + '_ci95' for metric, _, _, _, _ in sampled_ratio_metrics]
+
+def get_metric_fields():
+  ''' Returns CSV fields, which include sampling fields if sampling is enabled '''
+  return metric_fields + (sampling_fields if args.sample_above > 0 else [])
+
+def get_code_metric_fields():
+  return code_metric_fields + (sampling_fields if args.sample_above > 0 else [])
+
+def report_sampled_code_metrics(repo_directory, manifest, samples, contributions, fraction):
+  ''' Reports code metrics estimated from contributions of sampled files, and half widths of 95% confidence
+      intervals of ratio metrics. Returns whether all those half widths are within args.sample_precision of
+      their metrics. '''
+  stratum_contributions = dict()
+  for analyzer, _, _, _, report_fn in code_analyzers:
+    stratum_contributions[analyzer] = {stratum: [contributions[analyzer][file_name] for file_name in file_names
+                                                 if file_name in contributions[analyzer]]
+                                       for stratum, file_names in samples[analyzer].get_sample(fraction).items()}
+    stratum_sizes = samples[analyzer].get_stratum_sizes()
+    keys = set(key for stratum_results in stratum_contributions[analyzer].values()
+               for contribution in stratum_results for key in contribution)
+    totals = {key: estimate_total(stratum_sizes, {stratum: [contribution.get(key, 0) for contribution in stratum_results]
+                                                  for stratum, stratum_results in stratum_contributions[analyzer].items()})[0]
+              for key in keys}
+    report_fn(repo_directory, manifest, totals)
+
+  all_precise = True
+  for metric, analyzer, numerator, denominator, digits in sampled_ratio_metrics:
+    stratum_results = stratum_contributions[analyzer]
+    ratio, half_width = estimate_ratio(samples[analyzer].get_stratum_sizes(),
+                                       {stratum: [contribution.get(numerator, 0) for contribution in results]
+                                        for stratum, results in stratum_results.items()},
+                                       {stratum: [contribution.get(denominator, 0) for contribution in results]
+                                        for stratum, results in stratum_results.items()})
+    # Left empty, rather than -1, so that ranking does not drop repository.
+    repo_metadata[metric + '_ci95'] = '' if half_width is None else round(half_width, digits)
+    if half_width is not None and half_width > args.sample_precision * abs(ratio):
+      all_precise = False
+  return all_precise
+
+def get_sampled_code_metrics(repo_directory, manifest, file_lists):
+  ''' Reports code metrics of repository estimated from a stratified random sample of its files. Sample
+      starts with args.sample_initial_size files per analyzer and doubles until confidence intervals of all
+      ratio metrics are within args.sample_precision, all files are sampled, or next round would exceed
+      args.sample_time_budget. '''
+  samples = {analyzer: StratifiedSample(file_lists[analyzer], repo_directory, args.sample_seed)
+             for analyzer in file_lists}
+  contributions = {analyzer: dict() for analyzer in file_lists}
+  num_files = max(len(file_names) for file_names in file_lists.values())
+  fraction = min(1, args.sample_initial_size / num_files)
+  start_time = time.time()
+  while True:
+    round_start_time = time.time()
+    num_new_files = 0
+    for analyzer, _, analyze_files_fn, get_contribution_fn, _ in code_analyzers:
+      new_file_names = [file_name for file_names in samples[analyzer].get_sample(fraction).values()
+                        for file_name in file_names if file_name not in contributions[analyzer]]
+      num_new_files += len(new_file_names)
+      with tracing.span(analyzer, files=len(new_file_names), sampled_fraction=round(fraction, 3)):
+        for file_name, result in analyze_files(analyzer, analyze_files_fn, new_file_names, repo_directory):
+          contributions[analyzer][file_name] = get_contribution_fn(result)
+    all_precise = report_sampled_code_metrics(repo_directory, manifest, samples, contributions, fraction)
+    if args.debug:
+      print('Sampled', round(fraction, 3), 'of files, confidence intervals:',
+            {metric: repo_metadata[metric + '_ci95'] for metric, _, _, _, _ in sampled_ratio_metrics}, file=sys.stderr)
+    if fraction >= 1 or all_precise:
+      break
+    # Next round analyzes about as many new files as all rounds so far.
+    elapsed_time = time.time() - start_time
+    round_time_per_file = (time.time() - round_start_time) / max(1, num_new_files)
+    num_sampled_files = sum(len(analyzer_contributions) for analyzer_contributions in contributions.values())
+    if elapsed_time + round_time_per_file * num_sampled_files > args.sample_time_budget:
+      break
+    fraction = min(1, fraction * 2)
+
+  repo_metadata['sampled_files_fraction'] = round(sum(len(analyzer_contributions) for analyzer_contributions
+                                                      in contributions.values()) /
+                                                  sum(len(file_names) for file_names in file_lists.values()), 3)
+
+def get_peak_memory():
+  ''' Returns peak resident memory (in MB) of this process, and largest one of its terminated child
+      processes (e.g., analyzer pools) '''
+  # ru_maxrss is in KB on Linux.
+  return (round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+          round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1))
+
+def get_csv_row(metadata):
+  ''' Returns metadata of repository without errors of metrics, which CSV has no field for '''
+  return {field: value for field, value in metadata.items() if field != 'metric_errors'}
+
 def print_report():
-  writer = csv.DictWriter(sys.stdout, fieldnames=list(repo_metadata))
+  writer = csv.DictWriter(sys.stdout, fieldnames=get_metric_fields())
   if args.dont_print_csv_header == False:
     writer.writeheader()
-  writer.writerow(repo_metadata)
-
-# Parse command line arguments
-parser = argparse.ArgumentParser(
-    description = "Script to get repository metadata"
-    )
-parser.add_argument("-t", "--token",
-                    '--nargs', nargs='+', required=True,
-                    help = "GitHub token")
-parser.add_argument("-r", "--repo-url", required=True,
-                    help = "GitHub repository, as 'https://github.com/...'")
-parser.add_argument("-g", "--debug", action='store_true',
-                    help = "Debug this script")
-parser.add_argument("-p", "--dont-print-csv-header", action='store_true', help = "Don't print header for csv")
-parser.add_argument("-d", "--repo-dir", required=True,
-                    help = "Directory to store cloned repository")
-args = parser.parse_args()
-
-#print('Calling with', args)
-
-# Owner and repository names from https://github.com/<owner>/<repo_name>
-owner = args.repo_url.split('/')[3]
-repository = args.repo_url.split('/')[4]
-repo_metadata['repository_owner'] = owner + "_" + repository
-repo_metadata['repository_uri'] = args.repo_url
-
-# First clone git repo
-Repo.clone_from(url=args.repo_url, to_path=args.repo_dir)
-
-# create a Git object, pointing to repo_url, using repo_dir for cloning
-github_repo = GitHub(owner=owner, repository=repository, api_token=args.token)
-
-for item in github_repo.fetch(category='repository'):
-  for field in ['stargazers_count', 'subscribers_count', 'forks_count', 'open_issues', 'created_at']:
-    if field == 'created_at':
-      created_at_time_delta = datetime.now(timezone.utc) - isoparse(item['data'][field])
-      repo_metadata['repo_age_in_days'] = created_at_time_delta.days
-    repo_metadata[field] = item['data'][field]
-
-repo_metadata['num_commits'] = get_num_github_commits(owner=owner, repo=repository, token=args.token)
-
-report_number_of_issues_over_period(owner=owner, repository=repository, token=args.token)
-# contributors API does not work for repositories having high number of contributors.
-#print(get_num_github_contributors(owner=owner, repo=repo, token=args.token))
-
-# Get complexity of code in the repository
-get_repo_code_complexity(repo_directory=args.repo_dir)
-
-# Get cpplint warnings - can use Graal Coqua for Python.
-get_repo_code_formatting_report(repo_directory=args.repo_dir)
-
-# Get code license compliance
-get_repo_code_license_compliance(repo_directory=args.repo_dir)
-
-# Get security analysis report
-get_repo_code_security_report(repo_directory=args.repo_dir)
-
-print_report()
-
+  writer.writerow(get_csv_row(repo_metadata))
+
+def add_common_arguments(parser):
+  ''' Adds arguments shared by single-repo script and batch driver '''
+  parser.add_argument("-t", "--token",
+                      '--nargs', nargs='+', required=True,
+                      help = "GitHub token")
+  parser.add_argument("-g", "--debug", action='store_true',
+                      help = "Debug this script")
+  parser.add_argument("-w", "--workers", type=int, default=1,
+                      help = "Number of processes to use for analyzing files of the repository (default: 1)")
+  parser.add_argument("-c", "--clone-mode", choices=clone_modes, default='full',
+                      help = "full: clone complete history, shallow: clone only tip commit, "
+                             "sparse: shallow clone that fetches and checks out only files analyzed by GitRank "
+                             "(default: full)")
+  parser.add_argument("--mirror-cache-dir",
+                      help = "Directory of persistent bare mirrors of repositories. If given, repositories are "
+                             "fetched incrementally into their mirrors and checked out from there")
+  parser.add_argument("--mirror-cache-max-size", type=int, default=0,
+                      help = "Evict least recently used mirrors once the mirror cache exceeds this size in MB "
+                             "(default: 0, no limit)")
+  parser.add_argument("--analysis-cache",
+                      help = "SQLite database of per-file analysis results keyed by git blob SHA. Files seen "
+                             "before, in any repository, are not analyzed again")
+  parser.add_argument("--github-api", choices=['rest', 'graphql'], default='rest',
+                      help = "GitHub API used to obtain repository metadata. graphql needs a single request "
+                             "for a repository, and batch driver fetches many repositories per request "
+                             "(default: rest)")
+  parser.add_argument("--github-graphql-url", default=github_graphql.github_graphql_url,
+                      help = "GitHub GraphQL endpoint (default: " + github_graphql.github_graphql_url + ")")
+  parser.add_argument("--incremental-state",
+                      help = "SQLite database recording last analyzed commit and per-file results of every "
+                             "repository. Later runs only analyze files that changed since then")
+  parser.add_argument("--exclude-dir", action='append', metavar="PATTERN",
+                      help = "Do not analyze directories whose names match this pattern, in addition to "
+                             "default ones (" + ", ".join(file_manifest.default_excluded_directories) + "). "
+                             "May be repeated")
+  parser.add_argument("--exclude-file", action='append', metavar="PATTERN",
+                      help = "Do not analyze files whose names match this pattern, in addition to default ones "
+                             "(" + ", ".join(file_manifest.default_excluded_files) + "). May be repeated")
+  parser.add_argument("--no-default-excludes", action='store_true',
+                      help = "Analyze vendored and generated code matched by default exclusion patterns")
+  parser.add_argument("--max-file-size", type=int, default=file_manifest.default_max_file_size,
+                      help = "Do not analyze files larger than this size in KB, 0 for no limit "
+                             "(default: " + str(file_manifest.default_max_file_size) + ")")
+  parser.add_argument("--sample-above", type=int, default=0,
+                      help = "Estimate complexity, style and security metrics of repositories having more than "
+                             "this many source files from a stratified random sample of their files, and add "
+                             "95%% confidence intervals of estimated ratios as CSV columns (default: 0, never "
+                             "sample)")
+  parser.add_argument("--sample-initial-size", type=int, default=1000,
+                      help = "Number of files analyzed in first round of sampling; every next round doubles "
+                             "it (default: 1000)")
+  parser.add_argument("--sample-precision", type=float, default=0.05,
+                      help = "Stop sampling once half width of every confidence interval is within this "
+                             "fraction of its estimate (default: 0.05)")
+  parser.add_argument("--sample-time-budget", type=int, default=1800,
+                      help = "Do not start another round of sampling if it would take analysis of a "
+                             "repository past this many seconds (default: 1800)")
+  parser.add_argument("--sample-seed", type=int, default=0,
+                      help = "Seed of pseudo-random order in which files are sampled (default: 0)")
+  parser.add_argument("--github-http-cache",
+                      help = "SQLite database of GitHub REST API responses. Cached responses are reused for "
+                             "a while and then revalidated with conditional requests, which do not count "
+                             "against rate limit if nothing changed")
+  parser.add_argument("--trace-file",
+                      help = "File to append a JSON line to for every stage of processing a repository (GitHub "
+                             "metadata, clone, every analyzer, ...), subprocess, and GitHub request, with its "
+                             "wall and CPU time, peak memory, and counts such as files analyzed. Summarize it "
+                             "with src/tracing.py")
+  parser.add_argument("--github-http-cache-ttl", action='append', metavar="RESOURCE=SECONDS",
+                      help = "Seconds for which cached responses of a resource type (repository, commits, "
+                             "issues, contributors or other) are reused without revalidation. May be repeated "
+                             "(default: " + ", ".join(resource_type + "=" + str(ttl)
+                                                      for resource_type, ttl in http_cache.default_ttl_policy.items()
+                                                      if ttl is not None) + ")")
+
+def configure_github_clients(token):
+  ''' Enables HTTP cache and token scheduling for GitHub clients of this process. Every process does so
+      once; batch workers get a token scheduler shared with other workers beforehand. '''
+  if args.github_http_cache is not None and http_cache.http_cache is None:
+    http_cache.enable_github_http_cache(args.github_http_cache, http_cache.parse_ttl_policy(args.github_http_cache_ttl))
+  if http_cache.token_scheduler is None:
+    http_cache.enable_token_scheduler(TokenScheduler(token))
+
+def report_github_metadata(owner, repository, token):
+  ''' Obtains GitHub metadata of repository using REST API. Returns URL of repository it was forked from,
+      or None if it is not a fork. '''
+  # create a Git object, pointing to repo_url, using repo_dir for cloning
+  github_repo = GitHub(owner=owner, repository=repository, api_token=token)
+
+  upstream_url = None
+  for item in github_repo.fetch(category='repository'):
+    for field in ['stargazers_count', 'subscribers_count', 'forks_count', 'open_issues', 'created_at']:
+      if field == 'created_at':
+        created_at_time_delta = datetime.now(timezone.utc) - isoparse(item['data'][field])
+        repo_metadata['repo_age_in_days'] = created_at_time_delta.days
+      repo_metadata[field] = item['data'][field]
+    # Forks can borrow objects from mirror of the repository they were forked from.
+    if 'source' in item['data']:
+      upstream_url = item['data']['source']['html_url']
+
+  repo_metadata['num_commits'] = get_num_github_commits(owner=owner, repo=repository, token=token)
+
+  report_number_of_issues_over_period(owner=owner, repository=repository, token=token)
+  # contributors API does not work for repositories having high number of contributors.
+  #print(get_num_github_contributors(owner=owner, repo=repo, token=token))
+  return upstream_url
+
+def get_github_metadata(repo_url, token, github_metadata=None):
+  ''' Returns dictionary of GitHub metadata of repository at repo_url, along with URL of repository it
+      was forked from (None if it is not a fork). These may be passed in github_metadata if they have
+      already been fetched (e.g., by a batched GraphQL query). '''
+  repo_metadata.clear()
+
+  # Owner and repository names from https://github.com/<owner>/<repo_name>
+  owner = repo_url.split('/')[3]
+  repository = repo_url.split('/')[4]
+  repo_metadata['repository_owner'] = owner + "_" + repository
+  repo_metadata['repository_uri'] = repo_url
+
+  configure_github_clients(token)
+  with tracing.span('github_metadata', repository=repo_url) as span:
+    if github_metadata is None and args.github_api == 'graphql':
+      repositories_metadata, rate_limit = github_graphql.fetch_repositories_metadata(
+          [repo_url], token[0], closed_issue_windows, graphql_url=args.github_graphql_url,
+          session=http_cache.make_session())
+      github_metadata = repositories_metadata.get(repo_url)
+      if rate_limit is not None:
+        span.set(rate_limit_cost=rate_limit['cost'])
+    if github_metadata is not None:
+      metadata, upstream_url = github_metadata
+      repo_metadata.update(metadata)
+    else:
+      upstream_url = report_github_metadata(owner=owner, repository=repository, token=token)
+
+  return dict(repo_metadata), upstream_url
+
+def clone_repository_for_analysis(repo_url, repo_dir, upstream_url, time_left=None):
+  ''' Clones repository for analysis. If time_left is given, git is killed after that many seconds and
+      CloneTimeout is raised. '''
+  deadline = None if time_left is None else time.time() + time_left
+  with tracing.span('clone', repository=repo_url, clone_mode=args.clone_mode) as span:
+    # Number of commits comes from GitHub API, so history is not needed for analysis.
+    clone_repository(repo_url=repo_url, repo_dir=repo_dir, clone_mode=args.clone_mode,
+                     mirror_cache_dir=args.mirror_cache_dir, upstream_url=upstream_url, deadline=deadline)
+    if tracing.is_enabled():
+      # Objects borrowed from a mirror are not counted.
+      span.set(bytes_cloned=get_directory_size(repo_dir))
+
+def get_code_metrics(repo_url, repo_dir):
+  ''' Returns dictionary of metrics obtained by analyzing code of repository cloned in repo_dir '''
+  with tracing.span('code_metrics', repository=repo_url) as span:
+    repo_metadata.clear()
+    repo_metadata['repository_uri'] = repo_url
+
+    if args.no_default_excludes:
+      manifest_rules = [[], [], args.max_file_size]
+    else:
+      manifest_rules = [file_manifest.default_excluded_directories, file_manifest.default_excluded_files,
+                        args.max_file_size]
+    manifest_rules[0] = manifest_rules[0] + (args.exclude_dir or [])
+    manifest_rules[1] = manifest_rules[1] + (args.exclude_file or [])
+
+    # Code metrics only change with commit (and with analyzers or files they are given), so an unchanged
+    # repository need not be analyzed again.
+    commit_sha = Repo(repo_dir).head.commit.hexsha
+    analysis_config = dict(analyzer_versions, manifest=manifest_rules)
+    if args.sample_above > 0:
+      analysis_config['sampling'] = [args.sample_above, args.sample_initial_size, args.sample_precision, args.sample_seed]
+    analyzed_commit_sha = None
+    if args.incremental_state is not None:
+      analyzed_commit_sha, code_metrics = get_incremental_state().get_analyzed_commit(repo_url, analysis_config)
+
+    # Metrics stored before errors of metrics were recorded along with them are computed again.
+    if analyzed_commit_sha == commit_sha and 'metric_errors' in code_metrics:
+      span.set(unchanged_commit=True)
+      return code_metrics
+
+    # Walk checkout once and let every analyzer pick its files from the result.
+    with tracing.span('manifest') as manifest_span:
+      manifest = FileManifest(repo_dir, *manifest_rules)
+      if tracing.is_enabled():
+        manifest_span.set(files=len(manifest.file_sizes), excluded_files=manifest.num_excluded_files)
+
+    file_lists = None
+    if args.sample_above > 0:
+      file_lists = {analyzer: get_source_files_fn(manifest) for analyzer, get_source_files_fn, _, _, _ in code_analyzers}
+      if max(len(file_names) for file_names in file_lists.values()) <= args.sample_above:
+        file_lists = None
+        repo_metadata['sampled_files_fraction'] = 1
+        for metric, _, _, _, _ in sampled_ratio_metrics:
+          repo_metadata[metric + '_ci95'] = 0
+
+    if file_lists is not None:
+      # Complexity, style and security metrics estimated from a sample of files
+      with tracing.span('sampling'):
+        get_sampled_code_metrics(repo_dir, manifest, file_lists)
+    else:
+      # Get complexity of code in the repository
+      with tracing.span('lizard'):
+        get_repo_code_complexity(repo_directory=repo_dir, manifest=manifest)
+
+      # Get cpplint warnings - can use Graal Coqua for Python.
+      with tracing.span('cpplint'):
+        get_repo_code_formatting_report(repo_directory=repo_dir, manifest=manifest)
+
+      # Get security analysis report
+      with tracing.span('flawfinder'):
+        get_repo_code_security_report(repo_directory=repo_dir, manifest=manifest)
+
+    # Get code license compliance
+    with tracing.span('license'):
+      get_repo_code_license_compliance(repo_directory=repo_dir)
+
+    code_metrics = {field: repo_metadata[field] for field in get_code_metric_fields() + ['metric_errors']}
+    if args.incremental_state is not None:
+      get_incremental_state().set_analyzed_commit(repo_url, commit_sha, analysis_config, code_metrics)
+    return code_metrics
+
+def get_metadata_of_single_repo(repo_url, token, repo_dir, github_metadata=None):
+  ''' Clones repository at repo_url in repo_dir and returns dictionary of its metadata. GitHub metadata
+      of repository and URL of its upstream repository may be passed in github_metadata if they have
+      already been fetched (e.g., by a batched GraphQL query). '''
+  metadata, upstream_url = get_github_metadata(repo_url, token, github_metadata)
+  clone_repository_for_analysis(repo_url, repo_dir, upstream_url)
+  metadata.update(get_code_metrics(repo_url, repo_dir))
+  # print_report() reports repo_metadata.
+  repo_metadata.update(metadata)
+  return metadata
+
+if __name__ == '__main__':
+  # Parse command line arguments
+  parser = argparse.ArgumentParser(
+      description = "Script to get repository metadata"
+      )
+  add_common_arguments(parser)
+  parser.add_argument("-r", "--repo-url", required=True,
+                      help = "GitHub repository, as 'https://github.com/...'")
+  parser.add_argument("-p", "--dont-print-csv-header", action='store_true', help = "Don't print header for csv")
+  parser.add_argument("-d", "--repo-dir", required=True,
+                      help = "Directory to store cloned repository")
+  args = parser.parse_args()
+  if args.trace_file is not None:
+    tracing.enable_tracing(args.trace_file)
+
+  #print('Calling with', args)
+
+  get_metadata_of_single_repo(repo_url=args.repo_url, token=args.token, repo_dir=args.repo_dir)
+
+  print_report()
+  if args.debug:
+    http_cache.token_scheduler.print_report()
+    print('Peak memory (MB) of this process and of its largest child process:', *get_peak_memory(), file=sys.stderr)
 
+  if args.mirror_cache_dir is not None and args.mirror_cache_max_size > 0:
+    evict_mirrors(args.mirror_cache_dir, args.mirror_cache_max_size)
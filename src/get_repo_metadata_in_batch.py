@@ -0,0 +1,455 @@
+#! /usr/bin/env python3
+
+# MIT License
+# 
+# Copyright (c) 2022 Niranjan Hasabnis
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import argparse
+import asyncio
+import contextlib
+import csv
+import itertools
+import multiprocessing
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import requests
+
+import get_metadata_of_single_repo as single_repo
+import github_graphql
+import http_cache
+import metrics_file
+import tracing
+from batch_journal import BatchJournal
+from clone_repo import CloneTimeout, evict_mirrors, git_start_lock
+from token_scheduler import TokenScheduler
+from work_queue import SQLiteWorkQueue, get_shard, get_worker_id, parse_shard, remove_duplicate_repo_urls
+
+class RepositoryTimeout(Exception):
+  ''' Raised when a repository takes longer than --repo-timeout '''
+
+def raise_repository_timeout(signum, frame):
+  raise RepositoryTimeout()
+
+@contextlib.contextmanager
+def time_limit(seconds):
+  ''' Raises RepositoryTimeout in code it wraps once it runs for seconds (no limit if None). Workers run tasks
+      in their main thread, where the alarm signal is handled; analyzer subprocesses are killed on the way out. '''
+  if seconds is None:
+    yield
+    return
+  signal.setitimer(signal.ITIMER_REAL, max(seconds, 0.001))
+  try:
+    yield
+  finally:
+    signal.setitimer(signal.ITIMER_REAL, 0)
+
+def init_worker(worker_args, token_scheduler):
+  ''' Runs once in every worker process. Modules are imported by then, so only arguments and the token
+      scheduler shared by all workers are set. '''
+  single_repo.args = worker_args
+  http_cache.enable_token_scheduler(token_scheduler)
+  if worker_args.trace_file is not None:
+    tracing.enable_tracing(worker_args.trace_file)
+  signal.signal(signal.SIGALRM, raise_repository_timeout)
+
+def fetch_repo_github_metadata(repo_url, github_metadata, time_left):
+  ''' Runs in a fetch worker process '''
+  with time_limit(time_left):
+    return single_repo.get_github_metadata(repo_url, single_repo.args.token, github_metadata)
+
+def analyze_repo(repo_url, repo_dir, time_left):
+  ''' Runs in an analysis worker process '''
+  with time_limit(time_left):
+    code_metrics = single_repo.get_code_metrics(repo_url, repo_dir)
+  if single_repo.args.debug:
+    print('Peak memory (MB) of worker', os.getpid(), 'and of its largest child process after', repo_url + ':',
+          *single_repo.get_peak_memory(), file=sys.stderr)
+  return code_metrics
+
+def fetch_github_metadata_in_batches(repo_urls, batch_size):
+  ''' Yields repository URLs along with their GitHub metadata (None if it could not be fetched), fetching
+      metadata of batch_size repositories per GraphQL request '''
+  session = http_cache.make_session()
+  repo_urls = iter(repo_urls)
+  for batch in iter(lambda: list(itertools.islice(repo_urls, batch_size)), []):
+    try:
+      with tracing.span('github_graphql_batch', repositories=len(batch)) as span:
+        repositories_metadata, rate_limit = github_graphql.fetch_repositories_metadata(
+            batch, args.token[0], single_repo.closed_issue_windows, graphql_url=args.github_graphql_url, session=session)
+        if rate_limit is not None:
+          span.set(rate_limit_cost=rate_limit['cost'])
+      if args.debug:
+        print('GraphQL rate limit:', rate_limit, file=sys.stderr)
+    except requests.RequestException as err:
+      # Fetch workers fall back to REST API for these repositories.
+      print('Failed to fetch GitHub metadata of', len(batch), 'repositories:', repr(err), file=sys.stderr)
+      repositories_metadata = dict()
+    for repo_url in batch:
+      yield repo_url, repositories_metadata.get(repo_url)
+
+def read_repo_urls(url_file_name):
+  ''' Reads list of repository URLs, one per line '''
+  with open(url_file_name) as url_file:
+    return [line.strip() for line in url_file if line.strip() != '']
+
+async def run_stage(input_queue, output_queue, num_workers, num_next_stage_workers, process_item):
+  ''' Runs num_workers coroutines that take items from input_queue until they get None, and put results
+      of process_item (unless None) in output_queue. Next stage is then told to stop. '''
+  async def stage_worker():
+    while True:
+      item = await input_queue.get()
+      if item is None:
+        return
+      result = await process_item(item)
+      if result is not None and output_queue is not None:
+        # Blocks while next stage is busy, so that a fast stage does not run ahead.
+        await output_queue.put(result)
+
+  await asyncio.gather(*[stage_worker() for _ in range(num_workers)])
+  for _ in range(num_next_stage_workers):
+    await output_queue.put(None)
+
+async def get_metadata_of_repos(repo_urls, fetch_executor, clone_executor, make_analysis_executor, journal,
+                                write_row, work_queue=None):
+  ''' Obtains metadata of repositories in three pipelined stages: GitHub metadata fetch, clone, and code
+      analysis, each with its own concurrency and a bounded queue in front of it. At most
+      args.max_checkouts cloned repositories exist at a time. Completed repositories and failed attempts are
+      recorded in journal; a repository that fails is tried again from the start, after a backoff, up to
+      args.max_attempts times. repo_urls may be any iterable, which is read in a thread as it may block
+      (e.g., leasing repositories from work_queue, which is then told about every finished repository).
+      Analysis runs in a process pool made by make_analysis_executor, which is made again if a worker dies.
+      Returns repositories that were given up on. '''
+  loop = asyncio.get_running_loop()
+  fetch_queue = asyncio.Queue(maxsize=args.fetch_procs)
+  clone_queue = asyncio.Queue(maxsize=args.clone_threads)
+  analysis_queue = asyncio.Queue(maxsize=args.num_procs)
+  checkout_slots = asyncio.Semaphore(args.max_checkouts)
+  analysis_executor = make_analysis_executor()
+  attempts = dict()
+  # GitHub metadata fetched in batches (None if it was not), kept for retries.
+  prefetched_metadata = dict()
+  # Number of times analysis of a repository was cut short by a worker of the pool dying.
+  pool_breaks = dict()
+  # Repositories neither completed nor given up on; stages stop once all repositories are read and there
+  # are none.
+  unfinished_repo_urls = set()
+  failed_repo_urls = []
+  all_read = False
+  all_finished = asyncio.Event()
+  retry_tasks = set()
+
+  def finish(repo_url, completed=True):
+    unfinished_repo_urls.discard(repo_url)
+    prefetched_metadata.pop(repo_url, None)
+    if not completed:
+      failed_repo_urls.append(repo_url)
+    if work_queue is not None:
+      work_queue.set_status(repo_url, 'done' if completed else 'failed')
+    if all_read and len(unfinished_repo_urls) == 0:
+      all_finished.set()
+
+  async def retry(repo_url):
+    await asyncio.sleep(args.retry_backoff * 2 ** (attempts[repo_url] - 1))
+    await fetch_queue.put((repo_url, prefetched_metadata[repo_url], 0))
+
+  def fail(repo_url, stage, err):
+    timed_out = isinstance(err, (RepositoryTimeout, CloneTimeout))
+    attempts[repo_url] += 1
+    print('Attempt', attempts[repo_url], 'on', repo_url, 'failed in', stage + ':',
+          'timed out' if timed_out else repr(err), file=sys.stderr)
+    journal.record_failure(repo_url, stage, repr(err), attempts[repo_url], timed_out)
+    if attempts[repo_url] < args.max_attempts:
+      retry_task = asyncio.create_task(retry(repo_url))
+      retry_tasks.add(retry_task)
+      retry_task.add_done_callback(retry_tasks.discard)
+    else:
+      finish(repo_url, completed=False)
+
+  def get_time_left(time_used):
+    ''' Returns seconds left of args.repo_timeout to a repository, or None if there is no timeout '''
+    if args.repo_timeout <= 0:
+      return None
+    return args.repo_timeout - time_used
+
+  async def read_repos():
+    nonlocal all_read
+    if args.github_api == 'graphql':
+      # Metadata of next batch is fetched while earlier repositories move through the pipeline.
+      items = fetch_github_metadata_in_batches(repo_urls, args.graphql_batch_size)
+    else:
+      items = ((repo_url, None) for repo_url in repo_urls)
+    while True:
+      item = await loop.run_in_executor(None, next, items, None)
+      if item is None:
+        break
+      attempts[item[0]] = 0
+      prefetched_metadata[item[0]] = item[1]
+      unfinished_repo_urls.add(item[0])
+      await fetch_queue.put(item + (0,))
+    all_read = True
+    if len(unfinished_repo_urls) == 0:
+      all_finished.set()
+    # Failed repositories are put back in fetch queue until they are completed or given up on.
+    await all_finished.wait()
+    for _ in range(args.fetch_procs):
+      await fetch_queue.put(None)
+
+  async def fetch(item):
+    repo_url, github_metadata, time_used = item
+    start_time = time.time()
+    try:
+      metadata, upstream_url = await loop.run_in_executor(fetch_executor, fetch_repo_github_metadata,
+                                                          repo_url, github_metadata, get_time_left(time_used))
+      return repo_url, metadata, upstream_url, time_used + time.time() - start_time
+    except Exception as err:
+      fail(repo_url, 'fetch', err)
+      return None
+
+  def remove_checkout(tmp_dir_to_clone_repo):
+    shutil.rmtree(tmp_dir_to_clone_repo, ignore_errors=True)
+    checkout_slots.release()
+
+  async def clone(item):
+    repo_url, metadata, upstream_url, time_used = item
+    await checkout_slots.acquire()
+    tmp_dir_to_clone_repo = tempfile.mkdtemp()
+    repo_dir = os.path.join(tmp_dir_to_clone_repo, 'repo')
+    start_time = time.time()
+    try:
+      # git is killed once time is up, so a stalled clone frees its thread and checkout slot.
+      await loop.run_in_executor(clone_executor, single_repo.clone_repository_for_analysis,
+                                 repo_url, repo_dir, upstream_url, get_time_left(time_used))
+      return repo_url, metadata, tmp_dir_to_clone_repo, time_used + time.time() - start_time
+    except Exception as err:
+      remove_checkout(tmp_dir_to_clone_repo)
+      fail(repo_url, 'clone', err)
+      return None
+
+  async def analyze_in_pool(repo_url, repo_dir, time_used):
+    ''' Analyzes repository in analysis pool. A worker that dies (e.g., killed by the kernel when out of
+        memory) breaks the pool and fails all analyses running in it, while only one of them may have caused
+        it. So the pool is made again, and they are analyzed again without counting an attempt, unless one
+        of them already broke the pool args.max_attempts times. '''
+    nonlocal analysis_executor
+    start_time = time.time()
+    while True:
+      executor = analysis_executor
+      try:
+        return await loop.run_in_executor(executor, analyze_repo, repo_url, repo_dir,
+                                          get_time_left(time_used + time.time() - start_time))
+      except BrokenProcessPool:
+        if executor is analysis_executor:
+          print('Analysis pool broke; starting a new one', file=sys.stderr)
+          analysis_executor = make_analysis_executor()
+          executor.shutdown(wait=False)
+        pool_breaks[repo_url] = pool_breaks.get(repo_url, 0) + 1
+        if pool_breaks[repo_url] >= args.max_attempts:
+          raise
+
+  async def analyze(item):
+    repo_url, metadata, tmp_dir_to_clone_repo, time_used = item
+    try:
+      metadata.update(await analyze_in_pool(repo_url, os.path.join(tmp_dir_to_clone_repo, 'repo'), time_used))
+      journal.record_row(repo_url, metadata)
+      write_row(metadata)
+      finish(repo_url)
+    except Exception as err:
+      fail(repo_url, 'analysis', err)
+    finally:
+      remove_checkout(tmp_dir_to_clone_repo)
+
+  try:
+    await asyncio.gather(read_repos(),
+                         run_stage(fetch_queue, clone_queue, args.fetch_procs, args.clone_threads, fetch),
+                         run_stage(clone_queue, analysis_queue, args.clone_threads, args.num_procs, clone),
+                         run_stage(analysis_queue, None, args.num_procs, 0, analyze))
+  finally:
+    analysis_executor.shutdown()
+  return failed_repo_urls
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+      description = "Script to get metadata of a list of repositories"
+      )
+  single_repo.add_common_arguments(parser)
+  parser.add_argument("-f", "--url-file",
+                      help = "File containing list of git URLs, one per line (required without --queue)")
+  parser.add_argument("-o", "--output-csv-file", required=True,
+                      help = "File to store CSV data")
+  parser.add_argument("-n", "--num-procs", type=int, default=os.cpu_count() or 1,
+                      help = "Number of repositories to analyze in parallel (default: num_cpus_on_system)")
+  parser.add_argument("--fetch-procs", type=int, default=4,
+                      help = "Number of repositories whose GitHub metadata is fetched in parallel (default: 4)")
+  parser.add_argument("--clone-threads", type=int, default=4,
+                      help = "Number of repositories cloned in parallel (default: 4)")
+  parser.add_argument("--max-checkouts", type=int,
+                      help = "Maximum number of cloned repositories on disk at a time "
+                             "(default: num_procs + clone_threads)")
+  parser.add_argument("--graphql-batch-size", type=int, default=github_graphql.default_batch_size,
+                      help = "Number of repositories per GraphQL request with --github-api graphql "
+                             "(default: " + str(github_graphql.default_batch_size) + ")")
+  parser.add_argument("--journal",
+                      help = "File recording every completed repository and failed attempt as soon as it "
+                             "happens (default: output CSV file name followed by .journal). If it exists, "
+                             "repositories completed by an earlier run are not processed again")
+  parser.add_argument("--restart", action='store_true',
+                      help = "Discard journal of earlier runs and process all repositories")
+  parser.add_argument("--max-attempts", type=int, default=3,
+                      help = "Number of times a repository is tried before giving up on it in a run (default: 3)")
+  parser.add_argument("--retry-backoff", type=float, default=60,
+                      help = "Seconds before first retry of a failed repository, doubling with every retry "
+                             "(default: 60)")
+  parser.add_argument("--repo-timeout", type=float, default=0,
+                      help = "Seconds a repository may spend in GitHub metadata fetch, clone and analysis "
+                             "before it is failed as timed out (default: no limit)")
+  parser.add_argument("--metrics-file",
+                      help = "File to also store metadata in as typed columns (see src/metrics_file.py), in which "
+                             "failed metrics are nulls with an error code rather than -1. rank_repos.py reads it "
+                             "without parsing")
+  parser.add_argument("--shard",
+                      help = "Process only repositories of shard I (0-based) of N, given as I/N. Shard of a "
+                             "repository is a hash of its URL, so runs on N nodes with the same list and shards "
+                             "0/N to N-1/N process every repository once")
+  parser.add_argument("--queue",
+                      help = "SQLite work queue (see src/work_queue.py) shared with runs on other nodes. "
+                             "Repositories of -f, if given, are added to it, and this run leases repositories "
+                             "from it until none are left")
+  parser.add_argument("--lease-time", type=float, default=7200,
+                      help = "Seconds after which repositories leased from --queue by a run that did not finish "
+                             "them are leased to another run (default: 7200)")
+  args = parser.parse_args()
+  if args.url_file is None and args.queue is None:
+    parser.error("-f/--url-file is required without --queue")
+  if args.max_checkouts is None:
+    args.max_checkouts = args.num_procs + args.clone_threads
+  single_repo.args = args
+  if args.trace_file is not None:
+    tracing.enable_tracing(args.trace_file, truncate=True)
+
+  repo_urls = read_repo_urls(args.url_file) if args.url_file is not None else []
+  if args.shard is not None:
+    try:
+      shard_index, num_shards = parse_shard(args.shard)
+    except ValueError as e:
+      sys.exit(str(e))
+    repo_urls = [repo_url for repo_url in repo_urls if get_shard(repo_url, num_shards) == shard_index]
+  journal_file_name = args.journal or args.output_csv_file + '.journal'
+  if args.restart and os.path.exists(journal_file_name):
+    os.remove(journal_file_name)
+  try:
+    journal = BatchJournal(journal_file_name)
+  except BlockingIOError:
+    sys.exit("Journal " + journal_file_name + " is used by another run")
+  # Duplicates in list of URLs are processed once.
+  pending_repo_urls = [repo_url for repo_url in remove_duplicate_repo_urls(repo_urls) if not journal.is_done(repo_url)]
+  num_repos = len(journal.rows) + len(pending_repo_urls)
+  if len(journal.rows) > 0 and args.queue is None:
+    print('Resuming from', journal_file_name + ':', len(journal.rows), 'repositories are done,',
+          len(pending_repo_urls), 'are left', file=sys.stderr)
+
+  work_queue = None
+  if args.queue is not None:
+    work_queue = SQLiteWorkQueue(args.queue)
+    work_queue.add_repositories(repo_urls)
+    for repo_url in journal.rows:
+      work_queue.set_status(repo_url, 'done')
+    # Repositories are leased a few at a time, so that runs on all nodes keep busy until the queue is empty.
+    pending_repo_urls = (repo_url for repo_url in work_queue.lease_repositories(get_worker_id(), args.fetch_procs,
+                                                                                args.lease_time)
+                         if not journal.is_done(repo_url))
+    num_repos = None
+
+  # Rate limit budgets of tokens are tracked in a manager process, so that workers spread their requests
+  # over all tokens and throttle together before any token is exhausted.
+  manager = multiprocessing.Manager()
+  token_scheduler = TokenScheduler(args.token, manager.dict(), manager.Lock())
+  http_cache.enable_token_scheduler(token_scheduler)
+
+  with open(args.output_csv_file, 'w', newline='') as output_csvfile:
+    writer = csv.DictWriter(output_csvfile, fieldnames=single_repo.get_metric_fields())
+    writer.writeheader()
+    # Output is rebuilt from journal, so it holds all completed repositories even if an earlier run died
+    # while writing it.
+    for row in journal.rows.values():
+      row = single_repo.get_csv_row(row)
+      if not set(row) <= set(writer.fieldnames):
+        sys.exit("Journal " + journal_file_name + " has other fields than those of this run; use --restart")
+      writer.writerow(row)
+    output_csvfile.flush()
+    num_done = len(journal.rows)
+
+    def write_row(repo_metadata):
+      global num_done
+      # Write rows as they finish so that partial results are visible during long runs.
+      writer.writerow(single_repo.get_csv_row(repo_metadata))
+      output_csvfile.flush()
+      num_done += 1
+      if args.debug:
+        print('Processed', num_done, 'of', num_repos if num_repos is not None else 'queued', 'repositories',
+              file=sys.stderr)
+
+    def make_analysis_executor():
+      executor = ProcessPoolExecutor(max_workers=args.num_procs, initializer=init_worker,
+                                     initargs=(args, token_scheduler))
+      # Workers would be forked on first submit, while clone threads start git (see
+      # clone_repo.git_start_lock), so fork them now. A pool made again after a worker died is too.
+      with git_start_lock:
+        executor.submit(int)
+      return executor
+
+    # GitHub requests and clones mostly wait on network, while analysis needs CPUs, so every stage has its
+    # own workers. Fetch workers are processes as perceval clients are not thread-safe; clones are git
+    # subprocesses, so threads suffice for them.
+    with ProcessPoolExecutor(max_workers=args.fetch_procs, initializer=init_worker,
+                             initargs=(args, token_scheduler)) as fetch_executor, \
+         ThreadPoolExecutor(max_workers=args.clone_threads) as clone_executor:
+      failed_repo_urls = asyncio.run(get_metadata_of_repos(pending_repo_urls, fetch_executor, clone_executor,
+                                                           make_analysis_executor, journal, write_row, work_queue))
+  journal.close()
+  if args.metrics_file is not None:
+    # Metrics file is written at once, as its columns need all rows. Like the CSV file, it holds all
+    # repositories of the journal.
+    metrics_file.write_metrics_file(args.metrics_file, single_repo.get_metric_fields(), list(journal.rows.values()))
+
+  if len(failed_repo_urls) > 0:
+    # Next run with same journal tries them again (with --queue, once work_queue.py retry-failed is run).
+    print(len(failed_repo_urls), 'repositories failed:', file=sys.stderr)
+    for repo_url in failed_repo_urls:
+      failure = journal.failures[repo_url]
+      print('   ', repo_url, failure['status'], 'in', failure['stage'] + ':', failure['error'], file=sys.stderr)
+
+  token_scheduler.print_report()
+  # Workers have exited by now, so their peak memory is known. It tells how many workers fit on a node.
+  print('Peak memory (MB) of a worker process:', single_repo.get_peak_memory()[1], file=sys.stderr)
+  if args.trace_file is not None:
+    tracing.print_summary(tracing.summarize_trace(args.trace_file))
+
+  # Mirror cache is trimmed once per run rather than per repository, as sizing all mirrors walks the cache.
+  if args.mirror_cache_dir is not None and args.mirror_cache_max_size > 0:
+    evict_mirrors(args.mirror_cache_dir, args.mirror_cache_max_size)
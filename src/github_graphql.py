@@ -0,0 +1,140 @@
+#! /usr/bin/env python3
+
+# MIT License
+# 
+# Copyright (c) 2022 Niranjan Hasabnis
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import json
+from datetime import datetime, timedelta, timezone
+
+import requests
+from dateutil.parser import isoparse
+
+github_graphql_url = "https://api.github.com/graphql"
+
+# Number of repositories whose metadata is requested in one GraphQL query
+default_batch_size = 25
+# Seconds to wait for a response, so that a hung request does not stall the batch driver
+request_timeout = 120
+# Parents of a fork are followed up to this depth to find the root of its fork network, which REST reports
+# as 'source' and which GraphQL has no field for.
+max_fork_depth = 5
+
+def get_parents_query(depth):
+  ''' Returns query of URL of parent of repository, of its parent, and so on, up to depth levels '''
+  if depth == 0:
+    return ''
+  return 'parent { url isFork %s}' % get_parents_query(depth - 1)
+
+repository_query_fields = '''
+    stargazerCount
+    forkCount
+    createdAt
+    watchers { totalCount }
+    openIssues: issues(states: OPEN) { totalCount }
+    openPullRequests: pullRequests(states: OPEN) { totalCount }
+    %s
+    defaultBranchRef { target { ... on Commit { history { totalCount } } } }
+''' % get_parents_query(max_fork_depth)
+
+def get_owner_and_repository(repo_url):
+  # Owner and repository names from https://github.com/<owner>/<repo_name>
+  return repo_url.split('/')[3], repo_url.split('/')[4]
+
+def get_count_as_paginated_by_rest(count):
+  ''' REST collector obtains counts from Link header of pages of one entry, which is absent if there is only
+      one page, and then reports 0. Do the same so that metrics do not depend on the collector used. '''
+  return count if count > 1 else 0
+
+def get_source(repository_data):
+  ''' Returns data of root of fork network of repository (None if it is not a fork), as REST 'source', or of
+      deepest parent queried if root is deeper than max_fork_depth (which is then a fork itself) '''
+  source = None
+  while repository_data.get('parent') is not None:
+    source = repository_data = repository_data['parent']
+  return source
+
+def make_batch_query(repo_urls, closed_issue_windows, current_date):
+  ''' Returns GraphQL query for metadata of all repo_urls. Repository i is aliased as r<i> and its count of
+      closed issues and PRs in window j (updated since start of window, as with REST 'since') as r<i>_w<j>.
+      Windows end at current_date, which is a day boundary for REST and GraphQL to give the same counts. '''
+  query_parts = []
+  for i, repo_url in enumerate(repo_urls):
+    owner, repository = get_owner_and_repository(repo_url)
+    query_parts.append('  r%d: repository(owner: %s, name: %s) {%s  }' %
+                       (i, json.dumps(owner), json.dumps(repository), repository_query_fields))
+    for j, (_, days) in enumerate(closed_issue_windows):
+      from_date = current_date - timedelta(days=days)
+      search_query = 'repo:%s/%s is:closed updated:>=%s' % (owner, repository, from_date.isoformat(timespec='seconds') + 'Z')
+      query_parts.append('  r%d_w%d: search(query: %s, type: ISSUE) { issueCount }' % (i, j, json.dumps(search_query)))
+  query_parts.append('  rateLimit { cost remaining resetAt }')
+  return 'query {\n' + '\n'.join(query_parts) + '\n}'
+
+def get_repository_metadata(repository_data, window_counts, closed_issue_windows):
+  ''' Converts GraphQL data of a repository to the fields reported by REST collector '''
+  metadata = dict()
+  metadata['stargazers_count'] = repository_data['stargazerCount']
+  metadata['subscribers_count'] = repository_data['watchers']['totalCount']
+  metadata['forks_count'] = repository_data['forkCount']
+  # REST open_issues_count includes open pull requests.
+  metadata['open_issues'] = repository_data['openIssues']['totalCount'] + repository_data['openPullRequests']['totalCount']
+  created_at_time_delta = datetime.now(timezone.utc) - isoparse(repository_data['createdAt'])
+  metadata['repo_age_in_days'] = created_at_time_delta.days
+  metadata['created_at'] = repository_data['createdAt']
+  # REST collector reports one less than number of commits on default branch.
+  metadata['num_commits'] = repository_data['defaultBranchRef']['target']['history']['totalCount'] - 1
+  metadata['open_issues_and_pr_now'] = get_count_as_paginated_by_rest(metadata['open_issues'])
+  for (field, _), count in zip(closed_issue_windows, window_counts):
+    metadata[field] = get_count_as_paginated_by_rest(count)
+  return metadata
+
+def fetch_repositories_metadata(repo_urls, token, closed_issue_windows, graphql_url=github_graphql_url, session=None):
+  ''' Fetches GitHub metadata of all repo_urls in one GraphQL request. Returns dictionary from repository URL to
+      its metadata and URL of root of its fork network (None if it is not a fork), along with rate limit
+      info of the request. Repositories that could not be fetched (e.g., missing, or without commits) are
+      left out, so that caller can fall back to REST API for them. '''
+  session = session or requests.Session()
+  # Windows start at a day boundary, as those of REST collector do.
+  current_date = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+  response = session.post(graphql_url, json={'query': make_batch_query(repo_urls, closed_issue_windows, current_date)},
+                          headers={'Authorization': 'bearer ' + token}, timeout=request_timeout)
+  response.raise_for_status()
+  # Errors on individual repositories come with partial data, which is still used.
+  data = response.json().get('data') or dict()
+
+  repositories_metadata = dict()
+  for i, repo_url in enumerate(repo_urls):
+    repository_data = data.get('r%d' % i)
+    window_data = [data.get('r%d_w%d' % (i, j)) for j in range(len(closed_issue_windows))]
+    if repository_data is None or repository_data['defaultBranchRef'] is None or None in window_data:
+      continue
+    # Forks are cloned borrowing objects from mirror of root of their fork network, as with REST collector.
+    source = get_source(repository_data)
+    if source is not None and source['isFork']:
+      # Root is deeper than query; REST collector finds it.
+      continue
+    upstream_url = source['url'] if source is not None else None
+    repositories_metadata[repo_url] = (get_repository_metadata(repository_data,
+                                                               [window['issueCount'] for window in window_data],
+                                                               closed_issue_windows),
+                                       upstream_url)
+  return repositories_metadata, data.get('rateLimit')
@@ -0,0 +1,248 @@
+#! /usr/bin/env python3
+
+# MIT License
+# 
+# Copyright (c) 2022 Niranjan Hasabnis
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import json
+import re
+import sqlite3
+import time
+
+import requests
+from perceval.backends.core import github as perceval_github
+
+import tracing
+from token_scheduler import get_rate_limit_resource
+
+# Seconds for which a cached response of a resource type is used without asking GitHub. Older responses are
+# revalidated with a conditional request, which does not count against rate limit if response is unchanged
+# (304). None means never cache (rate limit status must always be fresh).
+default_ttl_policy = {'rate_limit': None,
+                      'repository': 6 * 3600,
+                      'commits': 6 * 3600,
+                      'contributors': 6 * 3600,
+                      'issues': 3600,
+                      'other': 0}
+
+# Headers that describe the original transfer or rate limit state, and so must not be replayed from cache
+_uncacheable_headers = ['content-encoding', 'content-length', 'transfer-encoding', 'connection',
+                        'x-ratelimit-limit', 'x-ratelimit-remaining', 'x-ratelimit-reset', 'x-ratelimit-used',
+                        'x-ratelimit-resource']
+
+# Cache, TTL policy and token scheduler of this process, once enabled, and adapter shared by all its GitHub clients
+http_cache = None
+http_cache_ttl_policy = None
+http_cache_pool_maxsize = 16
+token_scheduler = None
+shared_adapter = None
+
+def get_resource_type(url):
+  ''' Returns resource type of GitHub API URL for TTL policy, e.g., 'issues' for .../repos/<o>/<r>/issues?... '''
+  path = requests.utils.urlparse(url).path.rstrip('/')
+  if path.endswith('/rate_limit'):
+    return 'rate_limit'
+  match = re.search(r'/repos/[^/]+/[^/]+(/([^/]+))?$', path)
+  if match is None:
+    return 'other'
+  return match.group(2) if match.group(2) is not None else 'repository'
+
+class HttpCache(object):
+  ''' Responses of GET requests, along with their validators (ETag, Last-Modified), in a SQLite database
+      that can be shared by concurrent processes '''
+
+  def __init__(self, db_file_name):
+    self.connection = sqlite3.connect(db_file_name, timeout=60, check_same_thread=False)
+    self.connection.execute('PRAGMA journal_mode=WAL')
+    with self.connection:
+      self.connection.execute('CREATE TABLE IF NOT EXISTS responses ('
+                              'request_key TEXT PRIMARY KEY, status_code INTEGER NOT NULL, headers TEXT NOT NULL, '
+                              'body BLOB NOT NULL, stored_at REAL NOT NULL)')
+
+  def get(self, request_key):
+    ''' Returns status code, headers, body and time of storing of cached response, or None '''
+    row = self.connection.execute('SELECT status_code, headers, body, stored_at FROM responses WHERE request_key = ?',
+                                  [request_key]).fetchone()
+    if row is None:
+      return None
+    return row[0], json.loads(row[1]), row[2], row[3]
+
+  def put(self, request_key, status_code, headers, body):
+    with self.connection:
+      self.connection.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)',
+                              [request_key, status_code, json.dumps(headers), body, time.time()])
+
+  def touch(self, request_key):
+    ''' Marks cached response as revalidated now '''
+    with self.connection:
+      self.connection.execute('UPDATE responses SET stored_at = ? WHERE request_key = ?', [time.time(), request_key])
+
+class GitHubHTTPAdapter(requests.adapters.HTTPAdapter):
+  ''' Transport adapter that serves GET requests from HttpCache (if given) while they are fresh as per TTL
+      policy, and revalidates stale ones with If-None-Match/If-Modified-Since. Requests that go to GitHub are
+      sent with the token picked by TokenScheduler (if given). A single instance is mounted on every session,
+      so sessions also share its connection pool. '''
+
+  def __init__(self, http_cache, ttl_policy, token_scheduler=None, **kwargs):
+    super().__init__(**kwargs)
+    self.http_cache = http_cache
+    self.ttl_policy = ttl_policy
+    self.token_scheduler = token_scheduler
+    self.num_cache_hits = 0
+    self.num_not_modified = 0
+    self.num_fetched = 0
+
+  def send(self, request, **kwargs):
+    start_time = time.time()
+    response, cache_outcome = self.send_through_cache(request, **kwargs)
+    if tracing.is_enabled():
+      # A REST request costs 1 unless answered from cache or not modified; cost of a GraphQL query depends
+      # on the query, and is recorded by its caller.
+      if request.url.rstrip('/').endswith('/graphql'):
+        attributes = {'resource': 'graphql'}
+      else:
+        resource_type = get_resource_type(request.url)
+        is_free = cache_outcome in ['hit', 'not_modified'] or resource_type == 'rate_limit'
+        attributes = {'resource': resource_type, 'rate_limit_cost': 0 if is_free else 1}
+      tracing.record_event('github_request', time.time() - start_time, status=response.status_code,
+                           cache=cache_outcome, **attributes)
+    return response
+
+  def send_through_cache(self, request, **kwargs):
+    ''' Returns response to request, from cache if possible, along with how cache was used: 'hit' if response
+        came from cache without asking GitHub, 'not_modified' if GitHub confirmed cached response, 'miss' if
+        response was fetched, or None if response is not cacheable '''
+    if self.http_cache is None or request.method != 'GET':
+      return self.send_with_token(request, **kwargs), None
+    ttl = self.ttl_policy.get(get_resource_type(request.url), self.ttl_policy['other'])
+    if ttl is None:
+      return self.send_with_token(request, **kwargs), None
+
+    # Responses to same URL may differ with media type requested, but not with token for public repositories.
+    request_key = request.url + ' ' + request.headers.get('Accept', '')
+    cached_response = self.http_cache.get(request_key)
+    if cached_response is not None:
+      status_code, headers, body, stored_at = cached_response
+      if time.time() - stored_at < ttl:
+        self.num_cache_hits += 1
+        return self.build_cached_response(request, status_code, headers, body), 'hit'
+      if 'etag' in headers:
+        request.headers['If-None-Match'] = headers['etag']
+      if 'last-modified' in headers:
+        request.headers['If-Modified-Since'] = headers['last-modified']
+
+    response = self.send_with_token(request, **kwargs)
+    if response.status_code == 304 and cached_response is not None:
+      self.num_not_modified += 1
+      self.http_cache.touch(request_key)
+      cached_response = self.build_cached_response(request, status_code, headers, body)
+      # Rate limit state comes from the live response.
+      for header, value in response.headers.items():
+        if header.lower().startswith('x-ratelimit-'):
+          cached_response.headers[header] = value
+      return cached_response, 'not_modified'
+
+    self.num_fetched += 1
+    if response.status_code == 200:
+      self.http_cache.put(request_key, response.status_code,
+                          {header.lower(): value for header, value in response.headers.items()
+                           if header.lower() not in _uncacheable_headers},
+                          response.content)
+    return response, 'miss'
+
+  def send_with_token(self, request, **kwargs):
+    ''' Sends request with token picked by token scheduler, moving to another token if it hits rate limit '''
+    # Rate limit status is free, and is about the token perceval asks it for.
+    if self.token_scheduler is None or get_resource_type(request.url) == 'rate_limit':
+      return super().send(request, **kwargs)
+    resource = get_rate_limit_resource(request.url)
+    authorization_scheme = request.headers.get('Authorization', 'token').split(' ')[0]
+    for _ in range(len(self.token_scheduler.tokens) + 1):
+      token = self.token_scheduler.acquire(resource)
+      request.headers['Authorization'] = authorization_scheme + ' ' + token
+      response = super().send(request, **kwargs)
+      self.token_scheduler.update(token, resource, response.headers)
+      rate_limited = response.headers.get('X-RateLimit-Remaining') == '0' or 'Retry-After' in response.headers
+      if response.status_code not in [403, 429] or not rate_limited:
+        break
+      response.close()
+    return response
+
+  def build_cached_response(self, request, status_code, headers, body):
+    response = requests.Response()
+    response.status_code = status_code
+    response.reason = 'OK'
+    response.headers = requests.structures.CaseInsensitiveDict(headers)
+    response._content = body
+    response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+    response.url = request.url
+    response.request = request
+    return response
+
+def get_shared_adapter(max_retries=0):
+  ''' Returns adapter shared by GitHub sessions of this process, creating it on first use '''
+  global shared_adapter
+  if shared_adapter is None:
+    shared_adapter = GitHubHTTPAdapter(http_cache, http_cache_ttl_policy, token_scheduler,
+                                       pool_maxsize=http_cache_pool_maxsize, max_retries=max_retries)
+  return shared_adapter
+
+class SharedAdapterGitHubClient(perceval_github.GitHubClient):
+  ''' perceval GitHubClient whose HTTP session uses the shared adapter '''
+
+  def _create_http_session(self):
+    super()._create_http_session()
+    # Retry configuration of perceval's own adapter is kept.
+    adapter = get_shared_adapter(max_retries=self.session.get_adapter('https://').max_retries)
+    self.session.mount('https://', adapter)
+    self.session.mount('http://', adapter)
+
+def make_session():
+  ''' Returns requests session using shared adapter, for GitHub requests not made by perceval '''
+  session = requests.Session()
+  session.mount('https://', get_shared_adapter())
+  session.mount('http://', get_shared_adapter())
+  return session
+
+def enable_github_http_cache(db_file_name, ttl_policy=default_ttl_policy, pool_maxsize=16):
+  ''' Routes requests of all perceval GitHub clients created from now on in this process, including clients
+      created internally by perceval GitHub backend, through a shared caching adapter '''
+  global http_cache, http_cache_ttl_policy, http_cache_pool_maxsize
+  http_cache = HttpCache(db_file_name)
+  http_cache_ttl_policy = ttl_policy
+  http_cache_pool_maxsize = pool_maxsize
+  perceval_github.GitHubClient = SharedAdapterGitHubClient
+
+def enable_token_scheduler(scheduler):
+  ''' Sends GitHub requests of all perceval GitHub clients created from now on in this process, and of
+      sessions using shared adapter, with tokens picked by scheduler '''
+  global token_scheduler
+  token_scheduler = scheduler
+  perceval_github.GitHubClient = SharedAdapterGitHubClient
+
+def parse_ttl_policy(ttl_arguments):
+  ''' Returns default TTL policy overridden by arguments of the form <resource_type>=<seconds> '''
+  ttl_policy = dict(default_ttl_policy)
+  for ttl_argument in ttl_arguments or []:
+    resource_type, _, seconds = ttl_argument.partition('=')
+    ttl_policy[resource_type] = None if seconds == 'none' else int(seconds)
+  return ttl_policy
@@ -0,0 +1,115 @@
+#! /usr/bin/env python3
+
+# MIT License
+# 
+# Copyright (c) 2022 Niranjan Hasabnis
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import json
+import os
+import re
+import subprocess
+
+import tracing
+
+# Names of files in root directory of a repository that hold its license, e.g., LICENSE, LICENSE.md,
+# LICENCE.txt, LICENSE-MIT, COPYING, COPYING.LESSER, UNLICENSE
+license_file_pattern = re.compile(r'^(un)?licen[cs]e([.\-_].*)?$|^copying([.\-_].*)?$', re.IGNORECASE)
+
+# Phrases that together identify a license, normalized by normalize_license_text(). They do not depend on
+# copyright holders, years or formatting, and more specific licenses come before those whose phrases they
+# also contain.
+license_signatures = [
+  ('Apache-2.0', ['apache license version 2 0']),
+  ('AGPL-3.0', ['gnu affero general public license version 3 19 november 2007']),
+  ('LGPL-3.0', ['gnu lesser general public license version 3 29 june 2007']),
+  ('LGPL-2.1', ['gnu lesser general public license version 2 1 february 1999']),
+  ('GPL-3.0', ['gnu general public license version 3 29 june 2007']),
+  ('GPL-2.0', ['gnu general public license version 2 june 1991']),
+  ('MPL-2.0', ['mozilla public license version 2 0']),
+  ('EPL-2.0', ['eclipse public license v 2 0']),
+  ('EPL-1.0', ['eclipse public license v 1 0']),
+  ('BSL-1.0', ['boost software license version 1 0']),
+  ('MIT', ['permission is hereby granted free of charge to any person obtaining a copy of this software',
+           'the above copyright notice and this permission notice shall be included in all copies or '
+           'substantial portions of the software']),
+  ('BSD-3-Clause', ['redistribution and use in source and binary forms with or without modification are '
+                    'permitted provided that the following conditions are met',
+                    'neither the name of']),
+  ('BSD-2-Clause', ['redistribution and use in source and binary forms with or without modification are '
+                    'permitted provided that the following conditions are met']),
+  ('ISC', ['distribute this software for any purpose with or without fee is hereby granted']),
+  ('Zlib', ['in no event will the authors be held liable for any damages arising from the use of this software',
+            'altered source versions must be plainly marked as such']),
+  ('Unlicense', ['this is free and unencumbered software released into the public domain']),
+  ('CC0-1.0', ['cc0 1 0 universal']),
+]
+
+def normalize_license_text(text):
+  ''' Lowercases text and replaces punctuation, markup and runs of whitespace by single spaces '''
+  return ' '.join(re.findall(r'[a-z0-9]+', text.lower()))
+
+# Signature phrases are normalized once, when module is imported.
+normalized_signatures = [(license_id, [normalize_license_text(phrase) for phrase in phrases])
+                         for license_id, phrases in license_signatures]
+
+def classify_license_text(text):
+  ''' Returns SPDX identifier of license in text, or None if it is not one of license_signatures '''
+  normalized_text = ' ' + normalize_license_text(text) + ' '
+  for license_id, phrases in normalized_signatures:
+    if all(' ' + phrase + ' ' in normalized_text for phrase in phrases):
+      return license_id
+  return None
+
+def get_license_files(repo_directory):
+  ''' Returns license files in root directory of repository, sorted by name '''
+  return sorted(os.path.join(repo_directory, file_name) for file_name in os.listdir(repo_directory)
+                if license_file_pattern.match(file_name) and os.path.isfile(os.path.join(repo_directory, file_name)))
+
+def is_valid_license_by_scancode(license_file):
+  ''' Returns 1 if scancode finds a license in license_file that is not a generic CLA, 0 otherwise (also if
+      scancode is not available) '''
+  try:
+    with tracing.span('scancode_process'):
+      output_json = subprocess.check_output(['scancode', '-l', '--quiet', '--json', '-', license_file],
+                                            stderr=subprocess.DEVNULL).decode("utf-8")
+  except (subprocess.CalledProcessError, OSError):
+    return 0
+  output_dict = json.loads(output_json)
+  # check that license is not a generic-cla, but a known one such as Apache, MIT, etc.
+  if 'files' in output_dict:
+    license_file_record = output_dict['files'][0]
+    if 'license_expressions' in license_file_record and 'generic-cla' not in license_file_record['license_expressions']:
+      return 1
+  return 0
+
+def is_valid_license(repo_directory):
+  ''' Returns 1 if a license file of repository holds a known license, 0 otherwise. Known licenses are
+      recognized in-process; scancode is only run on license files that are not recognized. '''
+  license_files = get_license_files(repo_directory)
+  for license_file in license_files:
+    with open(license_file, encoding='utf-8', errors='replace') as input_file:
+      if classify_license_text(input_file.read()) is not None:
+        return 1
+  for license_file in license_files:
+    if is_valid_license_by_scancode(license_file) == 1:
+      return 1
+  return 0
@@ -23,6 +23,32 @@
 # SOFTWARE.
 
 import math
+import re
+
+# C/C++ keywords, which are Halstead operators even though they look like identifiers
+c_cpp_keywords = set([
+  'alignas', 'alignof', 'asm', 'auto', 'bool', 'break', 'case', 'catch', 'char', 'char8_t', 'char16_t',
+  'char32_t', 'class', 'const', 'consteval', 'constexpr', 'constinit', 'const_cast', 'continue', 'co_await',
+  'co_return', 'co_yield', 'decltype', 'default', 'delete', 'do', 'double', 'dynamic_cast', 'else', 'enum',
+  'explicit', 'export', 'extern', 'false', 'float', 'for', 'friend', 'goto', 'if', 'inline', 'int', 'long',
+  'mutable', 'namespace', 'new', 'noexcept', 'nullptr', 'operator', 'private', 'protected', 'public',
+  'register', 'reinterpret_cast', 'restrict', 'return', 'short', 'signed', 'sizeof', 'static', 'static_assert',
+  'static_cast', 'struct', 'switch', 'template', 'this', 'thread_local', 'throw', 'true', 'try', 'typedef',
+  'typeid', 'typename', 'union', 'unsigned', 'using', 'virtual', 'void', 'volatile', 'wchar_t', 'while'])
+
+# Identifiers, numbers, and string or character literals (with optional encoding prefix)
+operand_pattern = re.compile(r'[A-Za-z_$][A-Za-z0-9_$]*$|\.?[0-9]|(u8|u|U|L)?R?["\']')
+
+def is_operand(token):
+  return token not in c_cpp_keywords and operand_pattern.match(token) is not None
+
+def get_halstead_volume(operator_counts, operand_counts):
+  ''' Returns Halstead volume N * log2(n) from occurrences of every distinct operator and operand '''
+  vocabulary = len(operator_counts) + len(operand_counts)
+  length = sum(operator_counts.values()) + sum(operand_counts.values())
+  if vocabulary < 2:
+    return 0
+  return length * math.log(vocabulary, 2)
 
 class LizardExtension(object):
 
@@ -32,28 +58,45 @@ class LizardExtension(object):
 
   def __call__(self, tokens, reader):
     ''' This method is called per file.
-        tokens is a list of all the tokens in a file.'''
-    unique_tokens = set()
-    non_unique_tokens = []
+        tokens is a list of all the tokens in a file. Every token is classified as Halstead operator or
+        operand of the function that lizard attributes it to, so Halstead volume of every function is
+        known once the file is read. '''
     for token in tokens:
-      if not(token == ')' or token == '}' or token == ']'):
-        unique_tokens.add(token)
-        non_unique_tokens.append(token)
       yield token
+      # Closing brackets are counted with their opening ones, and preprocessor directives are not code.
+      if token in [')', '}', ']'] or token.startswith('#'):
+        continue
+      function = reader.context.current_function
+      if not hasattr(function, 'halstead_operators'):
+        function.halstead_operators = dict()
+        function.halstead_operands = dict()
+      counts = function.halstead_operands if is_operand(token) else function.halstead_operators
+      counts[token] = counts.get(token, 0) + 1
 
-    num_functions = len(reader.context.fileinfo.function_list)
-    if num_functions == 0:
+    function_list = reader.context.fileinfo.function_list
+    if len(function_list) == 0:
       return
 
-    avg_halstead_vol = round(len(non_unique_tokens) * math.log(len(unique_tokens), 2) / num_functions, 2)
-    avg_cyclomatic_complexity = reader.context.fileinfo.average_cyclomatic_complexity
-    avg_nloc =  reader.context.fileinfo.average_nloc
-    print('avg_nloc:', avg_nloc)
+    # Maintainability index of a function is 171 - 5.2 * ln(V) - 0.23 * CC - 16.2 * ln(NLOC), with V its
+    # Halstead volume. File gets average over its functions that have one.
+    total_maintainability_index = 0
+    num_functions_with_index = 0
+    for function in function_list:
+      halstead_volume = get_halstead_volume(getattr(function, 'halstead_operators', {}),
+                                            getattr(function, 'halstead_operands', {}))
+      function.halstead_volume = round(halstead_volume, 2)
+      # log() is undefined for such functions, so leave them out.
+      if halstead_volume <= 0 or function.nloc <= 0:
+        continue
+      total_maintainability_index += 171 - 5.2 * math.log(halstead_volume) \
+         - 0.23 * function.cyclomatic_complexity \
+         - 16.2 * math.log(function.nloc)
+      num_functions_with_index += 1
+    # File without such functions has no maintainability index, and is left out of repository average.
+    if num_functions_with_index == 0:
+      return
 
-    maintainability_index = 171 - 5.2 * math.log(avg_halstead_vol) \
-         - 0.23 * avg_cyclomatic_complexity \
-         - 16.2 * math.log(avg_nloc)
-    reader.context.fileinfo.maintainability_index = maintainability_index
+    reader.context.fileinfo.maintainability_index = total_maintainability_index / num_functions_with_index
 
   def cross_file_process(self, fileinfos):
     ''' aggregate results across all the files '''
@@ -64,4 +107,6 @@ class LizardExtension(object):
       yield fileinfo
 
   def print_result(self):
+    if self.total_files == 0:
+      return
     print('avg_maintainability_index:', round(self.total_maintainability_index / self.total_files, 2))
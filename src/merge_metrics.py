@@ -0,0 +1,90 @@
+#! /usr/bin/env python3
+
+# MIT License
+# 
+# Copyright (c) 2022 Niranjan Hasabnis
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import argparse
+import csv
+import sys
+
+from work_queue import normalize_repo_url
+
+def has_invalid_field(row):
+  ''' Returns whether row has a field with value -1, which indicates error '''
+  return '-1' in row.values()
+
+def read_csv_files(csv_file_names):
+  ''' Returns field names of all CSV files, in order of first appearance, and dictionary from normalized URL of
+      every repository to its row. Of the rows of a repository found more than once (e.g., in outputs of runs
+      that both leased it), the first one without errors is kept, or the first one if all have errors. '''
+  field_names = []
+  rows = dict()
+  num_duplicates = 0
+  for csv_file_name in csv_file_names:
+    with open(csv_file_name, newline='') as csv_file:
+      reader = csv.DictReader(csv_file)
+      field_names += [field_name for field_name in reader.fieldnames or [] if field_name not in field_names]
+      for row in reader:
+        repo_url = normalize_repo_url(row['repository_uri'])
+        if repo_url in rows:
+          num_duplicates += 1
+          if not has_invalid_field(rows[repo_url]) or has_invalid_field(row):
+            continue
+        rows[repo_url] = row
+  if num_duplicates > 0:
+    print('Dropped', num_duplicates, 'duplicate rows', file=sys.stderr)
+  return field_names, rows
+
+def get_ordered_repo_urls(rows, url_file_name=None):
+  ''' Returns normalized URLs of repositories in order of URL file, if given, followed by others in order of URL '''
+  ordered_repo_urls = []
+  if url_file_name is not None:
+    with open(url_file_name) as url_file:
+      for line in url_file:
+        repo_url = normalize_repo_url(line)
+        if repo_url in rows:
+          ordered_repo_urls.append(repo_url)
+    ordered_repo_urls = list(dict.fromkeys(ordered_repo_urls))
+  listed_repo_urls = set(ordered_repo_urls)
+  return ordered_repo_urls + sorted(repo_url for repo_url in rows if repo_url not in listed_repo_urls)
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+      description = "Script to merge CSV files written by runs of get_repo_metadata_in_batch.py on several "
+                    "shards or nodes into one"
+      )
+  parser.add_argument("csv_files", nargs='+', help = "CSV files to merge")
+  parser.add_argument("-o", "--output-csv-file", required=True, help = "File to store merged CSV data")
+  parser.add_argument("-f", "--url-file",
+                      help = "File containing list of git URLs, one per line, giving order of repositories "
+                             "(default: order of URLs)")
+  args = parser.parse_args()
+
+  field_names, rows = read_csv_files(args.csv_files)
+  with open(args.output_csv_file, 'w', newline='') as output_csvfile:
+    # Fields missing from some files (e.g., sampling fields) are left empty.
+    writer = csv.DictWriter(output_csvfile, fieldnames=field_names)
+    writer.writeheader()
+    for repo_url in get_ordered_repo_urls(rows, args.url_file):
+      writer.writerow(rows[repo_url])
+  print('Merged', len(rows), 'repositories', file=sys.stderr)
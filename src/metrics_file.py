@@ -0,0 +1,227 @@
+#! /usr/bin/env python3
+
+# MIT License
+# 
+# Copyright (c) 2022 Niranjan Hasabnis
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Typed columnar file of repository metadata, written by get_repo_metadata_in_batch.py and read by
+# rank_repos.py without parsing. Unlike the CSV file, in which -1 marks a metric that could not be computed,
+# a failed metric is a null having an error code, so that no value is mistaken for an error.
+#
+# Layout: magic, length of header (8 bytes, little endian), JSON header, and one block per column. Header has
+# number of rows, names of error codes and, for every column, its name, type and offsets of its blocks. Every
+# block starts at a multiple of 8 bytes, so that it is read as a numpy array over memory-mapped file.
+# - int64 and float64 columns: one value per row (0 or NaN for nulls), and one error code (uint8) per row,
+#   0 for a valid value.
+# - string columns: offsets (int64) of rows in data, one more than rows, and UTF-8 data of all rows.
+
+import argparse
+import csv
+import json
+import os
+import sys
+
+import numpy as np
+
+magic = b'GITRANK\x01'
+format_version = 1
+
+# Error codes of failed metrics. Collector records names of errors of metrics; 0 means no error.
+error_codes = {'missing': 1,         # Field is absent or empty (e.g., not estimated, or not in all merged files).
+               'no_functions': 2,    # Analyzer found no function to compute metric from.
+               'legacy_error': 3}    # Field was -1 in a CSV file converted with --legacy-errors.
+error_names = {code: error for error, code in error_codes.items()}
+
+_string_fields = ['repository_owner', 'repository_uri', 'created_at']
+_float_fields = ['average_cyclomatic_complexity_for_repo', 'average_maintainability_index_for_repo',
+                 'sampled_files_fraction']
+_float_suffixes = ('_per_nloc', '_ci95')
+_dtypes = {'int64': '<i8', 'float64': '<f8'}
+
+def get_field_type(field_name):
+  ''' Returns type of field: string, int64 or float64 '''
+  if field_name in _string_fields:
+    return 'string'
+  if field_name in _float_fields or field_name.endswith(_float_suffixes):
+    return 'float64'
+  return 'int64'
+
+def get_error_code(row, field_name, legacy_errors=False):
+  ''' Returns error code of field of row, which is a dictionary from field names to values as reported by the
+      collector (or as read from CSV file) and names of errors of failed fields under 'metric_errors' '''
+  error = row.get('metric_errors', dict()).get(field_name)
+  if error is not None:
+    return error_codes[error]
+  value = row.get(field_name)
+  if value is None or value == '':
+    return error_codes['missing']
+  if legacy_errors and str(value) == '-1':
+    return error_codes['legacy_error']
+  return 0
+
+def _get_padding(length):
+  return b'\0' * (-length % 8)
+
+def _get_blocks(field_name, field_type, rows, legacy_errors):
+  ''' Returns names and contents of blocks of column '''
+  errors = np.array([get_error_code(row, field_name, legacy_errors) for row in rows], dtype=np.uint8)
+  if field_type == 'string':
+    data = [str(row[field_name]).encode('utf-8') if error == 0 else b'' for row, error in zip(rows, errors)]
+    offsets = np.zeros(len(rows) + 1, dtype='<i8')
+    np.cumsum([len(value) for value in data], out=offsets[1:])
+    return [('offsets', offsets.tobytes()), ('data', b''.join(data)), ('errors', errors.tobytes())]
+  null_value = 0 if field_type == 'int64' else float('nan')
+  try:
+    values = np.array([(int if field_type == 'int64' else float)(row[field_name]) if error == 0 else null_value
+                       for row, error in zip(rows, errors)], dtype=_dtypes[field_type])
+  except ValueError as e:
+    raise ValueError("Invalid value of " + field_name + ": " + str(e))
+  return [('values', values.tobytes()), ('errors', errors.tobytes())]
+
+def write_metrics_file(file_name, field_names, rows, legacy_errors=False):
+  ''' Writes metrics file of rows, which are dictionaries from field names to values (see get_error_code()).
+      If legacy_errors, -1 in any field is an error, as in CSV files. File is replaced at once, so that
+      readers never see part of it. '''
+  header = {'version': format_version, 'num_rows': len(rows), 'error_codes': error_codes, 'columns': []}
+  blocks = []
+  # Offsets of blocks are relative to end of header, as they are known before length of header is.
+  offset = 0
+  for field_name in field_names:
+    field_type = get_field_type(field_name)
+    column = {'name': field_name, 'type': field_type}
+    for name, block in _get_blocks(field_name, field_type, rows, legacy_errors):
+      column[name] = [offset, len(block)]
+      blocks.append(block)
+      offset += len(block) + len(_get_padding(len(block)))
+    header['columns'].append(column)
+  header_bytes = json.dumps(header).encode('utf-8')
+  header_bytes += b' ' * (-(len(magic) + 8 + len(header_bytes)) % 8)
+
+  with open(file_name + '.tmp', 'wb') as metrics_file:
+    metrics_file.write(magic)
+    metrics_file.write(len(header_bytes).to_bytes(8, 'little'))
+    metrics_file.write(header_bytes)
+    for block in blocks:
+      metrics_file.write(block)
+      metrics_file.write(_get_padding(len(block)))
+  os.replace(file_name + '.tmp', file_name)
+
+def is_metrics_file(file_name):
+  with open(file_name, 'rb') as input_file:
+    return input_file.read(len(magic)) == magic
+
+def open_metrics_file(file_name):
+  ''' Memory-maps metrics file and returns its header and a view of its blocks '''
+  if not is_metrics_file(file_name):
+    raise ValueError(file_name + " is not a metrics file")
+  contents = np.memmap(file_name, dtype=np.uint8, mode='r')
+  header_length = int.from_bytes(contents[len(magic):len(magic) + 8].tobytes(), 'little')
+  header = json.loads(contents[len(magic) + 8:len(magic) + 8 + header_length].tobytes())
+  if header['version'] != format_version:
+    raise ValueError(file_name + " has version " + str(header['version']) + " of metrics file format")
+  return header, contents[len(magic) + 8 + header_length:]
+
+def _get_block(blocks, column, name, dtype):
+  offset, length = column[name]
+  return blocks[offset:offset + length].view(dtype)
+
+def read_rows(header, blocks, start, stop):
+  ''' Returns field names, columns and error codes of rows start to stop of metrics file opened by
+      open_metrics_file(). Columns and error codes are dictionaries from field names to numpy arrays. Numeric
+      columns without nulls are views of the file; those with nulls are object arrays having None for nulls,
+      as are string columns. '''
+  field_names = [column['name'] for column in header['columns']]
+  columns = dict()
+  errors = dict()
+  for column in header['columns']:
+    field_errors = _get_block(blocks, column, 'errors', np.uint8)[start:stop]
+    is_null = field_errors != 0
+    if column['type'] == 'string':
+      offsets = _get_block(blocks, column, 'offsets', '<i8')[start:stop + 1]
+      data = _get_block(blocks, column, 'data', np.uint8)[offsets[0]:offsets[-1]].tobytes()
+      offsets = (offsets - offsets[0]).tolist()
+      values = np.array([data[begin:end].decode('utf-8') for begin, end in zip(offsets, offsets[1:])], dtype=object)
+    else:
+      values = _get_block(blocks, column, 'values', _dtypes[column['type']])[start:stop]
+      if is_null.any():
+        values = values.astype(object)
+    if is_null.any():
+      values[is_null] = None
+    columns[column['name']] = values
+    errors[column['name']] = field_errors
+  return field_names, columns, errors
+
+def read_metrics_file(file_name):
+  ''' Returns field names, columns and error codes (see read_rows()) of all rows of metrics file '''
+  header, blocks = open_metrics_file(file_name)
+  return read_rows(header, blocks, 0, header['num_rows'])
+
+def read_metrics_file_in_chunks(file_name, chunk_size):
+  ''' Yields field names, columns and error codes (see read_rows()) of every chunk of chunk_size rows of
+      metrics file in order '''
+  header, blocks = open_metrics_file(file_name)
+  for start in range(0, header['num_rows'], chunk_size):
+    yield read_rows(header, blocks, start, min(start + chunk_size, header['num_rows']))
+
+def convert_csv_file(csv_file_name, metrics_file_name, legacy_errors):
+  with open(csv_file_name, newline='') as csv_file:
+    reader = csv.DictReader(csv_file)
+    rows = [row for row in reader]
+  write_metrics_file(metrics_file_name, reader.fieldnames or [], rows, legacy_errors)
+
+def export_csv_file(metrics_file_name, csv_file_name):
+  ''' Writes metrics file as CSV file, in which failed metrics are -1 and missing fields are empty, as the
+      collector writes them '''
+  header, blocks = open_metrics_file(metrics_file_name)
+  field_names, columns, errors = read_rows(header, blocks, 0, header['num_rows'])
+  for field_name in field_names:
+    is_error = (errors[field_name] != 0) & (errors[field_name] != header['error_codes']['missing'])
+    if is_error.any():
+      columns[field_name][is_error] = -1
+  with open(csv_file_name, 'w', newline='') as csv_file:
+    writer = csv.writer(csv_file)
+    writer.writerow(field_names)
+    writer.writerows(zip(*[columns[field_name].tolist() for field_name in field_names]))
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+      description = "Script to convert between CSV files of repository metadata and metrics files"
+      )
+  subparsers = parser.add_subparsers(dest="command", required=True)
+  from_csv_parser = subparsers.add_parser("from-csv", help = "Convert CSV file to metrics file")
+  from_csv_parser.add_argument("csv_file", help = "CSV file of repository metadata")
+  from_csv_parser.add_argument("metrics_file", help = "Metrics file to write")
+  from_csv_parser.add_argument("--legacy-errors", action='store_true',
+                               help = "Make -1 in any field a failed metric, as in CSV files written by the "
+                                      "collector (which cannot tell it from a valid -1)")
+  to_csv_parser = subparsers.add_parser("to-csv", help = "Convert metrics file to CSV file")
+  to_csv_parser.add_argument("metrics_file", help = "Metrics file to read")
+  to_csv_parser.add_argument("csv_file", help = "CSV file to write")
+  args = parser.parse_args()
+
+  try:
+    if args.command == "from-csv":
+      convert_csv_file(args.csv_file, args.metrics_file, args.legacy_errors)
+    elif args.command == "to-csv":
+      export_csv_file(args.metrics_file, args.csv_file)
+  except ValueError as e:
+    sys.exit(str(e))
@@ -0,0 +1,303 @@
+#! /usr/bin/env python3
+
+# MIT License
+# 
+# Copyright (c) 2022 Niranjan Hasabnis
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import argparse
+import csv
+import json
+import sqlite3
+import sys
+
+import numpy as np
+
+import rank_repos
+
+# Weight of every metric (percentage among ranked repositories) in its score, and of every score in overall
+# score. Popularity and maintainability scores are weighted sums of their metrics; quality metrics indicate
+# issues, so quality score is 100 minus weighted sum of its metrics. Same as scores of rank_repos.py.
+default_weight_profile = {'subscribers_count_by_age': 1 / 3,
+                          'stargazers_count_by_age': 1 / 3,
+                          'forks_count_by_age': 1 / 3,
+                          'average_maintainability_index_for_repo': 0.51,
+                          'closed_issues_and_pr_over_two_year': 0.09,
+                          'closed_issues_and_pr_over_one_year': 0.09,
+                          'closed_issues_and_pr_over_six_months': 0.09,
+                          'closed_issues_and_pr_over_one_month': 0.12,
+                          'num_commits_by_age': 0.12,
+                          'average_cyclomatic_complexity_for_repo': 0.2,
+                          'style_errors_per_nloc': 0.2,
+                          'security_notes_per_nloc': 0.2,
+                          'security_warnings_per_nloc': 0.2,
+                          'security_errors_per_nloc': 0.2,
+                          'quality_score': 1 / 3,
+                          'maintainability_score': 1 / 3,
+                          'popularity_score': 1 / 3}
+
+_score_metrics = {'popularity_score': rank_repos._norm_popularity_metrics,
+                  'maintainability_score': ['average_maintainability_index_for_repo',
+                                            'closed_issues_and_pr_over_two_year',
+                                            'closed_issues_and_pr_over_one_year',
+                                            'closed_issues_and_pr_over_six_months',
+                                            'closed_issues_and_pr_over_one_month'] \
+                                           + rank_repos._norm_maintainability_metrics,
+                  'quality_score': ['average_cyclomatic_complexity_for_repo'] + rank_repos._norm_quality_metrics}
+
+# Percentages, along with license validity, are also stored as columns.
+_stored_metric_columns = [key + '_pct' for key in rank_repos._ranking_metrics] + ['is_valid_license']
+
+def parse_weight_profile(weight_arguments, weight_profile=None):
+  ''' Returns weight profile (default profile by default) overridden by arguments of the form <metric>=<weight>
+      or <score>=<weight> '''
+  weight_profile = dict(weight_profile or default_weight_profile)
+  for weight_argument in weight_arguments or []:
+    key, _, weight = weight_argument.partition('=')
+    if key not in default_weight_profile:
+      raise ValueError("Unknown metric or score in weight profile: " + key)
+    weight_profile[key] = float(weight)
+  return weight_profile
+
+def quote(name):
+  return '"' + name.replace('"', '""') + '"'
+
+def get_owner(repository_uri):
+  ''' Returns owner of repository from its URL, e.g., vectorclass for https://github.com/vectorclass/version2 '''
+  return repository_uri.rstrip('/').split('/')[-2]
+
+class MetricsStore(object):
+  ''' Phase-1 metrics of repositories, along with percentages of ranking metrics and scores of default weight
+      profile as computed by rank_repos.py, in a SQLite database. Repositories can then be ranked under other
+      weight profiles and filtered without reading CSV file again.
+      Besides a row per repository, every percentage is stored as a column (float64 array in order of
+      repositories, one BLOB per chunk of CSV file), so that scores of all repositories under another profile
+      are computed with a few numpy operations rather than by scanning rows. '''
+
+  # Number of host parameters per SQL query; SQLite's default limit is 999.
+  query_batch_size = 500
+
+  def __init__(self, db_file_name):
+    self.connection = sqlite3.connect(db_file_name, timeout=60)
+    self.connection.execute('PRAGMA journal_mode=WAL')
+    with self.connection:
+      self.connection.execute('CREATE TABLE IF NOT EXISTS weight_profiles ('
+                              'name TEXT PRIMARY KEY, weights TEXT NOT NULL)')
+
+  def load_csv_file(self, csv_file_name, chunk_size=100000):
+    ''' Replaces repositories in store by those of CSV file written by get_repo_metadata_in_batch.py. CSV
+        file is read in chunks of chunk_size repositories, so it does not need to fit in memory. '''
+    min_count, max_count = rank_repos.get_min_max_of_csv_file(csv_file_name, chunk_size)
+    with self.connection:
+      self.connection.execute('DROP TABLE IF EXISTS repositories')
+      self.connection.execute('DROP TABLE IF EXISTS metric_columns')
+      self.connection.execute('CREATE TABLE metric_columns (key TEXT NOT NULL, chunk INTEGER NOT NULL, '
+                              'values_of_chunk BLOB NOT NULL, PRIMARY KEY (key, chunk))')
+      num_repositories = 0
+      ranked_chunks = rank_repos.get_ranked_chunks_of_csv_file(csv_file_name, chunk_size, min_count, max_count)
+      for chunk, (columns, _) in enumerate(ranked_chunks):
+        keys = list(columns)
+        if chunk == 0:
+          # Columns have no type, so that values are read back as they were written: fields of CSV file as
+          # strings, and computed metrics as numbers.
+          self.connection.execute('CREATE TABLE repositories (position INTEGER PRIMARY KEY, owner TEXT, ' +
+                                  ', '.join(quote(key) for key in keys) + ')')
+        owners = [get_owner(repository_uri) for repository_uri in columns['repository_uri'].tolist()]
+        positions = range(num_repositories, num_repositories + len(owners))
+        self.connection.executemany('INSERT INTO repositories VALUES (' + ', '.join('?' * (len(keys) + 2)) + ')',
+                                    zip(positions, owners, *[columns[key].tolist() for key in keys]))
+        self.connection.executemany('INSERT INTO metric_columns VALUES (?, ?, ?)',
+                                    [(key, chunk, rank_repos.get_values(columns[key]).astype(float).tobytes())
+                                     for key in _stored_metric_columns])
+        num_repositories += len(owners)
+      self.connection.execute('CREATE INDEX repositories_by_owner ON repositories (owner COLLATE NOCASE)')
+      self.connection.execute('CREATE INDEX repositories_by_score ON repositories (overall_score DESC, position)')
+    return num_repositories
+
+  def get_keys(self):
+    ''' Returns keys of stored repositories, in order of CSV file followed by computed metrics and scores '''
+    keys = [row[1] for row in self.connection.execute('PRAGMA table_info(repositories)')]
+    if len(keys) == 0:
+      raise ValueError("No repositories in store; load a CSV file first")
+    return keys[2:]
+
+  def get_metric_column(self, key):
+    ''' Returns values of a stored metric of all repositories in order '''
+    rows = self.connection.execute('SELECT values_of_chunk FROM metric_columns WHERE key = ? ORDER BY chunk', [key])
+    return np.concatenate([np.empty(0)] + [np.frombuffer(values_of_chunk) for values_of_chunk, in rows])
+
+  def get_rows(self, output_keys, positions):
+    ''' Returns rows of repositories at positions (in the same order) having values of output_keys '''
+    rows_by_position = dict()
+    for i in range(0, len(positions), self.query_batch_size):
+      batch = positions[i : i + self.query_batch_size]
+      rows = self.connection.execute('SELECT position, ' + ', '.join(quote(key) for key in output_keys) +
+                                     ' FROM repositories WHERE position IN (' + ','.join('?' * len(batch)) + ')', batch)
+      for row in rows:
+        rows_by_position[row[0]] = list(row[1:])
+    return [rows_by_position[position] for position in positions]
+
+  def save_weight_profile(self, name, weight_profile):
+    if name == 'default':
+      raise ValueError("Default weight profile cannot be changed")
+    with self.connection:
+      self.connection.execute('INSERT OR REPLACE INTO weight_profiles VALUES (?, ?)', [name, json.dumps(weight_profile)])
+
+  def get_weight_profile(self, name):
+    if name == 'default':
+      return dict(default_weight_profile)
+    row = self.connection.execute('SELECT weights FROM weight_profiles WHERE name = ?', [name]).fetchone()
+    if row is None:
+      raise ValueError("Unknown weight profile: " + name)
+    return json.loads(row[0])
+
+  def get_weight_profile_names(self):
+    return ['default'] + [row[0] for row in self.connection.execute('SELECT name FROM weight_profiles ORDER BY name')]
+
+  def rank(self, weight_profile=None, owner=None, min_score=None, max_score=None, valid_license=None,
+           top_n=None, print_detailed=False):
+    ''' Returns output keys and rows of repositories ranked by overall score under weight_profile (default
+        profile by default), like those written by rank_repos.py. Only repositories of given owner, with
+        overall score in [min_score, max_score], and with(out) valid license are returned if asked. '''
+    output_keys = rank_repos.get_output_keys(self.get_keys(), print_detailed)
+    if weight_profile is None or weight_profile == default_weight_profile:
+      return output_keys, self.rank_by_default_profile(output_keys, owner, min_score, max_score, valid_license, top_n)
+
+    if owner is not None:
+      positions = np.array([position for position, in self.connection.execute(
+          'SELECT position FROM repositories WHERE owner = ? COLLATE NOCASE ORDER BY position', [owner])], dtype=int)
+    else:
+      positions = np.arange(self.connection.execute('SELECT COUNT(*) FROM repositories').fetchone()[0])
+    if valid_license is not None:
+      positions = positions[(self.get_metric_column('is_valid_license')[positions] == 1) == valid_license]
+
+    # Scores are computed and rounded as in rank_repos.py.
+    def get_weighted_sum(keys):
+      return sum(weight_profile[key] * self.get_metric_column(key + '_pct')[positions] for key in keys)
+    scores = {score: get_weighted_sum(metrics) for score, metrics in _score_metrics.items()}
+    scores['quality_score'] = 100 - scores['quality_score']
+    overall_score = rank_repos.round_values(sum(weight_profile[score] * values for score, values in scores.items()), 2)
+
+    is_selected = np.ones(len(positions), dtype=bool)
+    if min_score is not None:
+      is_selected &= overall_score >= min_score
+    if max_score is not None:
+      is_selected &= overall_score <= max_score
+    selected_order = np.flatnonzero(is_selected)
+    if top_n is not None and top_n < len(selected_order):
+      # Only repositories scoring at least as high as the top_n-th one need to be sorted.
+      min_top_score = np.partition(overall_score[selected_order], len(selected_order) - top_n)[len(selected_order) - top_n]
+      selected_order = selected_order[overall_score[selected_order] >= min_top_score]
+    # Stable sort keeps repositories with same score in input order.
+    ranked_order = selected_order[np.argsort(-overall_score[selected_order], kind='stable')][:top_n]
+
+    rows = self.get_rows(output_keys, positions[ranked_order].tolist())
+    scores = {score: rank_repos.round_values(values[ranked_order], 2) for score, values in scores.items()}
+    scores['overall_score'] = overall_score[ranked_order]
+    for score, values in scores.items():
+      index = output_keys.index(score)
+      for row, value in zip(rows, values.tolist()):
+        row[index] = value
+    return output_keys, rows
+
+  def rank_by_default_profile(self, output_keys, owner, min_score, max_score, valid_license, top_n):
+    ''' Returns rows of repositories ranked by stored scores of default profile, in order of index '''
+    conditions, parameters = [], []
+    if owner is not None:
+      conditions.append('owner = ? COLLATE NOCASE')
+      parameters.append(owner)
+    if valid_license is not None:
+      conditions.append('CAST(is_valid_license AS INTEGER) = ?')
+      parameters.append(1 if valid_license else 0)
+    if min_score is not None:
+      conditions.append('overall_score >= ?')
+      parameters.append(min_score)
+    if max_score is not None:
+      conditions.append('overall_score <= ?')
+      parameters.append(max_score)
+    parameters.append(-1 if top_n is None else top_n)
+    rows = self.connection.execute('SELECT ' + ', '.join(quote(key) for key in output_keys) + ' FROM repositories' +
+                                   (' WHERE ' + ' AND '.join(conditions) if len(conditions) > 0 else '') +
+                                   ' ORDER BY overall_score DESC, position LIMIT ?', parameters)
+    return [list(row) for row in rows]
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+      description = "Script to store repository metadata and rank repositories under weight profiles"
+      )
+  parser.add_argument("-s", "--store", required=True,
+                      help = "SQLite database storing repository metadata and weight profiles")
+  subparsers = parser.add_subparsers(dest="command", required=True)
+
+  load_parser = subparsers.add_parser("load", help = "Replace repositories in store by those of a csv file")
+  load_parser.add_argument("-c", "--csv_file", required=True,
+                           help = "Name of csv file, or metrics file (see src/metrics_file.py), containing "
+                                  "repository metadata")
+  load_parser.add_argument("--chunk-size", type=int, default=100000,
+                           help = "Number of repositories to read at a time (default: 100000)")
+
+  profile_parser = subparsers.add_parser("save-profile", help = "Save a named weight profile")
+  profile_parser.add_argument("name", help = "Name of weight profile")
+  profile_parser.add_argument("-w", "--weight", action='append', metavar="METRIC=WEIGHT", required=True,
+                              help = "Weight of a metric in its score, or of a score in overall score, "
+                                     "overriding default profile. May be repeated")
+
+  subparsers.add_parser("list-profiles", help = "Print weight profiles")
+
+  rank_parser = subparsers.add_parser("rank", help = "Rank stored repositories")
+  rank_parser.add_argument("-p", "--profile", default="default", help = "Name of weight profile (default: default)")
+  rank_parser.add_argument("-w", "--weight", action='append', metavar="METRIC=WEIGHT",
+                           help = "Weight of a metric or score overriding that of the profile. May be repeated")
+  rank_parser.add_argument("--owner", help = "Rank only repositories of this owner")
+  rank_parser.add_argument("--min-score", type=float, help = "Minimum overall score")
+  rank_parser.add_argument("--max-score", type=float, help = "Maximum overall score")
+  rank_parser.add_argument("--valid-license", dest="valid_license", action='store_true', default=None,
+                           help = "Rank only repositories with valid license")
+  rank_parser.add_argument("--no-valid-license", dest="valid_license", action='store_false',
+                           help = "Rank only repositories without valid license")
+  rank_parser.add_argument("-k", "--top-k", type=int, help = "Print only k repositories with highest score")
+  rank_parser.add_argument("-o", "--output_csv_file", help = "File to store list of ranked repositories "
+                                                             "(default: standard output)")
+  rank_parser.add_argument("-d", "--print_detailed", action='store_true', default=False)
+  args = parser.parse_args()
+
+  metrics_store = MetricsStore(args.store)
+  try:
+    if args.command == "load":
+      num_repositories = metrics_store.load_csv_file(args.csv_file, args.chunk_size)
+      print("Loaded", num_repositories, "repositories")
+    elif args.command == "save-profile":
+      metrics_store.save_weight_profile(args.name, parse_weight_profile(args.weight))
+    elif args.command == "list-profiles":
+      for name in metrics_store.get_weight_profile_names():
+        print(name, json.dumps(metrics_store.get_weight_profile(name)))
+    elif args.command == "rank":
+      weight_profile = parse_weight_profile(args.weight, metrics_store.get_weight_profile(args.profile))
+      output_keys, ranked_rows = metrics_store.rank(weight_profile, args.owner, args.min_score, args.max_score,
+                                                    args.valid_license, args.top_k, args.print_detailed)
+      output_csvfile = open(args.output_csv_file, 'w', newline='') if args.output_csv_file else sys.stdout
+      writer = csv.writer(output_csvfile)
+      writer.writerow(output_keys)
+      writer.writerows(ranked_rows)
+      if output_csvfile is not sys.stdout:
+        output_csvfile.close()
+  except ValueError as e:
+    sys.exit(str(e))
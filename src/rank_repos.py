@@ -22,9 +22,18 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import os
 import csv
 import sys
+import heapq
 import argparse
+import itertools
+import contextlib
+import tempfile
+
+import numpy as np
+
+import metrics_file
 
 _popularity_metrics = ['subscribers_count', 'stargazers_count', 'forks_count']
 _maintainability_metrics = ['num_commits']
@@ -36,143 +45,291 @@ _non_normalized_metrics = ['average_cyclomatic_complexity_for_repo', 'average_ma
 _norm_popularity_metrics = [x + '_by_age' for x in _popularity_metrics]
 _norm_maintainability_metrics = [x + '_by_age' for x in _maintainability_metrics]
 _norm_quality_metrics = [x + '_per_nloc' for x in _quality_metrics]
+_output_keys = ['repository_owner', 'repository_uri',
+                'overall_score', 'quality_score', 'maintainability_score', 'popularity_score'] \
+               + _norm_quality_metrics + _norm_popularity_metrics + ['average_cyclomatic_complexity_for_repo_pct']
+_ranking_metrics = _norm_popularity_metrics + _norm_quality_metrics + _norm_maintainability_metrics + _non_normalized_metrics
+# Fields that ranking is computed from
+_input_metrics = _popularity_metrics + _maintainability_metrics + ['repo_age_in_days'] + _norm_quality_metrics \
+                 + _non_normalized_metrics
+
+# Repositories are kept as columns: dictionary from field name to numpy array having one value per repository.
+# Fields read from CSV file are object arrays of strings, so that they are written out exactly as they were read.
+# Fields read from metrics file (see metrics_file.py) are typed arrays, along with error codes of failed metrics.
 
-def read_csv_file(csv_file_name, list_of_csv_rows):
-  ''' Reads CSV file containing repository metadata and returns list of CSV rows in order '''
+def get_columns(field_names, rows):
+  values_of_fields = zip(*rows) if rows else [[] for _ in field_names]
+  return {key: np.array(values, dtype=object) for key, values in zip(field_names, values_of_fields)}
+
+def read_csv_file(csv_file_name):
+  ''' Reads CSV file containing repository metadata and returns its field names and its columns '''
   with open(csv_file_name, newline='') as csvfile:
-    reader = csv.DictReader(csvfile)
-    for row in reader:
-      list_of_csv_rows.append(row)
-
-def normalize_repository_metrics(list_of_csv_rows):
-  def normalize_for_key(candidate_repo, out_key, in_key, dividend):
-    candidate_repo[out_key] = round(float(candidate_repo[in_key]) / dividend, 2)
-
-  def normalize_popularity_metrics(candidate_repo):
-    ''' Normalize popularity metrics by repository age '''
-    candidate_repo_age = float(candidate_repo['repo_age_in_days'])
-    for in_key in _popularity_metrics:
-      normalize_for_key(candidate_repo, in_key + '_by_age', in_key, candidate_repo_age)
-
-  def normalize_maintainability_metrics(candidate_repo):
-    ''' Normalize maintainability metrics by repository age '''
-    candidate_repo_age = float(candidate_repo['repo_age_in_days'])
-    for in_key in _maintainability_metrics:
-      normalize_for_key(candidate_repo, in_key + '_by_age', in_key, candidate_repo_age)
-
-  def normalize_quality_metrics(candidate_repo):
-    ''' Normalize quality metrics by number of lines of code '''
-    for in_key in _quality_metrics:
-      normalize_for_key(candidate_repo, in_key + '_per_nloc', in_key, candidate_repo_nloc)
-
-  for candidate_repo in list_of_csv_rows:
-    normalize_popularity_metrics(candidate_repo)
-    normalize_maintainability_metrics(candidate_repo)
-    #normalize_quality_metrics(candidate_repo)
-
-def rank_repositories_v2(list_of_csv_rows):
-  # Obtain min and max of popularity and quality metrics.
-  min_count = dict()
-  max_count = dict()
-  for key in _norm_popularity_metrics + _norm_quality_metrics + _norm_maintainability_metrics + _non_normalized_metrics:
-    # Initialize
-    min_count[key] = float(list_of_csv_rows[1][key])
-    max_count[key] = float(list_of_csv_rows[1][key])
-    for candidate_repo in list_of_csv_rows:
-      if float(candidate_repo[key]) < min_count[key]:
-        min_count[key] = float(candidate_repo[key])
-      if float(candidate_repo[key]) > max_count[key]:
-        max_count[key] = float(candidate_repo[key])
-
-  # Determine percentage of a candidate repo for a given metric using its min and max.
-  for key in _norm_popularity_metrics + _norm_quality_metrics + _norm_maintainability_metrics + _non_normalized_metrics:
-    for candidate_repo in list_of_csv_rows:
-      if float(max_count[key]) - float(min_count[key]) == 0:
-        candidate_repo[key + '_pct'] = 100
-      else:
-        candidate_repo[key + '_pct'] = round(((float(candidate_repo[key]) - min_count[key]) / (max_count[key] - min_count[key])) * 100, 2)
-
-  def get_popularity_score(candidate_repo):
+    reader = csv.reader(csvfile)
+    field_names = next(reader)
+    rows = [row for row in reader if row]
+  return field_names, get_columns(field_names, rows)
+
+def read_csv_file_in_chunks(csv_file_name, chunk_size):
+  ''' Reads CSV file containing repository metadata and yields its field names and columns of every chunk of
+      chunk_size rows in order '''
+  with open(csv_file_name, newline='') as csvfile:
+    reader = csv.reader(csvfile)
+    field_names = next(reader)
+    for rows in iter(lambda: list(itertools.islice(reader, chunk_size)), []):
+      yield field_names, get_columns(field_names, [row for row in rows if row])
+
+def read_repositories(file_name):
+  ''' Reads CSV file or metrics file containing repository metadata and returns its field names, its columns
+      and error codes of its fields (None for CSV file, whose errors are -1) '''
+  if metrics_file.is_metrics_file(file_name):
+    return metrics_file.read_metrics_file(file_name)
+  return read_csv_file(file_name) + (None,)
+
+def read_repositories_in_chunks(file_name, chunk_size):
+  ''' Reads CSV file or metrics file containing repository metadata and yields field names, columns and
+      error codes (see read_repositories()) of every chunk of chunk_size rows in order '''
+  if metrics_file.is_metrics_file(file_name):
+    yield from metrics_file.read_metrics_file_in_chunks(file_name, chunk_size)
+  else:
+    for field_names, columns in read_csv_file_in_chunks(file_name, chunk_size):
+      yield field_names, columns, None
+
+def get_values(column):
+  ''' Returns values of a column as floats; strings are parsed with float() '''
+  if column.dtype != object:
+    return column
+  return column.astype(float)
+
+def round_values(values, ndigits):
+  ''' Rounds every value as round() does. np.round() agrees with round() except for values close to halfway
+      between two roundings, where its scaling error may decide the direction; those are rounded by round(). '''
+  scale = 10 ** ndigits
+  scaled_values = values * scale
+  rounded_values = np.round(scaled_values) / scale
+  with np.errstate(invalid='ignore'):
+    is_close_to_halfway = ~(np.abs(scaled_values - np.floor(scaled_values) - 0.5) > 1e-9 * (np.abs(scaled_values) + 1))
+  for index in np.flatnonzero(is_close_to_halfway):
+    rounded_values[index] = round(float(values[index]), ndigits)
+  return rounded_values
+
+def drop_invalid_repositories(field_names, columns, print_dropped=True, errors=None):
+  ''' Drops repositories that have any field with value -1 (which indicates error), or, if error codes of
+      fields are given, any failed field. Missing fields (empty in CSV) only make a repository invalid if
+      ranking is computed from them. '''
+  is_invalid = np.zeros(len(columns[field_names[0]]), dtype=bool)
+  if errors is None:
+    for column in columns.values():
+      is_invalid |= (column == "-1")
+  else:
+    for key in field_names:
+      is_failed = (errors[key] != 0)
+      if key not in _input_metrics:
+        is_failed &= (errors[key] != metrics_file.error_codes['missing'])
+      is_invalid |= is_failed
+  for index in np.flatnonzero(is_invalid) if print_dropped else []:
+    # Failed fields are shown by name of their error.
+    print("Dropping:", {key: columns[key][index:index + 1].tolist()[0] if errors is None or errors[key][index] == 0
+                        else metrics_file.error_names[errors[key][index]] for key in field_names})
+  return {key: column[~is_invalid] for key, column in columns.items()}
+
+def normalize_repository_metrics(columns):
+  def normalize_for_key(out_key, in_key, dividend):
+    columns[out_key] = round_values(get_values(columns[in_key]) / dividend, 2)
+
+  # Fail on repositories of age 0 days, as float division does, rather than produce inf.
+  with np.errstate(divide='raise', invalid='raise'):
+    # Normalize popularity and maintainability metrics by repository age
+    repo_age = get_values(columns['repo_age_in_days'])
+    for in_key in _popularity_metrics + _maintainability_metrics:
+      normalize_for_key(in_key + '_by_age', in_key, repo_age)
+
+def get_min_max_of_metrics(columns, min_count=None, max_count=None):
+  ''' Returns min and max of every ranking metric over given repositories and, if given, earlier min and max '''
+  min_count = dict(min_count or {})
+  max_count = dict(max_count or {})
+  for key in _ranking_metrics:
+    values = get_values(columns[key])
+    if len(values) == 0:
+      continue
+    min_count[key] = min(min_count.get(key, values.min()), values.min())
+    max_count[key] = max(max_count.get(key, values.max()), values.max())
+  return min_count, max_count
+
+def rank_repositories_v2(columns, min_count=None, max_count=None):
+  ''' Scores repositories. Percentages of metrics are relative to given min and max of every metric, which
+      are those of given repositories by default. '''
+  if min_count is None:
+    min_count, max_count = get_min_max_of_metrics(columns)
+
+  # Determine percentage of a candidate repo for a given metric using min and max of the metric.
+  for key in _ranking_metrics:
+    values = get_values(columns[key])
+    if max_count[key] - min_count[key] == 0:
+      columns[key + '_pct'] = np.full(len(values), 100)
+    else:
+      columns[key + '_pct'] = round_values(((values - min_count[key]) / (max_count[key] - min_count[key])) * 100, 2)
+
+  def get_popularity_score():
     ''' Equal weight for all 3 '''
-    return (candidate_repo['subscribers_count_by_age' + '_pct'] \
-          + candidate_repo['stargazers_count_by_age' + '_pct'] \
-          + candidate_repo['forks_count_by_age' + '_pct']) / 3
+    return (columns['subscribers_count_by_age' + '_pct'] \
+          + columns['stargazers_count_by_age' + '_pct'] \
+          + columns['forks_count_by_age' + '_pct']) / 3
 
-  def get_maintainability_score(candidate_repo):
+  def get_maintainability_score():
     ''' Higher weight for maintainability_index, lower for older PRs/issues '''
-    return (0.51 * candidate_repo['average_maintainability_index_for_repo' + '_pct'] +
-            0.09 * candidate_repo['closed_issues_and_pr_over_two_year' + '_pct'] +
-            0.09 * candidate_repo['closed_issues_and_pr_over_one_year' + '_pct'] +
-            0.09 * candidate_repo['closed_issues_and_pr_over_six_months' + '_pct'] +
-            0.12 * candidate_repo['closed_issues_and_pr_over_one_month' + '_pct'] +
-            0.12 * candidate_repo['num_commits_by_age' + '_pct'])
-
-  def get_quality_score(candidate_repo):
+    return (0.51 * columns['average_maintainability_index_for_repo' + '_pct'] +
+            0.09 * columns['closed_issues_and_pr_over_two_year' + '_pct'] +
+            0.09 * columns['closed_issues_and_pr_over_one_year' + '_pct'] +
+            0.09 * columns['closed_issues_and_pr_over_six_months' + '_pct'] +
+            0.12 * columns['closed_issues_and_pr_over_one_month' + '_pct'] +
+            0.12 * columns['num_commits_by_age' + '_pct'])
+
+  def get_quality_score():
     # Since these metrics indicate issues in percent, we subtract from 100%.
-    return 100 - ((candidate_repo['average_cyclomatic_complexity_for_repo' + '_pct'] \
-          + candidate_repo['style_errors_per_nloc' + '_pct'] \
-          + candidate_repo['security_notes_per_nloc' + '_pct'] \
-          + candidate_repo['security_warnings_per_nloc' + '_pct'] \
-          + candidate_repo['security_errors_per_nloc' + '_pct']) / 5)
-
-  for candidate_repo in list_of_csv_rows:
-    quality_score = get_quality_score(candidate_repo)
-    maintainability_score = get_maintainability_score(candidate_repo)
-    popularity_score = get_popularity_score(candidate_repo)
-    # Avg of 3 scores.
-    overall_score_of_candidate_repo = round((quality_score + maintainability_score + popularity_score) / 3, 2)
-    candidate_repo['quality_score'] = round(quality_score, 2)
-    candidate_repo['maintainability_score'] = round(maintainability_score, 2)
-    candidate_repo['popularity_score'] = round(popularity_score, 2)
-    candidate_repo['overall_score'] = overall_score_of_candidate_repo
-    #print(candidate_repo)
-
-parser = argparse.ArgumentParser(
-    description = "Script to rank repositories using metadata"
-    )
-parser.add_argument("-c", "--csv_file", required=True,
-                    help="Name of csv file containing repository metadata")
-parser.add_argument("-o", "--output_csv_file", required=True,
-                    help="File to store list of ranked repositories")
-parser.add_argument("-d", "--print_detailed", required=False, action='store_true', default=False)
-args = parser.parse_args()
-
-list_of_csv_rows = []
-# Dictionary to store index of baseline repository for ranking purpose
-read_csv_file(args.csv_file, list_of_csv_rows)
-
-filtered_list_of_csv_rows = []
-# Drop CSV rows that contain any field having value -1 (which indicates error).
-for candidate_repo in list_of_csv_rows:
-  if "-1" in list(candidate_repo.values()):
-    print("Dropping:", candidate_repo)
-    continue
-  else:
-    filtered_list_of_csv_rows.append(candidate_repo)
+    return 100 - ((columns['average_cyclomatic_complexity_for_repo' + '_pct'] \
+          + columns['style_errors_per_nloc' + '_pct'] \
+          + columns['security_notes_per_nloc' + '_pct'] \
+          + columns['security_warnings_per_nloc' + '_pct'] \
+          + columns['security_errors_per_nloc' + '_pct']) / 5)
+
+  quality_score = get_quality_score()
+  maintainability_score = get_maintainability_score()
+  popularity_score = get_popularity_score()
+  columns['quality_score'] = round_values(quality_score, 2)
+  columns['maintainability_score'] = round_values(maintainability_score, 2)
+  columns['popularity_score'] = round_values(popularity_score, 2)
+  # Avg of 3 scores.
+  columns['overall_score'] = round_values((quality_score + maintainability_score + popularity_score) / 3, 2)
+
+def get_ranked_order(columns):
+  ''' Returns order of repositories by score in reverse order. Stable sort keeps repositories with same score in
+      input order. '''
+  return np.argsort(-columns['overall_score'], kind='stable')
+
+def get_output_keys(columns, print_detailed):
+  ''' Returns keys written for every repository; all keys of columns, in addition, if print_detailed '''
+  order_of_keys = list(_output_keys)
+  if print_detailed:
+    for key in columns:
+      if key not in order_of_keys:
+        order_of_keys.append(key)
+  return order_of_keys
+
+def get_output_rows(columns, order_of_keys, order):
+  return zip(*[columns[key][order].tolist() for key in order_of_keys])
 
-# Normalize repository metrics
-normalize_repository_metrics(filtered_list_of_csv_rows)
+def rank_csv_file(csv_file_name, writer):
+  ''' Ranks repositories of CSV file (or metrics file) in memory and writes ranked list to writer '''
+  field_names, columns, errors = read_repositories(csv_file_name)
 
-rank_repositories_v2(filtered_list_of_csv_rows)
+  # Drop repositories that contain any field having value -1 (which indicates error), or failed metrics.
+  columns = drop_invalid_repositories(field_names, columns, errors=errors)
 
-# Sort list by score in reverse order
-filtered_list_of_csv_rows.sort(key=lambda repo: repo['overall_score'], reverse=True)
+  # Normalize repository metrics
+  normalize_repository_metrics(columns)
 
-order_of_keys = ['repository_owner', 'repository_uri', 
-                 'overall_score', 'quality_score', 'maintainability_score', 'popularity_score'] \
-                + _norm_quality_metrics + _norm_popularity_metrics + ['average_cyclomatic_complexity_for_repo_pct']
+  rank_repositories_v2(columns)
 
-if args.print_detailed:
-  for key in list(filtered_list_of_csv_rows[0]):
-    if key not in order_of_keys:
-      order_of_keys.append(key)
+  ranked_order = get_ranked_order(columns)
+  if args.top_k:
+    ranked_order = ranked_order[:args.top_k]
 
-# Write ranked repository list to output csv
-with open(args.output_csv_file, 'w', newline='') as output_csvfile:
-  if args.print_detailed:
-    writer = csv.DictWriter(output_csvfile, fieldnames=order_of_keys)
+  order_of_keys = get_output_keys(columns, args.print_detailed)
+  writer.writerow(order_of_keys)
+  writer.writerows(get_output_rows(columns, order_of_keys, ranked_order))
+
+def get_min_max_of_csv_file(csv_file_name, chunk_size):
+  ''' First pass over CSV file: drops invalid repositories and obtains min and max of every ranking metric '''
+  min_count, max_count = dict(), dict()
+  for field_names, columns, errors in read_repositories_in_chunks(csv_file_name, chunk_size):
+    columns = drop_invalid_repositories(field_names, columns, errors=errors)
+    normalize_repository_metrics(columns)
+    min_count, max_count = get_min_max_of_metrics(columns, min_count, max_count)
+  if len(min_count) == 0:
+    sys.exit("No repositories to rank in " + csv_file_name)
+  return min_count, max_count
+
+def get_ranked_chunks_of_csv_file(csv_file_name, chunk_size, min_count, max_count):
+  ''' Second pass over CSV file: yields columns of every chunk of repositories, after ranking, and their order
+      by score '''
+  for field_names, columns, errors in read_repositories_in_chunks(csv_file_name, chunk_size):
+    columns = drop_invalid_repositories(field_names, columns, print_dropped=False, errors=errors)
+    normalize_repository_metrics(columns)
+    rank_repositories_v2(columns, min_count, max_count)
+    yield columns, get_ranked_order(columns)
+
+def write_top_k_repositories(ranked_chunks, k, writer):
+  ''' Writes k repositories with highest score to writer, keeping only k repositories in a heap '''
+  # Heap entries are (score, -position in input, row), so the last repository with lowest score is on top.
+  heap = []
+  num_repositories = 0
+  for columns, ranked_order in ranked_chunks:
+    order_of_keys = get_output_keys(columns, args.print_detailed)
+    ranked_order = ranked_order[:k]
+    scores = columns['overall_score'][ranked_order].tolist()
+    positions = (num_repositories + ranked_order).tolist()
+    for score, position, row in zip(scores, positions, get_output_rows(columns, order_of_keys, ranked_order)):
+      if len(heap) < k:
+        heapq.heappush(heap, (score, -position, row))
+      elif (score, -position) > heap[0][:2]:
+        heapq.heapreplace(heap, (score, -position, row))
+    num_repositories += len(columns['overall_score'])
+  writer.writerow(order_of_keys)
+  writer.writerows(row for _, _, row in sorted(heap, reverse=True))
+
+def write_merged_repositories(ranked_chunks, run_directory, writer):
+  ''' Writes every chunk of repositories, in order of score, to a run file in run_directory, and merges the
+      runs into writer '''
+  run_file_names = []
+  for columns, ranked_order in ranked_chunks:
+    order_of_keys = get_output_keys(columns, args.print_detailed)
+    run_file_name = os.path.join(run_directory, "run_" + str(len(run_file_names)) + ".csv")
+    with open(run_file_name, 'w', newline='') as run_file:
+      csv.writer(run_file).writerows(get_output_rows(columns, order_of_keys, ranked_order))
+    run_file_names.append(run_file_name)
+
+  # Scores are written with repr(), so they are read back exactly. heapq.merge() is stable: for the same
+  # score, repositories of earlier runs come first.
+  score_index = order_of_keys.index('overall_score')
+  writer.writerow(order_of_keys)
+  with contextlib.ExitStack() as stack:
+    runs = [csv.reader(stack.enter_context(open(run_file_name, newline=''))) for run_file_name in run_file_names]
+    writer.writerows(heapq.merge(*runs, key=lambda row: float(row[score_index]), reverse=True))
+
+def rank_csv_file_in_chunks(csv_file_name, chunk_size, writer):
+  ''' Ranks repositories of CSV file in two passes, reading chunk_size repositories at a time, and writes
+      ranked list to writer '''
+  min_count, max_count = get_min_max_of_csv_file(csv_file_name, chunk_size)
+  ranked_chunks = get_ranked_chunks_of_csv_file(csv_file_name, chunk_size, min_count, max_count)
+  if args.top_k:
+    write_top_k_repositories(ranked_chunks, args.top_k, writer)
   else:
-    writer = csv.DictWriter(output_csvfile, fieldnames=order_of_keys, extrasaction='ignore')
-  writer.writeheader()
-  for candidate_repo in filtered_list_of_csv_rows:
-    writer.writerow(candidate_repo)
+    # Runs are stored next to output file, since temporary directory may not have space for them.
+    output_directory = os.path.dirname(os.path.abspath(args.output_csv_file))
+    with tempfile.TemporaryDirectory(dir=output_directory) as run_directory:
+      write_merged_repositories(ranked_chunks, run_directory, writer)
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+      description = "Script to rank repositories using metadata"
+      )
+  parser.add_argument("-c", "--csv_file", required=True,
+                      help="Name of csv file, or metrics file (see src/metrics_file.py), containing " \
+                           "repository metadata")
+  parser.add_argument("-o", "--output_csv_file", required=True,
+                      help="File to store list of ranked repositories")
+  parser.add_argument("-d", "--print_detailed", required=False, action='store_true', default=False)
+  parser.add_argument("-k", "--top-k", required=False, type=int, default=0,
+                      help="Write only k repositories with highest score (default: all)")
+  parser.add_argument("--chunk-size", required=False, type=int, default=0,
+                      help="Rank in two passes over csv file, reading these many repositories at a time, " \
+                           "for files that do not fit in memory (default: read whole file)")
+  args = parser.parse_args()
+
+  # Write ranked repository list to output csv
+  with open(args.output_csv_file, 'w', newline='') as output_csvfile:
+    writer = csv.writer(output_csvfile)
+    if args.chunk_size > 0:
+      rank_csv_file_in_chunks(args.csv_file, args.chunk_size, writer)
+    else:
+      rank_csv_file(args.csv_file, writer)
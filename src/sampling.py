@@ -0,0 +1,92 @@
+#! /usr/bin/env python3
+
+# MIT License
+# 
+# Copyright (c) 2022 Niranjan Hasabnis
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import hashlib
+import math
+import os
+
+# Normal quantile for two-sided 95% confidence intervals
+z_95 = 1.96
+
+class StratifiedSample(object):
+  ''' Files of a repository split in strata by their top-level directory. Files of every stratum are in a
+      pseudo-random order fixed by seed, so a sample of any size takes a prefix of every stratum, and
+      growing the sample only adds files. The same file is at the same position for every analyzer and
+      every run, which keeps samples reusable by the analysis cache. '''
+
+  def __init__(self, file_names, repo_directory, seed=0):
+    self.strata = dict()
+    for file_name in file_names:
+      relative_name = os.path.relpath(file_name, repo_directory)
+      stratum = relative_name.split(os.sep)[0] if os.sep in relative_name else '.'
+      self.strata.setdefault(stratum, []).append(file_name)
+    for stratum, stratum_files in self.strata.items():
+      stratum_files.sort(key=lambda file_name: hashlib.sha1((str(seed) + ':' + os.path.relpath(file_name, repo_directory))
+                                                            .encode('utf-8', errors='surrogateescape')).digest())
+
+  def get_sample(self, fraction):
+    ''' Returns dictionary from stratum to its files in sample having about fraction of files of every
+        stratum (proportional allocation), and at least 2 files of every stratum so that its variance is
+        known '''
+    return {stratum: stratum_files[: min(len(stratum_files), max(2, math.ceil(len(stratum_files) * fraction)))]
+            for stratum, stratum_files in self.strata.items()}
+
+  def get_stratum_sizes(self):
+    return {stratum: len(stratum_files) for stratum, stratum_files in self.strata.items()}
+
+def get_variance(values):
+  ''' Sample variance '''
+  if len(values) < 2:
+    return 0
+  mean = sum(values) / len(values)
+  return sum((value - mean) ** 2 for value in values) / (len(values) - 1)
+
+def estimate_total(stratum_sizes, stratum_values):
+  ''' Returns stratified estimate of total of a value over all files, and variance of the estimate, from
+      values of sampled files of every stratum '''
+  total = 0
+  variance = 0
+  for stratum, values in stratum_values.items():
+    stratum_size = stratum_sizes[stratum]
+    if len(values) == 0:
+      continue
+    total += stratum_size * sum(values) / len(values)
+    # Finite population correction: a fully sampled stratum adds no uncertainty.
+    variance += stratum_size ** 2 * (1 - len(values) / stratum_size) * get_variance(values) / len(values)
+  return total, variance
+
+def estimate_ratio(stratum_sizes, stratum_numerators, stratum_denominators):
+  ''' Returns combined ratio estimate of (sum of numerators / sum of denominators) over all files, and half
+      width of its 95% confidence interval (by linearization), or (None, None) if denominator is 0 '''
+  numerator_total, _ = estimate_total(stratum_sizes, stratum_numerators)
+  denominator_total, _ = estimate_total(stratum_sizes, stratum_denominators)
+  if denominator_total == 0:
+    return None, None
+  ratio = numerator_total / denominator_total
+  residuals = {stratum: [numerator - ratio * denominator for numerator, denominator
+                         in zip(stratum_numerators[stratum], stratum_denominators[stratum])]
+               for stratum in stratum_numerators}
+  _, residual_variance = estimate_total(stratum_sizes, residuals)
+  return ratio, z_95 * math.sqrt(residual_variance) / abs(denominator_total)
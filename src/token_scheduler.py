@@ -0,0 +1,131 @@
+#! /usr/bin/env python3
+
+# MIT License
+# 
+# Copyright (c) 2022 Niranjan Hasabnis
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import sys
+import threading
+import time
+
+# Requests left unused on every token, so that perceval, which stops at 10 remaining requests, never
+# sees an exhausted token.
+default_reserve = 20
+# Once remaining budget of a token falls below this fraction of its limit, its requests are spread evenly
+# over the time left until its reset instead of being sent as fast as possible.
+pacing_threshold = 0.1
+
+def get_rate_limit_resource(url):
+  ''' Returns GitHub rate limit resource that request to url is charged to '''
+  if '/graphql' in url:
+    return 'graphql'
+  if '/search/' in url:
+    return 'search'
+  return 'core'
+
+class TokenScheduler(object):
+  ''' Assigns every GitHub request to the token with most rate limit headroom for its resource, based on
+      X-RateLimit-* headers of earlier responses. Budget state may live in a multiprocessing.Manager dict
+      (with a Manager lock), in which case the scheduler can be passed to, and shared by, worker processes. '''
+
+  def __init__(self, tokens, state=None, lock=None, reserve=default_reserve):
+    self.tokens = list(tokens)
+    self.state = state if state is not None else dict()
+    self.lock = lock if lock is not None else threading.Lock()
+    self.reserve = reserve
+
+  def get_budget(self, token_index, resource, now):
+    budget = self.state.get((token_index, resource),
+                            {'limit': None, 'remaining': None, 'reset_at': 0, 'next_at': 0, 'requests': 0, 'used': 0})
+    if budget['remaining'] is not None and now >= budget['reset_at']:
+      budget['remaining'] = budget['limit']
+    return budget
+
+  def has_headroom(self, budget):
+    return budget['remaining'] is None or budget['remaining'] > self.reserve
+
+  def acquire(self, resource):
+    ''' Returns token to send next request for resource with. Blocks while all tokens are down to their
+        reserve, and paces requests of a token whose budget runs low. A token that is paced or backed off is
+        only picked when no other token may send at once. '''
+    while True:
+      with self.lock:
+        now = time.time()
+        budgets = [self.get_budget(token_index, resource, now) for token_index in range(len(self.tokens))]
+        # Tokens never used yet have unknown, and presumably full, budget. Tokens above their reserve come
+        # first, and among those, tokens that may send now come before those being paced or backed off (the
+        # soonest ready first), so that a token with most remaining budget does not hold up requests.
+        token_index = max(range(len(self.tokens)),
+                          key=lambda i: (self.has_headroom(budgets[i]), -max(now, budgets[i]['next_at']),
+                                         float('inf') if budgets[i]['remaining'] is None else budgets[i]['remaining'],
+                                         -budgets[i]['requests']))
+        budget = budgets[token_index]
+        if self.has_headroom(budget):
+          send_at = max(now, budget['next_at'])
+          if budget['remaining'] is not None:
+            budget['remaining'] -= 1
+            if budget['remaining'] < budget['limit'] * pacing_threshold:
+              budget['next_at'] = send_at + (budget['reset_at'] - now) / max(1, budget['remaining'] - self.reserve)
+          budget['requests'] += 1
+          self.state[(token_index, resource)] = budget
+          break
+        wait_until = min(budget['reset_at'] for budget in budgets)
+      time.sleep(max(1, wait_until - now))
+    if send_at > now:
+      time.sleep(send_at - now)
+    return self.tokens[token_index]
+
+  def update(self, token, resource, headers):
+    ''' Records rate limit state of token from headers of a response to a request sent with it '''
+    if token not in self.tokens or 'X-RateLimit-Remaining' not in headers:
+      return
+    token_index = self.tokens.index(token)
+    resource = headers.get('X-RateLimit-Resource', resource)
+    remaining = int(headers['X-RateLimit-Remaining'])
+    reset_at = int(headers.get('X-RateLimit-Reset', 0))
+    with self.lock:
+      budget = self.get_budget(token_index, resource, time.time())
+      # Budget used is measured by drop in remaining requests within a rate limit window. Responses of
+      # concurrent requests arrive out of order, so only drops below lowest remaining seen count. First
+      # response seen in a window only tells that it cost (at least) one.
+      if budget.get('observed_remaining') is not None and budget['reset_at'] == reset_at:
+        budget['used'] += max(0, budget['observed_remaining'] - remaining)
+        budget['observed_remaining'] = min(budget['observed_remaining'], remaining)
+      else:
+        budget['used'] += 1
+        budget['observed_remaining'] = remaining
+      budget['limit'] = int(headers.get('X-RateLimit-Limit', remaining))
+      budget['remaining'] = remaining
+      budget['reset_at'] = reset_at
+      if 'Retry-After' in headers:
+        # Secondary rate limit: back off this token only.
+        budget['next_at'] = time.time() + int(headers['Retry-After'])
+      self.state[(token_index, resource)] = budget
+
+  def print_report(self, file=sys.stderr):
+    ''' Prints rate limit budget used by every token so far '''
+    with self.lock:
+      budgets = dict(self.state)
+    for (token_index, resource), budget in sorted(budgets.items()):
+      print('GitHub token ...' + self.tokens[token_index][-4:], resource + ':',
+            budget['requests'], 'requests,', budget['used'], 'rate limit points used,',
+            budget['remaining'], 'of', budget['limit'], 'remaining', file=file)
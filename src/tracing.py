@@ -0,0 +1,253 @@
+#! /usr/bin/env python3
+
+# MIT License
+# 
+# Copyright (c) 2022 Niranjan Hasabnis
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import argparse
+import contextlib
+import json
+import os
+import resource
+import sys
+import threading
+import time
+
+# File that trace records are appended to by every process, or None if tracing is disabled
+trace_file_name = None
+_trace_fd = None
+_trace_fd_pid = None
+# Spans being recorded by a thread, innermost last, and repository and stage that spans of a thread without
+# spans of its own belong to (set by in_context(), e.g., for threads of a pool running cpplint processes)
+_thread_state = threading.local()
+
+# Attributes of a record that are not summed up across records of a stage
+_record_fields = ['time', 'pid', 'repository', 'stage', 'wall_time', 'cpu_time', 'peak_rss_increase_mb',
+                  'process_peak_rss_mb', 'children_peak_rss_mb', 'error', 'sampled_fraction']
+
+def enable_tracing(file_name, truncate=False):
+  ''' Appends trace records of this process, and of processes forked from it afterwards, to file_name '''
+  global trace_file_name
+  trace_file_name = file_name
+  if truncate:
+    open(file_name, 'w').close()
+
+def is_enabled():
+  return trace_file_name is not None
+
+def get_cpu_time():
+  ''' Returns CPU time of this process and its terminated child processes (analyzer pools, cpplint, ...) '''
+  times = os.times()
+  return times.user + times.system + times.children_user + times.children_system
+
+def write_record(record):
+  ''' Appends record to trace file as a line of JSON. Every record is written with a single write to a file
+      opened for appending, so that records of concurrent processes do not interleave. '''
+  global _trace_fd, _trace_fd_pid
+  if _trace_fd is None or _trace_fd_pid != os.getpid():
+    _trace_fd = os.open(trace_file_name, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    _trace_fd_pid = os.getpid()
+  os.write(_trace_fd, (json.dumps(record) + '\n').encode('utf-8'))
+
+def get_spans():
+  if not hasattr(_thread_state, 'spans'):
+    _thread_state.spans = []
+  return _thread_state.spans
+
+def get_context():
+  ''' Returns repository and stage that a new span or event of this thread belongs to '''
+  spans = get_spans()
+  if len(spans) > 0:
+    return spans[-1].record['repository'], spans[-1].record['stage']
+  return getattr(_thread_state, 'context', (None, None))
+
+def in_context(fn):
+  ''' Returns fn wrapped so that spans and events it records belong to the current span of this thread,
+      whichever thread fn runs in. Threads of a pool do not otherwise know which span they work for. '''
+  context = get_context()
+  def run_in_context(*args, **kwargs):
+    previous_context = getattr(_thread_state, 'context', (None, None))
+    _thread_state.context = context
+    try:
+      return fn(*args, **kwargs)
+    finally:
+      _thread_state.context = previous_context
+  return run_in_context
+
+def get_peak_rss_mb(who):
+  # ru_maxrss is in KB on Linux.
+  return round(resource.getrusage(who).ru_maxrss / 1024, 1)
+
+class Span(object):
+  ''' Trace record of a stage. Attributes can be set, or counted up, while stage runs. '''
+
+  def __init__(self, record):
+    self.record = record
+
+  def set(self, **attributes):
+    self.record.update(attributes)
+
+  def add(self, **counts):
+    for key, count in counts.items():
+      self.record[key] = self.record.get(key, 0) + count
+
+@contextlib.contextmanager
+def span(stage, repository=None, **attributes):
+  ''' Records wall time, CPU time and memory of the code it wraps as a stage, along with given and later set
+      attributes. Stage is nested in stage of enclosing span of this thread, and belongs to its repository
+      unless repository is given. CPU time is that of the whole process (and its terminated children) during
+      the stage, so it includes that of stages running concurrently in other threads. Memory is the increase
+      of peak memory of the process during the stage, and peak memory of the process and of its largest
+      terminated child so far. '''
+  if trace_file_name is None:
+    yield Span(dict())
+    return
+  parent_repository, parent_stage = get_context()
+  record = {'time': round(time.time(), 3), 'pid': os.getpid(),
+            'repository': repository if repository is not None else parent_repository,
+            'stage': stage if parent_stage is None else parent_stage + '/' + stage}
+  record.update(attributes)
+  current_span = Span(record)
+  spans = get_spans()
+  spans.append(current_span)
+  start_time = time.time()
+  start_cpu_time = get_cpu_time()
+  start_peak_rss_mb = get_peak_rss_mb(resource.RUSAGE_SELF)
+  try:
+    yield current_span
+  except BaseException as err:
+    record['error'] = repr(err)
+    raise
+  finally:
+    record['wall_time'] = round(time.time() - start_time, 3)
+    record['cpu_time'] = round(get_cpu_time() - start_cpu_time, 3)
+    record['process_peak_rss_mb'] = get_peak_rss_mb(resource.RUSAGE_SELF)
+    record['peak_rss_increase_mb'] = round(record['process_peak_rss_mb'] - start_peak_rss_mb, 1)
+    record['children_peak_rss_mb'] = get_peak_rss_mb(resource.RUSAGE_CHILDREN)
+    spans.pop()
+    write_record(record)
+
+def record_event(stage, wall_time, **attributes):
+  ''' Records an event, such as an API request, of the current stage '''
+  if trace_file_name is None:
+    return
+  repository, parent_stage = get_context()
+  record = {'time': round(time.time() - wall_time, 3), 'pid': os.getpid(), 'repository': repository,
+            'stage': stage if parent_stage is None else parent_stage + '/' + stage, 'wall_time': round(wall_time, 3)}
+  record.update(attributes)
+  write_record(record)
+
+def add_to_current_span(**counts):
+  ''' Counts up attributes of innermost span of this thread, if any '''
+  spans = get_spans()
+  if len(spans) > 0:
+    spans[-1].add(**counts)
+
+def get_percentile(sorted_values, percentile):
+  ''' Returns percentile of sorted values by nearest-rank method '''
+  return sorted_values[max(0, -(-len(sorted_values) * percentile // 100) - 1)]
+
+def summarize_trace(trace_file_name):
+  ''' Returns summary of trace records in trace_file_name: for every stage, number of records, total,
+      median, 95th percentile and max wall time, total CPU time, max increase of peak memory of a process
+      during stage, max peak memory of a process (or terminated child) at end of stage, and sums of numeric
+      attributes; number of GitHub requests by resource and cache outcome; and total wall time of every
+      repository over its top-level stages '''
+  stages = dict()
+  github_requests = dict()
+  repositories = dict()
+  with open(trace_file_name) as trace_file:
+    for line in trace_file:
+      record = json.loads(line)
+      stage = stages.setdefault(record['stage'], {'wall_times': [], 'cpu_time': 0, 'peak_rss_increase_mb': 0,
+                                                  'process_peak_rss_mb': 0, 'errors': 0, 'totals': dict()})
+      stage['wall_times'].append(record['wall_time'])
+      stage['cpu_time'] += record.get('cpu_time', 0)
+      stage['peak_rss_increase_mb'] = max(stage['peak_rss_increase_mb'], record.get('peak_rss_increase_mb', 0))
+      stage['process_peak_rss_mb'] = max(stage['process_peak_rss_mb'], record.get('process_peak_rss_mb', 0),
+                                         record.get('children_peak_rss_mb', 0))
+      stage['errors'] += 'error' in record
+      for key, value in record.items():
+        if key not in _record_fields and isinstance(value, (int, float)) and not isinstance(value, bool):
+          stage['totals'][key] = stage['totals'].get(key, 0) + value
+      if record['stage'].endswith('github_request'):
+        request_key = record.get('resource', 'other') + ' ' + str(record.get('cache'))
+        github_requests[request_key] = github_requests.get(request_key, 0) + 1
+      if '/' not in record['stage'] and record['repository'] is not None:
+        repositories[record['repository']] = repositories.get(record['repository'], 0) + record['wall_time']
+
+  summary = {'stages': dict(), 'github_requests': github_requests,
+             'repositories': dict(sorted(repositories.items(), key=lambda item: item[1], reverse=True))}
+  for name, stage in sorted(stages.items()):
+    wall_times = sorted(stage['wall_times'])
+    summary['stages'][name] = {'count': len(wall_times), 'errors': stage['errors'],
+                               'wall_time': round(sum(wall_times), 3),
+                               'p50_wall_time': get_percentile(wall_times, 50),
+                               'p95_wall_time': get_percentile(wall_times, 95), 'max_wall_time': wall_times[-1],
+                               'cpu_time': round(stage['cpu_time'], 3),
+                               'peak_rss_increase_mb': stage['peak_rss_increase_mb'],
+                               'process_peak_rss_mb': stage['process_peak_rss_mb'],
+                               'totals': {key: round(value, 3) for key, value in stage['totals'].items()}}
+  return summary
+
+def print_summary(summary, file=sys.stderr, num_repositories=10):
+  ''' Prints summary of trace as returned by summarize_trace() '''
+  top_level_wall_time = sum(stage['wall_time'] for name, stage in summary['stages'].items() if '/' not in name)
+  # Peak MB+ is the largest increase of peak memory of a process during the stage; Process MB is the peak
+  # memory of a process (or of a terminated child process) at the end of the stage, which includes that of
+  # earlier stages.
+  print('%-48s %7s %6s %10s %6s %10s %8s %8s %8s %8s %10s' % ('Stage', 'Count', 'Errors', 'Wall (s)', '%', 'CPU (s)',
+                                                              'p50 (s)', 'p95 (s)', 'Max (s)', 'Peak MB+',
+                                                              'Process MB'), file=file)
+  for name, stage in summary['stages'].items():
+    share = '' if '/' in name or top_level_wall_time == 0 else '%.1f' % (100 * stage['wall_time'] / top_level_wall_time)
+    print('%-48s %7d %6d %10.1f %6s %10.1f %8.2f %8.2f %8.2f %8.1f %10.1f' % (
+        name, stage['count'], stage['errors'], stage['wall_time'], share, stage['cpu_time'], stage['p50_wall_time'],
+        stage['p95_wall_time'], stage['max_wall_time'], stage['peak_rss_increase_mb'], stage['process_peak_rss_mb']),
+        file=file)
+    if len(stage['totals']) > 0:
+      print('    ' + ', '.join(key + '=' + str(value) for key, value in sorted(stage['totals'].items())), file=file)
+  if len(summary['github_requests']) > 0:
+    print('GitHub requests by resource and cache outcome:', file=file)
+    for request_key, count in sorted(summary['github_requests'].items()):
+      print('    %-40s %7d' % (request_key, count), file=file)
+  if len(summary['repositories']) > 0:
+    print('Slowest repositories (wall time of their stages, in seconds):', file=file)
+    for repository, wall_time in list(summary['repositories'].items())[:num_repositories]:
+      print('    %-60s %10.1f' % (repository, wall_time), file=file)
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+      description = "Script to summarize trace written with --trace-file"
+      )
+  parser.add_argument("trace_file", help = "Trace file (JSON lines)")
+  parser.add_argument("-j", "--json", action='store_true', help = "Print summary as JSON")
+  parser.add_argument("-n", "--num-repositories", type=int, default=10,
+                      help = "Number of slowest repositories to print (default: 10)")
+  args = parser.parse_args()
+
+  summary = summarize_trace(args.trace_file)
+  if args.json:
+    json.dump(summary, sys.stdout, indent=2)
+    print()
+  else:
+    print_summary(summary, sys.stdout, args.num_repositories)
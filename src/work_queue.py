@@ -0,0 +1,170 @@
+#! /usr/bin/env python3
+
+# MIT License
+# 
+# Copyright (c) 2022 Niranjan Hasabnis
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import argparse
+import hashlib
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+
+def normalize_repo_url(repo_url):
+  ''' Returns URL by which repositories are identified across nodes and shards. GitHub URLs do not depend on
+      case or on a trailing slash. '''
+  return repo_url.strip().rstrip('/').lower()
+
+def remove_duplicate_repo_urls(repo_urls):
+  ''' Returns repo_urls without URLs of repositories listed before (see normalize_repo_url()) '''
+  seen = set()
+  unique_repo_urls = []
+  for repo_url in repo_urls:
+    if normalize_repo_url(repo_url) not in seen:
+      seen.add(normalize_repo_url(repo_url))
+      unique_repo_urls.append(repo_url)
+  return unique_repo_urls
+
+def get_shard(repo_url, num_shards):
+  ''' Returns shard (0 to num_shards - 1) of repository. Shard only depends on URL of repository, so every node
+      computes the same shards from any list holding it. '''
+  return int(hashlib.sha1(normalize_repo_url(repo_url).encode('utf-8')).hexdigest(), 16) % num_shards
+
+def parse_shard(shard):
+  ''' Returns shard index and number of shards from I/N '''
+  shard_index, _, num_shards = shard.partition('/')
+  shard_index, num_shards = int(shard_index), int(num_shards)
+  if not 0 <= shard_index < num_shards:
+    raise ValueError("Shard must be I/N with 0 <= I < N: " + shard)
+  return shard_index, num_shards
+
+def get_worker_id():
+  return socket.gethostname() + ':' + str(os.getpid())
+
+class SQLiteWorkQueue(object):
+  ''' Repositories to process, shared by batch runs on several nodes through a SQLite database on a shared
+      file system. A run leases repositories for lease_time seconds and marks them done or failed; those of a
+      run that died are leased again once their lease runs out. Repositories are keyed by normalized URL (see
+      normalize_repo_url()), as are shards and merged outputs, and leased by URL they were first added with. '''
+
+  def __init__(self, db_file_name):
+    # Connection is used by event loop and by threads that lease repositories for it.
+    self.connection = sqlite3.connect(db_file_name, timeout=60, check_same_thread=False)
+    self.lock = threading.Lock()
+    with self.lock, self.connection:
+      self.connection.execute('CREATE TABLE IF NOT EXISTS repositories ('
+                              'repository TEXT PRIMARY KEY, position INTEGER NOT NULL, '
+                              "status TEXT NOT NULL DEFAULT 'pending', worker TEXT, leased_until REAL, url TEXT)")
+      # Queues made before URLs were normalized have no url column, and rows keyed by URL as it was added.
+      columns = [column[1] for column in self.connection.execute('PRAGMA table_info(repositories)')]
+      if 'url' not in columns:
+        self.connection.execute('ALTER TABLE repositories ADD COLUMN url TEXT')
+      self.connection.execute('CREATE INDEX IF NOT EXISTS repositories_by_status ON repositories (status, position)')
+
+  def add_repositories(self, repo_urls):
+    ''' Adds repositories that are not in queue yet, to be leased after those already in it '''
+    repo_urls = remove_duplicate_repo_urls(repo_urls)
+    with self.lock, self.connection:
+      position = self.connection.execute('SELECT COALESCE(MAX(position), -1) + 1 FROM repositories').fetchone()[0]
+      self.connection.executemany('INSERT OR IGNORE INTO repositories (repository, position, url) VALUES (?, ?, ?)',
+                                  [(normalize_repo_url(repo_url), position + i, repo_url)
+                                   for i, repo_url in enumerate(repo_urls)])
+
+  def lease(self, worker, count, lease_time):
+    ''' Leases up to count pending repositories, or repositories whose lease ran out, to worker. Returns their
+        URLs, which are empty if no repositories are left to lease. '''
+    now = time.time()
+    with self.lock:
+      # Immediate transaction keeps runs on other nodes from leasing same repositories.
+      self.connection.execute('BEGIN IMMEDIATE')
+      try:
+        rows = self.connection.execute(
+            "SELECT repository, COALESCE(url, repository) FROM repositories "
+            "WHERE status = 'pending' OR (status = 'leased' AND leased_until < ?) ORDER BY position LIMIT ?",
+            [now, count]).fetchall()
+        self.connection.executemany("UPDATE repositories SET status = 'leased', worker = ?, leased_until = ? "
+                                    'WHERE repository = ?', [(worker, now + lease_time, key) for key, _ in rows])
+        self.connection.execute('COMMIT')
+      except BaseException:
+        self.connection.execute('ROLLBACK')
+        raise
+    return [repo_url for _, repo_url in rows]
+
+  def lease_repositories(self, worker, count, lease_time):
+    ''' Yields repositories leased count at a time until none are left '''
+    while True:
+      repo_urls = self.lease(worker, count, lease_time)
+      if len(repo_urls) == 0:
+        return
+      yield from repo_urls
+
+  def set_status(self, repo_url, status):
+    ''' Marks repository as done or failed '''
+    with self.lock, self.connection:
+      self.connection.execute('UPDATE repositories SET status = ?, leased_until = NULL WHERE repository = ?',
+                              [status, normalize_repo_url(repo_url)])
+
+  def retry_failed(self):
+    ''' Makes failed repositories pending again, and returns their number '''
+    with self.lock, self.connection:
+      return self.connection.execute("UPDATE repositories SET status = 'pending', worker = NULL "
+                                     "WHERE status = 'failed'").rowcount
+
+  def get_status_counts(self):
+    ''' Returns number of repositories by status, counting those whose lease ran out as expired '''
+    with self.lock:
+      return dict(self.connection.execute(
+          "SELECT CASE WHEN status = 'leased' AND leased_until < ? THEN 'expired' ELSE status END, COUNT(*) "
+          'FROM repositories GROUP BY 1 ORDER BY 1', [time.time()]))
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+      description = "Script to fill and inspect work queue shared by batch runs on several nodes"
+      )
+  parser.add_argument("-q", "--queue", required=True, help = "SQLite database of work queue")
+  subparsers = parser.add_subparsers(dest="command", required=True)
+  add_parser = subparsers.add_parser("add", help = "Add repositories to work queue")
+  add_parser.add_argument("-f", "--url-file", required=True, help = "File containing list of git URLs, one per line")
+  add_parser.add_argument("--shard", help = "Add only repositories of shard I (0-based) of N, given as I/N")
+  subparsers.add_parser("status", help = "Print number of repositories by status")
+  subparsers.add_parser("retry-failed", help = "Make failed repositories pending again")
+  args = parser.parse_args()
+
+  work_queue = SQLiteWorkQueue(args.queue)
+  if args.command == "add":
+    with open(args.url_file) as url_file:
+      repo_urls = [line.strip() for line in url_file if line.strip() != '']
+    if args.shard is not None:
+      try:
+        shard_index, num_shards = parse_shard(args.shard)
+      except ValueError as e:
+        sys.exit(str(e))
+      repo_urls = [repo_url for repo_url in repo_urls if get_shard(repo_url, num_shards) == shard_index]
+    work_queue.add_repositories(repo_urls)
+  elif args.command == "status":
+    for status, count in work_queue.get_status_counts().items():
+      print(status, count)
+  elif args.command == "retry-failed":
+    print('Made', work_queue.retry_failed(), 'failed repositories pending again')
@@ -0,0 +1,218 @@
+#! /usr/bin/env python3
+
+# MIT License
+# 
+# Copyright (c) 2022 Niranjan Hasabnis
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Tests of GraphQL collection of GitHub metadata against a local stub of the GraphQL API.
+# Run from top directory with: python3 -m unittest discover tests
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import unittest
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import github_graphql
+
+closed_issue_windows = [('closed_issues_and_pr_over_two_year', 365*2), ('closed_issues_and_pr_over_one_month', 30)]
+
+def get_repository_data(stargazers=10, commits=50, parent=None):
+  return {'stargazerCount': stargazers, 'forkCount': 3, 'createdAt': '2020-01-01T00:00:00Z',
+          'watchers': {'totalCount': 4}, 'openIssues': {'totalCount': 5}, 'openPullRequests': {'totalCount': 2},
+          'parent': parent, 'defaultBranchRef': {'target': {'history': {'totalCount': commits}}}}
+
+def get_fork_chain(urls, root_is_fork=False):
+  ''' Returns parent data of a fork whose parent is urls[0], whose parent is urls[1], and so on. Parent of
+      last one is not in data, as it is not queried, if root_is_fork. '''
+  parent = {'url': urls[-1], 'isFork': root_is_fork}
+  if not root_is_fork:
+    parent['parent'] = None
+  for url in reversed(urls[:-1]):
+    parent = {'url': url, 'isFork': True, 'parent': parent}
+  return parent
+
+class GraphQLStubHandler(BaseHTTPRequestHandler):
+  ''' Answers every POST with response of server, and records queries it was sent '''
+
+  def do_POST(self):
+    request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+    self.server.queries.append(request['query'])
+    time.sleep(self.server.delay)
+    body = json.dumps(self.server.response).encode('utf-8')
+    self.send_response(self.server.status)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, *args):
+    pass
+
+class GraphQLTestCase(unittest.TestCase):
+
+  def setUp(self):
+    self.server = ThreadingHTTPServer(('127.0.0.1', 0), GraphQLStubHandler)
+    self.server.queries = []
+    self.server.response = {'data': dict()}
+    self.server.status = 200
+    self.server.delay = 0
+    self.server.daemon_threads = True
+    threading.Thread(target=self.server.serve_forever, daemon=True).start()
+    self.graphql_url = 'http://127.0.0.1:%d/graphql' % self.server.server_address[1]
+
+  def tearDown(self):
+    self.server.shutdown()
+    self.server.server_close()
+
+  def set_response(self, repositories, window_counts, errors=None):
+    ''' Makes server answer with given data of repository i (None if it could not be fetched) and counts of
+        its closed issues and PRs in every window (None for a window that could not be fetched) '''
+    data = {'rateLimit': {'cost': 1, 'remaining': 4999, 'resetAt': '2030-01-01T00:00:00Z'}}
+    for i, (repository_data, counts) in enumerate(zip(repositories, window_counts)):
+      data['r%d' % i] = repository_data
+      for j, count in enumerate(counts):
+        data['r%d_w%d' % (i, j)] = None if count is None else {'issueCount': count}
+    self.server.response = {'data': data}
+    if errors is not None:
+      self.server.response['errors'] = errors
+
+  def fetch(self, repo_urls):
+    return github_graphql.fetch_repositories_metadata(repo_urls, 'token', closed_issue_windows,
+                                                      graphql_url=self.graphql_url)
+
+class MakeBatchQueryTest(unittest.TestCase):
+
+  def test_aliases_of_repositories_and_windows(self):
+    query = github_graphql.make_batch_query(['https://github.com/a/b', 'https://github.com/c/d'],
+                                            closed_issue_windows, datetime(2024, 3, 31))
+    self.assertIn('r0: repository(owner: "a", name: "b")', query)
+    self.assertIn('r1: repository(owner: "c", name: "d")', query)
+    self.assertIn('r0_w0: search(query: "repo:a/b is:closed updated:>=2022-04-01T00:00:00Z", type: ISSUE)', query)
+    self.assertIn('r1_w1: search(query: "repo:c/d is:closed updated:>=2024-03-01T00:00:00Z", type: ISSUE)', query)
+    self.assertIn('rateLimit', query)
+
+  def test_parents_are_queried_up_to_max_fork_depth(self):
+    query = github_graphql.make_batch_query(['https://github.com/a/b'], closed_issue_windows, datetime(2024, 3, 31))
+    self.assertEqual(query.count('parent {'), github_graphql.max_fork_depth)
+
+class FetchRepositoriesMetadataTest(GraphQLTestCase):
+
+  def test_metadata_as_reported_by_rest(self):
+    self.set_response([get_repository_data()], [[7, 1]])
+    repositories_metadata, rate_limit = self.fetch(['https://github.com/a/b'])
+    metadata, upstream_url = repositories_metadata['https://github.com/a/b']
+    self.assertEqual(metadata['stargazers_count'], 10)
+    self.assertEqual(metadata['subscribers_count'], 4)
+    self.assertEqual(metadata['open_issues'], 7)
+    # Counts are those of REST collector: one less commit, and 0 for a count of 1.
+    self.assertEqual(metadata['num_commits'], 49)
+    self.assertEqual(metadata['closed_issues_and_pr_over_two_year'], 7)
+    self.assertEqual(metadata['closed_issues_and_pr_over_one_month'], 0)
+    self.assertIsNone(upstream_url)
+    self.assertEqual(rate_limit['cost'], 1)
+
+  def test_windows_start_at_day_boundary(self):
+    self.set_response([get_repository_data()], [[7, 1]])
+    self.fetch(['https://github.com/a/b'])
+    self.assertRegex(self.server.queries[0], r'updated:>=[0-9-]+T00:00:00Z')
+
+  def test_partial_errors_leave_out_failed_repositories(self):
+    # Repository 1 does not exist, and window of repository 2 could not be searched.
+    self.set_response([get_repository_data(), None, get_repository_data()], [[7, 1], [None, None], [3, None]],
+                      errors=[{'type': 'NOT_FOUND', 'path': ['r1'], 'message': 'Could not resolve to a Repository'},
+                              {'path': ['r2_w1'], 'message': 'Something went wrong'}])
+    repositories_metadata, _ = self.fetch(['https://github.com/a/b', 'https://github.com/c/d',
+                                           'https://github.com/e/f'])
+    self.assertEqual(list(repositories_metadata), ['https://github.com/a/b'])
+
+  def test_repository_without_commits_is_left_out(self):
+    repository_data = get_repository_data()
+    repository_data['defaultBranchRef'] = None
+    self.set_response([repository_data], [[7, 1]])
+    self.assertEqual(self.fetch(['https://github.com/a/b'])[0], dict())
+
+  def test_upstream_is_root_of_fork_network(self):
+    parent = get_fork_chain(['https://github.com/p/fork', 'https://github.com/root/repo'])
+    self.set_response([get_repository_data(parent=parent)], [[7, 1]])
+    _, upstream_url = self.fetch(['https://github.com/a/b'])[0]['https://github.com/a/b']
+    self.assertEqual(upstream_url, 'https://github.com/root/repo')
+
+  def test_fork_deeper_than_query_is_left_out(self):
+    # Deepest parent queried is a fork itself, so root is not known.
+    parent = get_fork_chain(['https://github.com/p%d/fork' % i for i in range(github_graphql.max_fork_depth)],
+                            root_is_fork=True)
+    self.set_response([get_repository_data(parent=parent)], [[7, 1]])
+    self.assertEqual(self.fetch(['https://github.com/a/b'])[0], dict())
+
+  def test_hung_request_times_out(self):
+    self.server.delay = 1
+    with mock.patch.object(github_graphql, 'request_timeout', 0.2):
+      with self.assertRaises(requests.Timeout):
+        self.fetch(['https://github.com/a/b'])
+
+class RestFallbackTest(GraphQLTestCase):
+  ''' Repositories whose GraphQL metadata could not be fetched fall back to REST API '''
+
+  def test_failed_batch_yields_no_metadata(self):
+    import get_repo_metadata_in_batch as batch
+    self.server.status = 502
+    self.server.response = {'message': 'Bad Gateway'}
+    batch.args = argparse.Namespace(token=['token'], github_graphql_url=self.graphql_url, debug=False)
+    self.assertEqual(list(batch.fetch_github_metadata_in_batches(['https://github.com/a/b', 'https://github.com/c/d'],
+                                                                 batch_size=1)),
+                     [('https://github.com/a/b', None), ('https://github.com/c/d', None)])
+
+  def test_batch_yields_metadata_of_fetched_repositories_only(self):
+    import get_repo_metadata_in_batch as batch
+    self.set_response([get_repository_data(), None], [[7, 1, 1, 1], [None, None, None, None]],
+                      errors=[{'type': 'NOT_FOUND', 'path': ['r1'], 'message': 'Could not resolve to a Repository'}])
+    batch.args = argparse.Namespace(token=['token'], github_graphql_url=self.graphql_url, debug=False)
+    items = dict(batch.fetch_github_metadata_in_batches(['https://github.com/a/b', 'https://github.com/c/d'],
+                                                        batch_size=2))
+    self.assertIsNotNone(items['https://github.com/a/b'])
+    self.assertIsNone(items['https://github.com/c/d'])
+
+  def test_repository_left_out_by_graphql_is_fetched_by_rest(self):
+    import get_metadata_of_single_repo as single_repo
+    self.set_response([None], [[None, None]],
+                      errors=[{'type': 'NOT_FOUND', 'path': ['r0'], 'message': 'Could not resolve to a Repository'}])
+    single_repo.args = argparse.Namespace(github_api='graphql', github_graphql_url=self.graphql_url)
+    with mock.patch.object(single_repo, 'configure_github_clients'), \
+         mock.patch.object(single_repo, 'report_github_metadata', return_value='https://github.com/root/repo') \
+         as report_github_metadata:
+      metadata, upstream_url = single_repo.get_github_metadata('https://github.com/a/b', ['token'])
+    report_github_metadata.assert_called_once_with(owner='a', repository='b', token=['token'])
+    self.assertEqual(metadata['repository_uri'], 'https://github.com/a/b')
+    self.assertEqual(upstream_url, 'https://github.com/root/repo')
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,84 @@
+#! /usr/bin/env python3
+
+# MIT License
+# 
+# Copyright (c) 2022 Niranjan Hasabnis
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Tests of work queue shared by batch runs on several nodes.
+# Run from top directory with: python3 -m unittest discover tests
+
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from work_queue import SQLiteWorkQueue, get_shard, remove_duplicate_repo_urls
+
+class SQLiteWorkQueueTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.TemporaryDirectory()
+    self.queue_file_name = os.path.join(self.directory.name, 'queue.db')
+
+  def tearDown(self):
+    self.directory.cleanup()
+
+  def test_urls_of_same_repository_are_queued_once(self):
+    queue = SQLiteWorkQueue(self.queue_file_name)
+    queue.add_repositories(['https://github.com/A/B', 'https://github.com/c/d'])
+    queue.add_repositories(['https://github.com/a/b/', 'https://github.com/C/D/'])
+    self.assertEqual(queue.lease('worker', 10, 60), ['https://github.com/A/B', 'https://github.com/c/d'])
+    self.assertEqual(queue.lease('worker', 10, 60), [])
+
+  def test_status_is_set_by_any_url_of_repository(self):
+    queue = SQLiteWorkQueue(self.queue_file_name)
+    queue.add_repositories(['https://github.com/A/B'])
+    queue.lease('worker', 10, 60)
+    queue.set_status('https://github.com/a/b/', 'done')
+    self.assertEqual(queue.get_status_counts(), {'done': 1})
+
+  def test_queue_without_url_column_is_upgraded(self):
+    connection = sqlite3.connect(self.queue_file_name)
+    connection.execute('CREATE TABLE repositories (repository TEXT PRIMARY KEY, position INTEGER NOT NULL, '
+                       "status TEXT NOT NULL DEFAULT 'pending', worker TEXT, leased_until REAL)")
+    connection.execute("INSERT INTO repositories (repository, position) VALUES ('https://github.com/x/y', 0)")
+    connection.commit()
+    connection.close()
+    queue = SQLiteWorkQueue(self.queue_file_name)
+    queue.add_repositories(['https://github.com/A/B'])
+    self.assertEqual(queue.lease('worker', 10, 60), ['https://github.com/x/y', 'https://github.com/A/B'])
+
+class RemoveDuplicateRepoUrlsTest(unittest.TestCase):
+
+  def test_first_url_of_repository_is_kept(self):
+    self.assertEqual(remove_duplicate_repo_urls(['https://github.com/A/B', 'https://github.com/c/d',
+                                                 'https://github.com/a/b/']),
+                     ['https://github.com/A/B', 'https://github.com/c/d'])
+
+  def test_urls_of_same_repository_have_same_shard(self):
+    self.assertEqual(get_shard('https://github.com/A/B', 7), get_shard('https://github.com/a/b/', 7))
+
+if __name__ == '__main__':
+  unittest.main()